@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Measure how fast periscope classifies the video names of a library.
+
+The names of a corpus, one per line, are parsed by trying every pattern in
+turn, then with parse_many and its prefilter, and the names per second of
+both are reported. Any name classified differently is printed. The corpus
+defaults to the sample next to this script, a listing of a real library
+works too:
+
+    find /media/videos -type f > listing.txt
+    python benchmarks/parsing.py --corpus listing.txt [--count 100000]
+
+The corpus is repeated up to count names, each copy with a different show
+or movie name so that the duplicates are not free.
+"""
+
+import os
+import gc
+import sys
+import time
+import string
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from periscope import parser
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "filenames.txt")
+
+
+def load(path, count):
+    """ Return count distinct names made from the lines of a corpus. """
+    with open(path) as corpus:
+        lines = [line.strip() for line in corpus if line.strip()]
+    names = []
+    copy = 0
+    while len(names) < count:
+        # Letters only, digits would change the patterns that match
+        suffix = ""
+        number = copy
+        while number:
+            number, letter = divmod(number, 26)
+            suffix += string.ascii_lowercase[letter]
+        for line in lines[:count - len(names)]:
+            folder, name = os.path.split(line)
+            names.append(os.path.join(folder, suffix + name))
+        copy += 1
+    return names
+
+
+def every_pattern(names):
+    """ Parse the names the way guess_file_data used to. """
+    return [parser._parse(parser.file_key(name)) for name in names]
+
+
+def measure(function, names):
+    """ Return the result and the seconds of function(names). """
+    # As timeit does, the collections would blur the results
+    gc.disable()
+    try:
+        start = time.time()
+        result = function(names)
+        return result, time.time() - start
+    finally:
+        gc.enable()
+
+
+def main():
+    """ Run the benchmark and print its results. """
+    option_parser = OptionParser("usage: %prog [options]")
+    option_parser.add_option("-c", "--corpus", dest="corpus", default=CORPUS,
+                             help="file with one name per line (%default)")
+    option_parser.add_option("-n", "--count", type="int", dest="count",
+                             default=100000,
+                             help="number of names to parse (%default)")
+    options = option_parser.parse_args()[0]
+    names = load(options.corpus, options.count)
+    expected = every_pattern(names)
+    kinds = {}
+    for name, result in zip(names, expected):
+        kinds.setdefault(result.type, []).append(name)
+    print "{:<10}{:>10}{:>18}{:>16}{:>10}".format(
+        "names", "count", "every pattern/s", "parse_many/s", "speedup")
+    for kind, group in sorted(kinds.items()) + [("all", names)]:
+        old, before = measure(every_pattern, group)
+        new, after = measure(parser.parse_many, group)
+        for name, old_result, new_result in zip(group, old, new):
+            if old_result != new_result:
+                print "Mismatch for {}: {} != {}".format(name, old_result,
+                                                         new_result)
+        print "{:<10}{:>10}{:>18.0f}{:>16.0f}{:>9.1f}x".format(
+            kind, len(group), len(group) / before, len(group) / after,
+            before / after)
+
+
+if __name__ == "__main__":
+    main()
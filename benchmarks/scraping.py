@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Compare the extraction of periscope.markup with BeautifulSoup 3.
+
+Each scenario reads a page the way a plugin does: with a BeautifulSoup
+tree of the whole page, then with extract and each backend available.
+The median time of each is reported, and the scenarios whose results
+differ are flagged. The pages are saved pages named after the scenarios
+when --pages is given (save them from a browser), generated pages of the
+same shape otherwise:
+
+    python benchmarks/scraping.py [--pages saved/] [--runs 20]
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from BeautifulSoup import BeautifulSoup
+
+from periscope import markup
+
+# The parts of a site page around the results, repeated to a usual size
+BOILERPLATE_HEAD = """<html><head><title>Subtitles</title>
+<meta http-equiv="Content-Type" content="text/html; charset=utf-8">
+<link rel="stylesheet" href="/style.css">
+<script type="text/javascript">
+var menu = document.getElementById("menu");
+for (var i = 0; i < 10 && menu; i++) { menu.innerHTML += "<li>" + i; }
+</script></head><body><div id="header"><ul class="menu">
+""" + "".join('<li class="item"><a href="/show/{0}">Show number {0}</a>'
+              '</li>\n'.format(number) for number in range(150)) + """
+</ul></div><div id="content">
+"""
+BOILERPLATE_FOOT = """</div><div id="sidebar">
+""" + "".join('<div class="news"><h3>News {0}</h3><p>Some text about the '
+              'show {0}, with <b>bold</b> and <i>italic</i> words.</p>'
+              '</div>\n'.format(number) for number in range(60)) + """
+</div><div id="footer"><p>Copyright</p></div></body></html>"""
+
+ADDIC7ED_VERSION = """<table class="tabel95"><tr><td class="NewsTitle"
+colspan="3"><img src="/images/folder_page.png" />
+Version {0}, 0.00 MBs</td></tr>
+<tr><td class="language">English</td><td><strong>Completed</strong></td>
+<td><a href="/original/{0}/1">original</a> <a href="/updated/{0}/1">most
+updated</a></td></tr>
+<tr><td class="language">French</td><td><strong>42% Completed</strong></td>
+<td><a href="/original/{0}/8">original</a></td></tr></table>
+"""
+SUBSCENE_RESULT = """<tr><td class="a1"><a class="a1" href="/subtitle/{0}">
+<span class="l r neutral-icon">English</span>
+<span>The.Show.S01E02.{0}.HDTV</span></a></td><td class="a3">9</td></tr>
+"""
+TVSUBTITLES_EPISODE = """<tr bgcolor="#ffffff"><td>1x{0:02d}</td>
+<td><a href="episode-{0}.html"><b>Episode {0}</b></a></td><td>3/3</td>
+<td><a href="subtitle-{0}-en.html"><img src="images/flags/en.gif" alt="en"
+width="18" height="12"></a><a href="subtitle-{0}-fr.html"><img
+src="images/flags/fr.gif" alt="fr" width="18" height="12"></a></td></tr>
+"""
+PODNAPISI_ROW = """<tr class="{1}"><td><a href="/en/show-{0}"><img
+src="/images/flags/{2}.gif" /></a><a href="/en/subtitle-{0}">The Show</a>
+<span class="opis">Season: <b>1</b> Episode: <b>{0}</b></span></td>
+<td>Release.{0}</td></tr>
+"""
+
+
+def addic7ed(roots):
+    """ Read the versions of an episode as Addic7ed does. """
+    found = []
+    for root in roots:
+        for title in root("td", {"class": "NewsTitle", "colspan": "3"}):
+            language = title.findNext("td", {"class": "language"})
+            status = language.findNext("td")
+            links = status.findNext("td").findAll("a")
+            found.append((language.contents[0].strip(),
+                          status.find("strong").string, links[-1]["href"]))
+    return found
+
+
+def subscene(links):
+    """ Read the search results as SubScene does. """
+    found = []
+    for link in links:
+        language = link.find("span")
+        release = language.findNext("span")
+        found.append((language.contents[0].strip(),
+                      release.contents[0].strip(), link["href"]))
+    return found
+
+
+def tvsubtitles(roots):
+    """ Read the languages of an episode as TvSubtitles does. """
+    found = []
+    for root in roots:
+        if isinstance(root, markup.Element):
+            cells = root.findText("1x07")
+        else:
+            cells = [text.parent for text in root.findAll(text="1x07")]
+        for cell in cells:
+            for image in cell.parent.findAll("td")[3].findAll("img"):
+                found.append((image["alt"], image.parent["href"]))
+    return found
+
+
+def podnapisi(roots):
+    """ Read the search results as Podnapisi does. """
+    found = []
+    for row in roots:
+        details = row.find("span", {"class": "opis"}).findAll("b")
+        found.append((details[0].text, details[1].text,
+                      row.findAll("a")[1]["href"]))
+    return found
+
+
+# name: (generated body, the extract targets, nested, read function, the
+# function returning the roots of read from a soup)
+SCENARIOS = {
+    "addic7ed": ("".join(ADDIC7ED_VERSION.format(team) for team in
+                         ("LOL", "DIMENSION", "720P", "KILLERS", "FQM", "2HD",
+                          "ASAP", "IMMERSE")),
+                 ["table"], False, addic7ed, lambda soup: [soup]),
+    "subscene": ("<table>" + "".join(SUBSCENE_RESULT.format(number)
+                                     for number in range(60)) + "</table>",
+                 [("a", {"class": "a1"})], True, subscene,
+                 lambda soup: soup("a", {"class": "a1"})),
+    "tvsubtitles": ("<table>" + "".join(TVSUBTITLES_EPISODE.format(number)
+                                        for number in range(1, 24)) +
+                    "</table>", ["table"], False, tvsubtitles,
+                    lambda soup: [soup]),
+    "podnapisi": ("<table>" + "".join(PODNAPISI_ROW.format(
+        number, "ab"[number % 2], ("en", "fr", "sl")[number % 3])
+        for number in range(1, 40)) + "</table>",
+                  [("tr", {"class": "a"}), ("tr", {"class": "b"})], True,
+                  podnapisi, lambda soup: soup("tr", {"class": "a"}) +
+                  soup("tr", {"class": "b"})),
+}
+
+
+def page(name, pages):
+    """ Return the saved page of a scenario, or a generated one. """
+    if pages:
+        path = os.path.join(pages, name + ".html")
+        if os.path.exists(path):
+            with open(path) as saved:
+                return saved.read()
+    return BOILERPLATE_HEAD + SCENARIOS[name][0] + BOILERPLATE_FOOT
+
+
+def median_time(function, runs):
+    """ Return the result and the median seconds of runs calls. """
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return result, sorted(times)[len(times) // 2]
+
+
+def normalized(results):
+    """ Return results with only unicode strings, to compare them.
+
+    They are sorted, the soup of Podnapisi lists the rows by class.
+    """
+    return sorted(tuple(unicode(value) for value in result)
+                  for result in results)
+
+
+def main():
+    """ Run the scenarios and print their results. """
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("-p", "--pages", dest="pages",
+                      help="folder of saved pages named <scenario>.html")
+    parser.add_option("-n", "--runs", type="int", dest="runs", default=20,
+                      help="number of runs of each scenario (%default)")
+    options = parser.parse_args()[0]
+    backends = ["htmlparser"] + (["lxml"] if markup.lxml else [])
+    print "{:<14}{:>8}{:>16}".format("scenario", "kB", "BeautifulSoup") + \
+        "".join("{:>14}".format(backend) for backend in backends)
+    for name in sorted(SCENARIOS):
+        _, targets, nested, read, soup_roots = SCENARIOS[name]
+        content = page(name, options.pages)
+        expected, reference = median_time(
+            lambda: read(soup_roots(BeautifulSoup(content))), options.runs)
+        line = "{:<14}{:>8}{:>13.1f} ms".format(name, len(content) // 1024,
+                                                reference * 1000)
+        for backend in backends:
+            result, seconds = median_time(
+                lambda: read(markup.extract(content, *targets, nested=nested,
+                                            backend=backend)), options.runs)
+            line += "{:>11.1f} ms".format(seconds * 1000)
+            if normalized(result) != normalized(expected):
+                line += " (differs)"
+        print line
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Measure the cold start time and resident memory of periscope.
+
+Each scenario runs in a fresh interpreter, several times, and the median
+wall time and the peak resident memory are reported:
+
+    python benchmarks/startup.py [--runs 10]
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code run by the child interpreter, it prints its time and peak memory
+CHILD = """
+import sys, time, json, resource
+start = time.time()
+sys.path.insert(0, {root!r})
+{code}
+print json.dumps([time.time() - start,
+                  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss])
+"""
+
+SCENARIOS = [
+    ("import periscope", "import periscope"),
+    ("Periscope()", "import periscope\n"
+                    "client = periscope.Periscope({cache!r})\n"
+                    "client.close()"),
+    ("list the plugins", "import periscope\n"
+                         "for spec in periscope.Periscope."
+                         "list_existing_plugins():\n"
+                         "    spec.capabilities"),
+    ("import every plugin", "import periscope\n"
+                            "for spec in periscope.Periscope."
+                            "list_existing_plugins():\n"
+                            "    spec.load()"),
+]
+
+
+def run(code, cache):
+    """ Run code in a new interpreter, return its time and memory. """
+    child = CHILD.format(root=ROOT, code=code.format(cache=cache))
+    output = subprocess.check_output([sys.executable, "-c", child],
+                                     stderr=open(os.devnull, "w"))
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    """ Run the scenarios and print their results. """
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option("-n", "--runs", type="int", dest="runs", default=10,
+                      help="number of runs of each scenario (%default)")
+    options = parser.parse_args()[0]
+    cache = tempfile.mkdtemp()
+    try:
+        print "{:<22}{:>12}{:>14}".format("scenario", "median ms",
+                                          "peak RSS kB")
+        for name, code in SCENARIOS:
+            results = [run(code, cache) for _ in range(options.runs)]
+            times = sorted(result[0] for result in results)
+            print "{:<22}{:>12.1f}{:>14}".format(
+                name, times[len(times) // 2] * 1000,
+                max(result[1] for result in results))
+    finally:
+        shutil.rmtree(cache)
+
+
+if __name__ == "__main__":
+    main()
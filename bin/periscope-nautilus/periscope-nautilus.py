@@ -18,19 +18,17 @@
 #    along with periscope; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-from gi.repository import Gtk, Gio, GObject, Nautilus
-from multiprocessing import Process, Queue
-from Queue import Empty
-from time import sleep
-# import urllib2
+from gi.repository import Gtk, Gio, GLib, GObject, Nautilus
+from multiprocessing import Process, Pipe
+import itertools
+import threading
 import os
 import gettext
-# import logging
 import xdg.BaseDirectory as bd # required
 try:
     from gi.repository import Notify
 except ImportError:
-    pass
+    Notify = None
 
 import periscope
 
@@ -39,11 +37,21 @@ gettext.install('periscope-nautilus')
 
 class DownloadSubtitles(GObject.GObject, Nautilus.MenuProvider):
     ''' This class is to be used in Nautilus with the python-nautilus extension. 
-    It provides a context menu on video file to download subtitles.'''
+    It provides a context menu on video file to download subtitles.
+
+    The subtitles are downloaded by a single PeriscopeWorker process, started
+    at the first click and kept for the next ones. Its answers come back on a
+    pipe watched by the GLib main loop, so Nautilus is never blocked and each
+    subtitle is notified as soon as it is downloaded.'''
     def __init__(self):
         if Notify:
             Notify.init("periscope subtitles downloader")
         self.cache_folder = os.path.join(bd.xdg_config_home, "periscope")
+        self.worker = None
+        self.conn = None
+        self.batch_ids = itertools.count()
+        # Batch id -> [filenames, found, notfound]
+        self.batches = {}
 
     def get_file_items(self, window, files):
         # Keep only the files we want (right type and file)
@@ -64,39 +72,96 @@ class DownloadSubtitles(GObject.GObject, Nautilus.MenuProvider):
         # Get the file paths from gvfs so we support non local file systems, yay!
         g = Gio.Vfs.get_default()
         videos = map(lambda f: g.get_file_for_uri(f.get_uri()).get_path(), videos)
+        if not videos:
+            return
 
-        # Download the subtitles in a new process and get the results in this process via a Queue
-        queue = Queue()
-        invoker = PeriscopeInvoker(videos, self.cache_folder, queue)
-        invoker.start()
-        result = []
-        while not result:
-            try:
-                result = queue.get_nowait()
-            except Empty:
-                pass
-            finally:
-                Gtk.main_iteration_do(False) # a blocking version with timeout would have been nice
-                sleep(0.01)
-        [found, notfound] = result
-        self.notify(found, notfound)
-        invoker.join()
+        # Hand the files to the worker, the results come back in on_message
+        self.start_worker()
+        batch = next(self.batch_ids)
+        self.batches[batch] = [videos, [], []]
+        self.conn.send(("download", batch, videos))
+
+    def start_worker(self):
+        ''' Start the worker process unless it is already running'''
+        if self.worker is not None and self.worker.is_alive():
+            return
+        parent_conn, child_conn = Pipe()
+        self.worker = PeriscopeWorker(child_conn, parent_conn, self.cache_folder)
+        self.worker.start()
+        child_conn.close() # only the worker writes on this end
+        self.conn = parent_conn
+        GLib.io_add_watch(parent_conn.fileno(), GLib.PRIORITY_DEFAULT,
+                          GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                          self.on_message, parent_conn)
+
+    def on_message(self, fd, condition, conn):
+        ''' Handle the messages of the worker, called by the GLib main loop'''
+        try:
+            while conn.poll():
+                message = conn.recv()
+                if message[0] == "done":
+                    self.file_done(*message[1:])
+                elif message[0] == "finished":
+                    self.batch_done(message[1])
+        except (EOFError, IOError):
+            condition = GLib.IO_HUP
+        if condition & (GLib.IO_HUP | GLib.IO_ERR):
+            # The worker died, report what it did not process
+            conn.close()
+            if conn is self.conn:
+                self.worker = self.conn = None
+                for batch in self.batches.keys():
+                    self.batch_done(batch)
+            return False # remove the watch
+        return True
+
+    def file_done(self, batch, filename, subtitle):
+        ''' Record and notify the outcome of a file'''
+        if batch not in self.batches:
+            return
+        if subtitle:
+            self.batches[batch][1].append(subtitle)
+        else:
+            self.batches[batch][2].append({"filename": filename})
+        self.notify_file(filename, subtitle)
+
+    def batch_done(self, batch):
+        ''' Sum up a batch of several files once it is complete'''
+        filenames, found, notfound = self.batches.pop(batch)
+        reported = set(f["filename"] for f in found + notfound)
+        notfound += [{"filename": f} for f in filenames if f not in reported]
+        if len(filenames) > 1 or len(reported) < len(filenames):
+            self.notify(found, notfound)
 
     def is_valid(self, f):
         return f.get_mime_type() in periscope.SUPPORTED_FORMATS and (f.get_uri_scheme() == 'file' or f.get_uri_scheme() == 'smb')
 
+    def notify_file(self, filename, subtitle):
+        ''' Use Notify to warn the user that a file has been processed'''
+        if Notify:
+            if subtitle:
+                title = _("Subtitle found")
+                msg = os.path.basename(filename) + " (" + subtitle['lang'] + ")"
+            else:
+                title = _("No subtitle found")
+                msg = os.path.basename(filename)
+            n = Notify.Notification.new(title, msg, Gtk.STOCK_FIND_AND_REPLACE)
+            n.set_timeout(Notify.EXPIRES_DEFAULT)
+            n.show()
+
     def notify(self, found, notfound):
         ''' Use Notify to warn the user that subtitles have been downloaded'''
         if Notify:
             title = "periscope found %s out of %s subtitles" %(len(found), len(found) + len(notfound))
+            msg = ""
             if len(notfound) > 0:
-                msg = _("Could not find: \n")
+                msg += _("Could not find: \n")
                 filenames = [os.path.basename(f["filename"]) for f in notfound]
                 msg += "\n".join(filenames)
                 msg += "\n"
 
             if len(found) > 0:
-                msg = _("Found: \n")
+                msg += _("Found: \n")
                 filenames = [os.path.basename(f["filename"]) + " ("+f['lang']+")" for f in found]
                 msg += "\n".join(filenames)
 
@@ -106,25 +171,51 @@ class DownloadSubtitles(GObject.GObject, Nautilus.MenuProvider):
         else:
             pass
 
-class PeriscopeInvoker(Process):
-    ''' Thread that will call persicope in the background'''
-    def __init__(self, filenames, cache_folder, queue):
-        self.filenames = filenames
-        self.found = []
-        self.notfound = []
-        self.cache_folder = cache_folder
-        self.queue = queue
+class PeriscopeWorker(Process):
+    ''' Process that will call periscope in the background.
+    It lives as long as Nautilus and keeps the same Periscope, so the plugins,
+    connections and caches stay warm from a click to the next. Each batch of
+    files is downloaded in its own thread, and every file is reported on the
+    pipe as soon as it is done.'''
+    def __init__(self, conn, parent_conn, cache_folder):
         Process.__init__(self)
+        self.daemon = True # dies with Nautilus
+        self.conn = conn
+        self.parent_conn = parent_conn
+        self.cache_folder = cache_folder
 
     def run(self):
-        subdl = periscope.Periscope(self.cache_folder)
-        print "prefered languages: %s" %subdl.preferedLanguages
-        for filename in self.filenames:
-            subtitle = subdl.downloadSubtitle(filename, subdl.preferedLanguages)
+        self.parent_conn.close() # so that recv fails once Nautilus is gone
+        self.lock = threading.Lock()
+        self.subdl = periscope.Periscope(self.cache_folder)
+        print "prefered languages: %s" %self.subdl.prefered_languages
+        try:
+            while True:
+                try:
+                    message = self.conn.recv()
+                except (EOFError, IOError):
+                    break
+                if message[0] == "download":
+                    thread = threading.Thread(target=self.download, args=message[1:])
+                    thread.daemon = True
+                    thread.start()
+        finally:
+            self.subdl.close()
+
+    def download(self, batch, filenames):
+        def done(filename, subtitle):
             if subtitle:
-                del subtitle["plugin"] # multiprocessing Queue won't be able to pickle this and will bark
-                self.found.append(subtitle)
-            else:
-                self.notfound.append({"filename": filename })
-        self.queue.put([self.found, self.notfound])
-        self.queue.close() # we won't have anything more to transmit to the parent process
+                subtitle = dict(subtitle)
+                del subtitle["plugin"] # the pipe won't be able to pickle this and will bark
+            self.send(("done", batch, filename, subtitle))
+        try:
+            self.subdl.download_many(filenames, self.subdl.prefered_languages, callback=done)
+        finally:
+            self.send(("finished", batch))
+
+    def send(self, message):
+        with self.lock: # the batches run in parallel
+            try:
+                self.conn.send(message)
+            except IOError:
+                pass # Nautilus is gone
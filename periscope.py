@@ -18,36 +18,92 @@
 #    along with periscope; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 import os
-import mimetypes
+import socket
 from optparse import OptionParser
 import logging
 logging.basicConfig(level=logging.DEBUG)
 
 from periscope.periscope import Periscope
+from periscope.daemon import PeriscopeDaemon, DaemonClient, DaemonUnavailable
+from periscope.pool import DEFAULT_JOBS
+from periscope.walker import LibraryWalker
+from periscope.watcher import LibraryWatcher
 from periscope import VERSION
 
 LOG = logging.getLogger(__name__)
 
-SUPPORTED_FORMATS = ('video/x-msvideo',
-                     'video/quicktime',
-                     'video/x-matroska',
-                     'video/mp4')
+
+def get_langs(periscope_client, options):
+    """ Return the wanted languages, from the options or the config. """
+    if not options.langs:  # Look into the config file
+        LOG.info(" No lang given, looking into config file")
+        return periscope_client.prefered_languages
+    return options.langs
 
 
 def download_subtitle(periscope_client, videos, options):
-    """ Dowload only the best subtitle for the file. """
-    subs = []
-    for arg in videos:
-        if not options.langs:  # Look into the config file
-            LOG.info(" No lang given, looking into config file")
-            langs = periscope_client.prefered_languages
+    """ Dowload only the best subtitle for each file. """
+    langs = get_langs(periscope_client, options)
+    subs = periscope_client.download_many(videos, langs, jobs=options.jobs,
+                                          deadline=options.deadline,
+                                          satisfice=options.satisfice,
+                                          speculate=options.speculate)
+    report(subs, videos.found, videos.skipped, videos.unchanged)
+
+
+def forward_to_daemon(command, args, options):
+    """ Have the running daemon download the subtitles.
+
+    DaemonUnavailable is raised when no daemon runs.
+    """
+    client = DaemonClient(options.cache_folder)
+    answers = client.request(command,
+                             paths=[os.path.abspath(arg) for arg in args],
+                             langs=options.langs,
+                             force=bool(options.force_download),
+                             exclude=options.excludes,
+                             incremental=bool(options.incremental),
+                             jobs=options.jobs, deadline=options.deadline,
+                             satisfice=bool(options.satisfice),
+                             speculate=options.speculate)
+    for answer in answers:
+        if answer["event"] == "done":
+            subtitle = answer["subtitle"]
+            LOG.info(" {}: {}".format(answer["filename"],
+                                      subtitle["subtitlepath"] if subtitle
+                                      else "no subtitle"))
+        elif answer["event"] == "finished":
+            report(answer["subtitles"], answer["found"], answer["skipped"],
+                   answer["unchanged"])
+            return
         else:
-            langs = options.langs
-        sub = periscope_client.download_subtitle(arg, langs)
-        if sub:
-            subs.append(sub)
+            LOG.error("The daemon failed: {}".format(answer.get("message")))
+            exit(1)
+    LOG.error("The daemon stopped before the end of the request.")
+    exit(1)
+
+
+def run_daemon(cache_folder):
+    """ Serve the requests of the CLI until ctrl+c or --stop-daemon. """
+    periscope_client = Periscope(cache_folder)
+    try:
+        daemon = PeriscopeDaemon(periscope_client)
+    except (RuntimeError, socket.error), err:
+        LOG.error("Could not start the daemon: {}".format(err))
+        periscope_client.close()
+        exit(1)
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        LOG.info(" Daemon stopped")
 
-    if len(subs) == 0 and len(videos) > 0:
+
+def report(subs, found, skipped, unchanged):
+    """ Log the downloaded subtitles, exit with 1 if none was. """
+    LOG.info(" {} videos need a subtitle, {} already have one, {} did not "
+             "change since the last run".format(found, skipped, unchanged))
+
+    if len(subs) == 0 and found > 0:
         exit(1)
     else:
         LOG.info("*" * 50)
@@ -57,6 +113,25 @@ def download_subtitle(periscope_client, videos, options):
             LOG.info("*" * 50)
 
 
+def watch_libraries(periscope_client, roots, options):
+    """ Download the subtitles of the videos added to roots until ctrl+c. """
+    watcher = LibraryWatcher(roots, force=options.force_download,
+                             exclude=options.excludes)
+    watcher.start()
+    LOG.info(" Watching {}, press ctrl+c to stop".format(", ".join(roots)))
+    try:
+        periscope_client.download_many(watcher,
+                                       get_langs(periscope_client, options),
+                                       jobs=options.jobs,
+                                       deadline=options.deadline,
+                                       satisfice=options.satisfice,
+                                       speculate=options.speculate)
+    except KeyboardInterrupt:
+        LOG.info(" Stopped watching")
+    finally:
+        watcher.stop()
+
+
 def main():
     """ Download subtitles. """
     # parse command line options
@@ -76,6 +151,49 @@ def main():
                             "already one present"))
     parser.add_option("-q", "--query", action="append", dest="queries",
                       help="query to send to the subtitles website")
+    parser.add_option("--incremental", action="store_true",
+                      dest="incremental",
+                      help=("only process the new or changed files and the "
+                            "ones whose retry time passed, according to the "
+                            "library index of the cache folder"))
+    parser.add_option("--process-retries", action="store_true",
+                      dest="process_retries",
+                      help=("search again the files with no subtitle yet "
+                            "whose retry time passed (1h, 6h, 1d then 3d "
+                            "after each unsuccessful search)"))
+    parser.add_option("--watch", action="store_true", dest="watch",
+                      help=("watch the given folders, or the libraries of "
+                            "the config file, and download the subtitles of "
+                            "the new videos as they are added"))
+    parser.add_option("-x", "--exclude", action="append", dest="excludes",
+                      help=("glob pattern of the files and folders to skip "
+                            "(like *sample* or /media/tmp/*), can be used "
+                            "multiple times"))
+    parser.add_option("-j", "--jobs", action="store", type="int",
+                      dest="jobs", default=DEFAULT_JOBS,
+                      help=("number of searches and downloads to run at the "
+                            "same time across all the files (default is "
+                            "%default)"))
+    parser.add_option("--deadline", action="store", type="float",
+                      dest="deadline",
+                      help=("give up on the sites that did not answer after "
+                            "this number of seconds for a file"))
+    parser.add_option("--satisfice", action="store_true", dest="satisfice",
+                      help=("do not wait for the other sites once a subtitle "
+                            "in the first wanted language is found"))
+    parser.add_option("--daemon", action="store_true", dest="daemon",
+                      help=("keep periscope running in the background, the "
+                            "next commands are sent to it through a socket "
+                            "of the cache folder"))
+    parser.add_option("--stop-daemon", action="store_true",
+                      dest="stop_daemon", help="stop the running daemon")
+    parser.add_option("--no-daemon", action="store_true", dest="no_daemon",
+                      help="do not send the command to the running daemon")
+    parser.add_option("--speculate", action="store", type="int",
+                      dest="speculate", default=1,
+                      help=("fetch this number of the best subtitles of a "
+                            "file at once and keep the first valid one, "
+                            "instead of trying them one after the other"))
     parser.add_option("--cache-folder", action="store", type="string",
                       dest="cache_folder",
                       help=("location of the periscope cache/config folder "
@@ -86,7 +204,16 @@ def main():
     parser.add_option("--list-active-plugins", action="store_true",
                       dest="show_active_plugins",
                       help=("list all plugins used to search subtitles "
-                            "(a subset of all the supported plugins)"))
+                            "(a subset of all the supported plugins) with "
+                            "their recent health"))
+    parser.add_option("--activate-plugin", action="append",
+                      dest="activated_plugins",
+                      help=("add a plugin to the ones used to search "
+                            "subtitles, saved in the config file"))
+    parser.add_option("--deactivate-plugin", action="append",
+                      dest="deactivated_plugins",
+                      help=("remove a plugin from the ones used to search "
+                            "subtitles, saved in the config file"))
     parser.add_option("--quiet", action="store_true", dest="quiet",
                       help=("run in quiet mode (only show warn and error "
                             "messages)"))
@@ -116,20 +243,84 @@ def main():
                 exit()
             options.cache_folder = os.path.join(home, ".config", "periscope")
 
+    if options.daemon:
+        run_daemon(options.cache_folder)
+        exit()
+
+    if options.stop_daemon:
+        try:
+            LOG.info(" Stopped the daemon {}".format(
+                DaemonClient(options.cache_folder).stop()))
+        except DaemonUnavailable:
+            LOG.error("No daemon is running.")
+            exit(1)
+        exit()
+
+    forwardable = not (options.no_daemon or options.queries or
+                       options.watch or options.show_plugins or
+                       options.show_active_plugins or
+                       options.activated_plugins or
+                       options.deactivated_plugins)
+    if forwardable and (args or options.process_retries):
+        command = "process-retries" if options.process_retries \
+            else "download"
+        try:
+            forward_to_daemon(command, args, options)
+            exit()
+        except DaemonUnavailable:
+            LOG.debug(" No daemon running, processing the files here")
+
     periscope_client = Periscope(options.cache_folder)
 
+    if options.activated_plugins or options.deactivated_plugins:
+        for name in options.activated_plugins or []:
+            try:
+                periscope_client.activate_plugin(name)
+            except ImportError, err:
+                LOG.error(str(err))
+                exit(1)
+        for name in options.deactivated_plugins or []:
+            periscope_client.deactivate_plugin(name)
+        if not args:
+            options.show_active_plugins = True
+
     if options.show_active_plugins:
         print "Active plugins: "
         plugins = periscope_client.list_active_plugins()
         for plugin in plugins:
-            print "- " + plugin.__name__
+            print "- {}: {}".format(plugin.__name__,
+                                    periscope_client.plugin_health(plugin))
         exit()
 
     if options.show_plugins:
         print "All plugins: "
         plugins = periscope_client.list_existing_plugins()
         for plugin in plugins:
-            print "- " + plugin.__name__
+            print "- {} ({})".format(plugin.__name__,
+                                     ", ".join(sorted(plugin.capabilities)))
+        exit()
+
+    if options.watch:
+        roots = args or periscope_client.library_roots
+        if not roots:
+            LOG.error("No folder to watch given or set in the config file.")
+            exit(1)
+        try:
+            watch_libraries(periscope_client, roots, options)
+        finally:
+            periscope_client.close()
+        exit()
+
+    if options.process_retries:
+        due = periscope_client.library.due()
+        LOG.info(" {} files are due for a retry".format(len(due)))
+        try:
+            download_subtitle(periscope_client,
+                              LibraryWalker(due,
+                                            force=options.force_download),
+                              options)
+        finally:
+            periscope_client.close()
         exit()
 
     if options.queries:
@@ -140,43 +331,17 @@ def main():
         print parser.print_help()
         exit()
 
-    videos = []
-    for arg in args:
-        videos += recursive_search(arg, options)
-
-    download_subtitle(periscope_client, videos, options)
-
-
-def recursive_search(entry, options):
-    """ Searche files in the dir. """
-    files = []
-    if os.path.isdir(entry):
-        # TODO if hidden folder, don't keep going
-        # (how to handle windows/mac/linux ?)
-        for ent in os.listdir(entry):
-            files += recursive_search(os.path.join(entry, ent), options)
-
-    elif os.path.isfile(entry):
-        # Add mkv mimetype to the list
-        mimetypes.add_type("video/x-matroska", ".mkv")
-        mimetype = mimetypes.guess_type(entry)[0]
-        if mimetype in SUPPORTED_FORMATS:
-            # Add it to the list only if there is not already one (or forced)
-            basepath = os.path.splitext(entry)[0]
-            if (options.force_download or not
-                (os.path.exists(basepath + '.srt') or
-                 os.path.exists(basepath + '.sub'))):
-                files.append(os.path.normpath(entry))
-            else:
-                LOG.info(("Skipping file {} as it already has a subtitle. "
-                          "Use the --force option to force the download").
-                format(entry))
-        else:
-            LOG.warn(("{} mimetype is '{}' which is not a supported"
-                      " video format ({})").format(entry,
-                                                   mimetype,
-                                                   SUPPORTED_FORMATS))
-    return files
+    is_due = None
+    if options.incremental:
+        is_due = periscope_client.library.is_due
+    videos = LibraryWalker(args, force=options.force_download,
+                           exclude=options.excludes, is_due=is_due)
+
+    try:
+        download_subtitle(periscope_client, videos, options)
+    finally:
+        periscope_client.close()
+
 
 if __name__ == "__main__":
     main()
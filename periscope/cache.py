@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+""" On disk cache of the search results of the plugins. """
+
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+from periscope.fingerprint import fingerprint
+
+LOG = logging.getLogger(__name__)
+
+
+def file_key(filename):
+    """ Return the fingerprint of a file used in the cache keys.
+
+    Queries that are not a file on disk are used as is.
+    """
+    if not os.path.isfile(filename):
+        return filename
+    file_fingerprint = fingerprint(filename)
+    return "{}-{}".format(file_fingerprint["size"],
+                          file_fingerprint["thesubdb"])
+
+
+class ResultCache(object):
+
+    """ Cache of the subtitles returned by each plugin for a file.
+
+    Entries are keyed by the plugin, the file fingerprint and the wanted
+    languages, and each one is a small JSON file in the results folder of
+    the cache folder. Empty results are cached too (negative caching) so a
+    file with no subtitles on a site is not searched again on every run.
+    The lifetimes can be set for each plugin in the config file:
+
+        [SubScene]
+        cache-ttl = 86400
+        negative-cache-ttl = 21600
+
+    A lifetime of 0 disables the cache.
+    """
+
+    def __init__(self, cache_path, config):
+        """ Init method with the periscope cache folder and config. """
+        self.folder = os.path.join(cache_path, "results")
+        self.config = config
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    def ttl(self, plugin_class, negative=False):
+        """ Return the lifetime in seconds of a result of plugin_class. """
+        option = "negative-cache-ttl" if negative else "cache-ttl"
+        section = plugin_class.__name__
+        if self.config.has_option(section, option):
+            try:
+                return self.config.getint(section, option)
+            except ValueError:
+                LOG.warn("Invalid value for {} in section {} of the config".
+                         format(option, section))
+        if negative:
+            return plugin_class.negative_cache_ttl
+        return plugin_class.cache_ttl
+
+    def _path(self, plugin_class, filename, langs):
+        """ Return the path of the entry of a search. """
+        digest = hashlib.sha1()
+        for part in (plugin_class.__name__, file_key(filename),
+                     ",".join(langs or [])):
+            if isinstance(part, unicode):
+                part = part.encode("utf-8")
+            digest.update(part + "\0")
+        return os.path.join(self.folder, digest.hexdigest())
+
+    def get(self, plugin_class, filename, langs):
+        """ Return the cached subtitles or None if there are none. """
+        try:
+            path = self._path(plugin_class, filename, langs)
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry["expires"] < time.time():
+            return None
+        LOG.debug("Cache hit for {} on {}".format(filename,
+                                                  plugin_class.__name__))
+        subtitles = entry["subtitles"]
+        for sub in subtitles:
+            sub["filename"] = filename
+        return subtitles
+
+    def set(self, plugin_class, filename, langs, subtitles):
+        """ Cache the subtitles returned by plugin_class for the file. """
+        ttl = self.ttl(plugin_class, negative=not subtitles)
+        if ttl <= 0:
+            return
+        entry = {"expires": time.time() + ttl,
+                 "subtitles": [dict((key, value)
+                                    for key, value in sub.iteritems()
+                                    if key != "plugin")
+                               for sub in subtitles]}
+        try:
+            path = self._path(plugin_class, filename, langs)
+            with open(path + ".tmp", "w") as entry_file:
+                json.dump(entry, entry_file)
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError, TypeError, ValueError):
+            LOG.warn("Could not cache the results of {} for {}".
+                     format(plugin_class.__name__, filename))
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+""" Resident periscope serving the CLI over a Unix socket. """
+
+from __future__ import absolute_import
+
+import os
+import json
+import errno
+import socket
+import logging
+import threading
+import SocketServer
+
+from periscope.pool import DEFAULT_JOBS
+from periscope.walker import LibraryWalker
+
+LOG = logging.getLogger(__name__)
+
+# Name of the socket of the daemon in the cache folder
+SOCKET_NAME = "periscoped.sock"
+# Seconds to wait for the daemon to accept a connection
+CONNECT_TIMEOUT = 1.0
+
+
+class DaemonUnavailable(Exception):
+
+    """ Raised when no daemon listens on the socket. """
+
+
+def socket_path(cache_folder):
+    """ Return the path of the socket of the daemon of a cache folder. """
+    return os.path.join(cache_folder, SOCKET_NAME)
+
+
+def public_subtitle(subtitle):
+    """ Return the subtitle without the plugin, which can not be sent. """
+    if subtitle is None:
+        return None
+    return dict((key, value) for key, value in subtitle.iteritems()
+                if key != "plugin")
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    """ Read one JSON request and write the JSON answers, one per line. """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+        except ValueError:
+            self.send({"event": "error", "message": "Invalid request"})
+            return
+        try:
+            self.server.process(request, self.send)
+        except socket.error:
+            LOG.info("Client left before the end of its request")
+        except Exception, err:
+            LOG.exception("Request {} failed".format(request))
+            self.send({"event": "error", "message": str(err)})
+
+    def send(self, message):
+        """ Write an answer to the client. """
+        self.wfile.write(json.dumps(message, default=str) + "\n")
+        self.wfile.flush()
+
+
+class PeriscopeDaemon(SocketServer.ThreadingMixIn,
+                      SocketServer.UnixStreamServer):
+
+    """ Serve the requests of the CLI with a resident Periscope.
+
+    The plugins, with their logins, the HTTP connection pools and the caches
+    are kept from a request to the next, so a media server hook calling
+    periscope for each new file does not pay for them every time. The
+    socket is in the cache folder and only readable by its owner. Each
+    request is a line of JSON like:
+
+        {"command": "download", "paths": ["/media/video.avi"],
+         "langs": ["fr"], "force": false, "exclude": [],
+         "incremental": false, "jobs": 8, "deadline": null,
+         "satisfice": false, "speculate": 1}
+
+    and is answered with a "done" event for each video as soon as it is
+    processed, then a "finished" event with the counts of the walk and the
+    downloaded subtitles. "process-retries" takes the same options but
+    searches the files whose retry time passed, "ping" and "stop" only
+    answer with an "ok" event.
+    """
+
+    daemon_threads = True
+    # A timeout keeps the main thread responsive to ctrl+c and to stop
+    timeout = 0.5
+
+    def __init__(self, periscope_client):
+        """ Init method with the Periscope to keep resident. """
+        self.periscope = periscope_client
+        self._stopped = threading.Event()
+        path = socket_path(periscope_client.cache_path)
+        if os.path.exists(path):
+            try:
+                DaemonClient(periscope_client.cache_path).ping()
+            except DaemonUnavailable:
+                LOG.info("Removing the stale socket {}".format(path))
+                os.remove(path)
+            else:
+                raise RuntimeError("A daemon already listens on {}".
+                                   format(path))
+        umask = os.umask(0177)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def serve(self):
+        """ Serve until a stop request or ctrl+c. """
+        LOG.info("Listening on {}".format(self.server_address))
+        try:
+            while not self._stopped.is_set():
+                self.handle_request()
+        finally:
+            self.server_close()
+            try:
+                os.remove(self.server_address)
+            except OSError:
+                pass
+            self.periscope.close()
+
+    def process(self, request, send):
+        """ Run a request, send is called with each answer. """
+        command = request.get("command")
+        LOG.info("Request {}".format(command))
+        if command == "ping":
+            send({"event": "ok", "pid": os.getpid()})
+        elif command == "stop":
+            send({"event": "ok", "pid": os.getpid()})
+            self._stopped.set()
+        elif command in ("download", "process-retries"):
+            self._download(command, request, send)
+        else:
+            send({"event": "error",
+                  "message": "Unknown command {}".format(command)})
+
+    def _download(self, command, request, send):
+        """ Download the subtitles of the videos of a request. """
+        if command == "process-retries":
+            paths = self.periscope.library.due()
+        else:
+            paths = request.get("paths") or []
+        is_due = None
+        if request.get("incremental"):
+            is_due = self.periscope.library.is_due
+        videos = LibraryWalker(paths, force=request.get("force", False),
+                               exclude=request.get("exclude"), is_due=is_due)
+        langs = request.get("langs") or self.periscope.prefered_languages
+
+        def done(filename, subtitle):
+            """ Report a video as soon as it is processed. """
+            send({"event": "done", "filename": filename,
+                  "subtitle": public_subtitle(subtitle)})
+
+        try:
+            subs = self.periscope.download_many(
+                videos, langs, jobs=request.get("jobs") or DEFAULT_JOBS,
+                deadline=request.get("deadline"),
+                satisfice=request.get("satisfice", False), callback=done,
+                speculate=request.get("speculate") or 1)
+        finally:
+            # Nothing is lost if the daemon is killed later
+            self.periscope.flush()
+        send({"event": "finished", "found": videos.found,
+              "skipped": videos.skipped, "unchanged": videos.unchanged,
+              "subtitles": [public_subtitle(sub) for sub in subs]})
+
+
+class DaemonClient(object):
+
+    """ Send requests to the daemon of a cache folder. """
+
+    def __init__(self, cache_folder, timeout=CONNECT_TIMEOUT):
+        """ Init method with the cache folder of the daemon. """
+        self.path = socket_path(cache_folder)
+        self.timeout = timeout
+
+    def request(self, command, **kwargs):
+        """ Send a request and yield the answers of the daemon.
+
+        DaemonUnavailable is raised, before anything is yielded, when no
+        daemon runs.
+        """
+        connection = self._connect()
+        kwargs["command"] = command
+        try:
+            connection.sendall(json.dumps(kwargs) + "\n")
+            answers = connection.makefile("r")
+            for line in answers:
+                yield json.loads(line)
+        finally:
+            connection.close()
+
+    def ping(self):
+        """ Return the pid of the daemon, or raise DaemonUnavailable. """
+        for answer in self.request("ping"):
+            return answer["pid"]
+        raise DaemonUnavailable(self.path)
+
+    def stop(self):
+        """ Stop the daemon, or raise DaemonUnavailable. """
+        for answer in self.request("stop"):
+            return answer["pid"]
+        raise DaemonUnavailable(self.path)
+
+    def _connect(self):
+        """ Return a socket connected to the daemon. """
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect(self.path)
+        except socket.error, err:
+            connection.close()
+            if err.errno in (errno.ENOENT, errno.ECONNREFUSED,
+                             errno.ENOTSOCK) or \
+                    isinstance(err, socket.timeout):
+                raise DaemonUnavailable(self.path)
+            raise
+        # The downloads may take long, only the connection is bounded
+        connection.settimeout(None)
+        return connection
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+""" File fingerprints shared by the hash based plugins.
+
+The sites identify a video by hashes of its first and last 64 KiB. Both
+regions are read once, with one read each, and every hash of
+HASH_FUNCTIONS is computed from the same buffers. Results are memoized by
+(device, inode, size, mtime) and saved in the cache folder so a file that
+did not change is never read again.
+"""
+
+import os
+import json
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+LOG = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Number of new fingerprints after which the store is written to disk
+SAVE_EVERY = 100
+
+_LONGLONGS = struct.Struct("<{}q".format(CHUNK_SIZE / 8))
+
+
+def opensubtitles_hash(size, head, tail):
+    """ Return the hash of the file as used by OpenSubtitles.
+
+    The method is defined on OpenSubtitles API (link below)
+    http://trac.opensubtitles.org/projects/opensubtitles/
+    wiki/HashSourceCodes#Python
+    """
+    if size < CHUNK_SIZE * 2:
+        return "SizeError"
+    file_hash = size + sum(_LONGLONGS.unpack(head)) + \
+        sum(_LONGLONGS.unpack(tail))
+    return "%016x" % (file_hash & 0xFFFFFFFFFFFFFFFF)
+
+
+def thesubdb_hash(size, head, tail):
+    """ Return the hash of the file as used by TheSubDB. """
+    return hashlib.md5(head + tail).hexdigest()
+
+
+HASH_FUNCTIONS = OrderedDict([
+    ("opensubtitles", opensubtitles_hash),
+    ("thesubdb", thesubdb_hash),
+])
+
+
+def compute_fingerprint(file_path):
+    """ Read the file once and return its size and all its hashes. """
+    with open(file_path, "rb") as video:
+        size = os.fstat(video.fileno()).st_size
+        head = video.read(CHUNK_SIZE)
+        video.seek(max(0, size - CHUNK_SIZE), os.SEEK_SET)
+        tail = video.read(CHUNK_SIZE)
+    result = {"size": size}
+    for name, hash_function in HASH_FUNCTIONS.iteritems():
+        result[name] = hash_function(size, head, tail)
+    return result
+
+
+class FingerprintStore(object):
+
+    """ Memoize the fingerprints, optionally saved to a JSON file. """
+
+    def __init__(self, path=None):
+        """ Load the fingerprints saved in path. """
+        self.path = path
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+        self._unsaved = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path) as store_file:
+                    self._fingerprints = json.load(store_file)
+            except (IOError, ValueError):
+                LOG.warn("Could not read the fingerprints from {}".
+                         format(path))
+
+    def get(self, file_path):
+        """ Return the fingerprint of a file, compute it if needed. """
+        stat = os.stat(file_path)
+        key = "{}:{}:{}:{}".format(stat.st_dev, stat.st_ino, stat.st_size,
+                                   stat.st_mtime)
+        with self._lock:
+            result = self._fingerprints.get(key)
+        if result and all(name in result for name in HASH_FUNCTIONS):
+            return result
+        result = compute_fingerprint(file_path)
+        with self._lock:
+            self._fingerprints[key] = result
+            self._unsaved += 1
+            if self._unsaved >= SAVE_EVERY:
+                self._save()
+        return result
+
+    def flush(self):
+        """ Write the new fingerprints to disk. """
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def _save(self):
+        """ Write the fingerprints to disk. Lock must be held. """
+        self._unsaved = 0
+        if not self.path:
+            return
+        try:
+            with open(self.path + ".tmp", "w") as store_file:
+                json.dump(self._fingerprints, store_file)
+            os.rename(self.path + ".tmp", self.path)
+        except (IOError, OSError):
+            LOG.warn("Could not save the fingerprints to {}".
+                     format(self.path))
+
+
+_STORE = FingerprintStore()
+
+
+def set_cache_folder(cache_path):
+    """ Save the fingerprints in the given cache folder from now on. """
+    global _STORE
+    _STORE.flush()
+    _STORE = FingerprintStore(os.path.join(cache_path, "fingerprints"))
+
+
+def flush():
+    """ Write the new fingerprints to disk. """
+    _STORE.flush()
+
+
+def fingerprint(file_path):
+    """ Return a dict with the size and every hash of the file. """
+    return _STORE.get(file_path)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+""" Health of the plugins and circuit breaker to skip the dead sites. """
+
+import os
+import json
+import time
+import logging
+import threading
+
+LOG = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+# Consecutive failures after which the circuit of a plugin opens
+FAILURE_THRESHOLD = 5
+# Seconds a circuit stays open, doubled after each failed probe
+OPEN_DURATION = 10 * 60
+MAX_OPEN_DURATION = 24 * 60 * 60
+# Seconds after which a probe that did not report is given up
+PROBE_TIMEOUT = 5 * 60
+# Weight of the last call in the success rate and latency averages
+SMOOTHING = 0.2
+
+
+def _new_stats():
+    """ Return the stats of a plugin that was never called. """
+    return {"state": CLOSED, "calls": 0, "failures": 0,
+            "consecutive_failures": 0, "success_rate": 1.0, "latency": None,
+            "open_until": 0, "open_duration": OPEN_DURATION,
+            "probe_started": None}
+
+
+class HealthRegistry(object):
+
+    """ Track the calls of each plugin and open its circuit when it fails.
+
+    After FAILURE_THRESHOLD consecutive failures the circuit of a plugin is
+    open: allow() returns False and the plugin is skipped instead of timing
+    out on every file. Once OPEN_DURATION passed, the circuit is half-open
+    and a single call is let through as a probe. A successful probe closes
+    the circuit, a failed one opens it again for twice as long.
+
+    The success rate and latency are moving averages, so they show how the
+    plugin behaves lately. The stats are kept in a JSON file of the cache
+    folder to be shared by the next runs.
+    """
+
+    def __init__(self, path=None):
+        """ Load the stats saved in path. """
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._unsaved = False
+        if path and os.path.exists(path):
+            try:
+                with open(path) as health_file:
+                    self._stats = json.load(health_file)
+            except (IOError, ValueError):
+                LOG.warn("Could not read the plugin health from {}".
+                         format(path))
+
+    def _get(self, name):
+        """ Return the stats of a plugin. Lock must be held. """
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = _new_stats()
+        return stats
+
+    def allow(self, name):
+        """ Return True if the plugin can be called now. """
+        now = time.time()
+        with self._lock:
+            stats = self._get(name)
+            if stats["state"] == CLOSED:
+                return True
+            if stats["state"] == OPEN:
+                if now < stats["open_until"]:
+                    return False
+                LOG.info("Circuit of {} is half-open, probing it".
+                         format(name))
+                stats["state"] = HALF_OPEN
+            elif stats["probe_started"] and \
+                    now - stats["probe_started"] < PROBE_TIMEOUT:
+                # Only one probe at a time
+                return False
+            stats["probe_started"] = now
+            return True
+
+    def record(self, name, success, latency=None):
+        """ Record the outcome of a call to the plugin. """
+        with self._lock:
+            stats = self._get(name)
+            stats["calls"] += 1
+            stats["success_rate"] += SMOOTHING * (
+                (1.0 if success else 0.0) - stats["success_rate"])
+            if latency is not None:
+                if stats["latency"] is None:
+                    stats["latency"] = latency
+                else:
+                    stats["latency"] += SMOOTHING * (latency -
+                                                     stats["latency"])
+            self._unsaved = True
+            if success:
+                stats["consecutive_failures"] = 0
+                if stats["state"] != CLOSED:
+                    LOG.info("Circuit of {} is closed again".format(name))
+                    stats.update(state=CLOSED, open_duration=OPEN_DURATION,
+                                 probe_started=None)
+                    self._save()
+                return
+            stats["failures"] += 1
+            stats["consecutive_failures"] += 1
+            if stats["state"] == HALF_OPEN:
+                stats["open_duration"] = min(MAX_OPEN_DURATION,
+                                             stats["open_duration"] * 2)
+            elif stats["consecutive_failures"] < FAILURE_THRESHOLD:
+                return
+            stats.update(state=OPEN, probe_started=None,
+                         open_until=time.time() + stats["open_duration"])
+            LOG.warn("{} failed {} times in a row, skipping it for {}s".
+                     format(name, stats["consecutive_failures"],
+                            stats["open_duration"]))
+            self._save()
+
+    def stats(self, name):
+        """ Return a copy of the stats of a plugin. """
+        with self._lock:
+            return dict(self._get(name))
+
+    def describe(self, name):
+        """ Return a one line summary of the health of a plugin. """
+        stats = self.stats(name)
+        state = stats["state"]
+        if state == OPEN:
+            state += " for {:.0f}s".format(
+                max(0, stats["open_until"] - time.time()))
+        latency = "-" if stats["latency"] is None else \
+            "{:.2f}s".format(stats["latency"])
+        return ("{}, success rate {:.0%}, latency {}, {} consecutive "
+                "failures, {} calls".format(state, stats["success_rate"],
+                                            latency,
+                                            stats["consecutive_failures"],
+                                            stats["calls"]))
+
+    def flush(self):
+        """ Write the stats to disk. """
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def _save(self):
+        """ Write the stats to disk. Lock must be held. """
+        self._unsaved = False
+        if not self.path:
+            return
+        try:
+            with open(self.path + ".tmp", "w") as health_file:
+                json.dump(self._stats, health_file)
+            os.rename(self.path + ".tmp", self.path)
+        except (IOError, OSError):
+            LOG.warn("Could not save the plugin health to {}".
+                     format(self.path))
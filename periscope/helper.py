@@ -1,16 +1,473 @@
 """ Module with helper functions used in various plugins. """
 
+from __future__ import absolute_import
+
 import os
+import time
+import gzip
+import base64
+import socket
+import urllib
 import urllib2
-import socket  # For timeout purposes
+import httplib
+import logging
 import zipfile
+import threading
+import xmlrpclib
+from urlparse import urlsplit, urljoin
+from StringIO import StringIO
+
+from periscope.policy import DEFAULT_POLICY, DeadlineExceeded
+
+LOG = logging.getLogger(__name__)
 
 USER_AGENT = 'Mozilla/5.0 (X11; U; Linux x86_64; en-US; rv:1.9.1.3)'
+# Number of idle connections kept open for each host
+MAX_IDLE_PER_HOST = 4
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307)
+
+
+class Response(object):
+
+    """ Fully read answer of an HTTPSession request.
+
+    It offers read(), geturl() and info() so the code written for the
+    objects returned by urllib2.urlopen keeps working.
+    """
+
+    def __init__(self, url, status, reason, headers, content):
+        """ Init method with the final url and the decoded body. """
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    def read(self):
+        """ Return the body of the response. """
+        return self.content
+
+    def geturl(self):
+        """ Return the url of the response, after the redirections. """
+        return self.url
+
+    def info(self):
+        """ Return the headers of the response. """
+        return self.headers
+
+    def close(self):
+        """ Nothing to release, the connection is already back in its pool.
+        """
+        pass
+
+
+class _CookieRequest(urllib2.Request):
+
+    """ Request given to cookielib to set and read the cookies. """
+
+
+class _CookieResponse(object):
+
+    """ Response given to cookielib to extract the cookies. """
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def info(self):
+        return self.headers
+
+
+class _ProxyConnection(httplib.HTTPConnection):
+
+    """ Connection to an HTTP proxy, sending it the requests of a host. """
+
+    def __init__(self, proxy, host, credentials=None, **kwargs):
+        """ Init method with the proxy and the host actually requested. """
+        httplib.HTTPConnection.__init__(self, proxy, **kwargs)
+        self.target = host
+        self.credentials = credentials
+
+    def putrequest(self, method, url, *args, **kwargs):
+        """ Overwrite, the proxy is given the absolute url. """
+        if url.startswith("/"):
+            url = "http://{}{}".format(self.target, url)
+        httplib.HTTPConnection.putrequest(self, method, url, *args, **kwargs)
+        if self.credentials:
+            self.putheader("Proxy-Authorization", self.credentials)
+
+
+def proxy_for(scheme, host):
+    """ Return the (host, Proxy-Authorization) of the proxy to reach host.
+
+    The proxies are read from the environment (http_proxy, https_proxy and
+    no_proxy) as urllib does. None is returned to connect directly.
+    """
+    proxy = urllib.getproxies().get(scheme)
+    if not proxy or urllib.proxy_bypass(host):
+        return None
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    userinfo, _, proxy_host = urlsplit(proxy).netloc.rpartition("@")
+    credentials = None
+    if userinfo:
+        credentials = "Basic " + base64.b64encode(urllib.unquote(userinfo))
+    return proxy_host, credentials
+
+
+class HTTPSession(object):
+
+    """ HTTP client keeping the connections alive between the requests.
+
+    Idle connections are kept in a pool for each host, so the plugins that
+    fetch several pages of a site only pay the TCP (and TLS) handshake
+    once. Responses are asked gzip compressed and redirections are
+    followed. Errors are raised as urllib2.HTTPError and urllib2.URLError,
+    like urllib2.urlopen does. The session is thread safe: a connection is
+    only used by one request at a time.
+
+    Timeouts and retries come from a RequestPolicy: the one given to
+    request(), else the one set for the host with set_policy(), else
+    DEFAULT_POLICY. The process wide socket timeout is never used.
+
+    The proxies of the environment are honoured, see proxy_for: the http
+    requests are sent to the proxy and the https ones tunneled through it
+    with CONNECT.
+
+    Once an HTTPCache is given to set_cache(), the GET requests given a
+    freshness are served from it while their page is fresh, and
+    revalidated with the server once it is stale.
+    """
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST):
+        """ Create an empty session. """
+        self.max_idle_per_host = max_idle_per_host
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._policies = {}
+        self.cache = None
+
+    def set_cache(self, cache):
+        """ Keep the pages of the requests given a freshness in cache, an
+        HTTPCache, or stop keeping them with None.
+        """
+        self.cache = cache
+
+    def set_policy(self, host, policy):
+        """ Use policy for the requests to host that do not give one. """
+        with self._lock:
+            self._policies[host] = policy
+
+    def policy_for(self, url):
+        """ Return the policy of the host of url. """
+        with self._lock:
+            return self._policies.get(urlsplit(url).netloc, DEFAULT_POLICY)
 
+    def get_connection(self, scheme, host, connect_timeout, read_timeout):
+        """ Return an idle connection to host or a new connected one.
 
-def download_file(url, file_path, logger):
+        The second value returned tells if the connection was reused.
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            connection = idle.pop() if idle else None
+        reused = connection is not None
+        if not reused:
+            connection = self._new_connection(scheme, host, connect_timeout)
+            connection.connect()
+        connection.timeout = read_timeout
+        connection.sock.settimeout(read_timeout)
+        return connection, reused
+
+    @staticmethod
+    def _new_connection(scheme, host, timeout):
+        """ Return a connection to host, through its proxy if it has one.
+        """
+        proxy = proxy_for(scheme, host)
+        if proxy is None:
+            if scheme == "https":
+                return httplib.HTTPSConnection(host, timeout=timeout)
+            return httplib.HTTPConnection(host, timeout=timeout)
+        proxy_host, credentials = proxy
+        LOG.debug("Connecting to {} through {}".format(host, proxy_host))
+        if scheme == "https":
+            connection = httplib.HTTPSConnection(proxy_host, timeout=timeout)
+            connection.set_tunnel(host, headers=credentials and
+                                  {"Proxy-Authorization": credentials})
+            return connection
+        return _ProxyConnection(proxy_host, host, credentials,
+                                timeout=timeout)
+
+    def release_connection(self, scheme, host, connection):
+        """ Give back a connection whose response was fully read. """
+        if connection.sock is None:
+            return
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """ Close all the idle connections. """
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.itervalues():
+            for connection in idle:
+                connection.close()
+
+    def request(self, url, data=None, headers=None, policy=None,
+                cookie_jar=None, method=None, freshness=None):
+        """ Send a GET request, or a POST one if data is given.
+
+        data can be a string or a dict to encode as a form. cookie_jar is
+        an optional cookielib.CookieJar sent with the request and updated
+        with the cookies of the response. Failed attempts are retried as
+        the policy says. Return a Response.
+
+        freshness is the number of seconds a GET answer without cookies can
+        be served from the cache of the session, see set_cache.
+        """
+        policy = policy or self.policy_for(url)
+        if isinstance(data, dict):
+            data = urllib.urlencode(data)
+        if method is None:
+            method = "GET" if data is None else "POST"
+        if freshness is None or self.cache is None or method != "GET" or \
+                cookie_jar is not None:
+            return self._send(method, url, data, headers, policy, cookie_jar)
+        # The requests of the same page wait for the first one to cache it
+        with self.cache.lock(url):
+            return self._cached(url, headers, policy, freshness)
+
+    def _cached(self, url, headers, policy, freshness):
+        """ Return the cached page of url, revalidated if it is stale. """
+        page = self.cache.get(url)
+        if page is not None and page.age() < freshness:
+            LOG.debug("Using the cached page of {}".format(url))
+            return page.response()
+        request_headers = dict(headers or {})
+        if page is not None:
+            request_headers.update(page.validators())
+        try:
+            response = self._send("GET", url, None, request_headers, policy,
+                                  None)
+        except urllib2.URLError, err:
+            # A stale page is better than none while the site is down
+            if page is None or getattr(err, "code", 500) < 500:
+                raise
+            LOG.warn("Using the stale page of {} ({})".format(url, err))
+            return page.response()
+        if response.status == 304 and page is not None:
+            LOG.debug("The cached page of {} did not change".format(url))
+            self.cache.touch(page)
+            return page.response()
+        if response.status == 200:
+            self.cache.put(url, response)
+        return response
+
+    def _send(self, method, url, data, headers, policy, cookie_jar):
+        """ Send a request, retrying the failed attempts. """
+        end = policy.start()
+        attempt = 0
+        while True:
+            try:
+                return self._follow(method, url, data, headers, policy, end,
+                                    cookie_jar)
+            except urllib2.HTTPError, err:
+                delay = policy.retry_delay(attempt, end, err.code,
+                                           err.hdrs.get("retry-after"))
+                error = err.code
+            except urllib2.URLError, err:
+                delay = policy.retry_delay(attempt, end)
+                error = err.reason
+            if delay is None:
+                raise
+            LOG.debug("Attempt {} on {} failed ({}), retrying in {:.2f}s".
+                      format(attempt + 1, url, error, delay))
+            time.sleep(delay)
+            attempt += 1
+
+    def _follow(self, method, url, data, headers, policy, end, cookie_jar):
+        """ Send one attempt of a request, following the redirections. """
+        for _ in range(MAX_REDIRECTS + 1):
+            try:
+                timeouts = policy.timeouts(end)
+            except DeadlineExceeded, err:
+                # Raised like the other failures, for the callers and the
+                # retries of request
+                raise urllib2.URLError(err)
+            response = self._request(method, url, data, headers, timeouts,
+                                     cookie_jar)
+            location = response.headers.get("location")
+            if response.status not in REDIRECT_CODES or not location:
+                break
+            url = urljoin(url, location)
+            if response.status != 307 and method == "POST":
+                method, data = "GET", None
+        else:
+            raise urllib2.HTTPError(url, response.status,
+                                    "Too many redirections",
+                                    response.headers, StringIO(""))
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.headers,
+                                    StringIO(response.content))
+        return response
+
+    def _request(self, method, url, data, headers, timeouts, cookie_jar):
+        """ Send one request, without following the redirections. """
+        parts = urlsplit(url)
+        scheme, host = parts.scheme or "http", parts.netloc
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request_headers = {"User-Agent": USER_AGENT,
+                           "Accept-Encoding": "gzip",
+                           "Connection": "keep-alive"}
+        if data is not None:
+            request_headers["Content-Type"] = \
+                "application/x-www-form-urlencoded"
+        request_headers.update(headers or {})
+        if cookie_jar is not None:
+            cookie_request = _CookieRequest(url, data, request_headers)
+            cookie_jar.add_cookie_header(cookie_request)
+            request_headers.update(cookie_request.unredirected_hdrs)
+        while True:
+            connection, reused = None, False
+            try:
+                connection, reused = self.get_connection(scheme, host,
+                                                         *timeouts)
+                connection.request(method, path, data, request_headers)
+                response = connection.getresponse()
+                try:
+                    content = response.read()
+                except httplib.IncompleteRead, err:
+                    LOG.warn("Incomplete read of {}, trying anyway".
+                             format(url))
+                    content = err.partial
+                    connection.close()
+                break
+            except (httplib.HTTPException, socket.error), err:
+                if connection is not None:
+                    connection.close()
+                # The server may have closed an idle connection, so a
+                # request on a reused connection is tried once more
+                if not reused:
+                    raise urllib2.URLError(err)
+                LOG.debug("Stale connection to {}, reconnecting".
+                          format(host))
+        if response.will_close:
+            connection.close()
+        else:
+            self.release_connection(scheme, host, connection)
+        if response.getheader("content-encoding", "").lower() == "gzip":
+            try:
+                content = gzip.GzipFile(fileobj=StringIO(content)).read()
+            except (IOError, EOFError, ValueError), err:
+                raise urllib2.URLError(err)
+        if cookie_jar is not None:
+            cookie_jar.extract_cookies(_CookieResponse(response.msg),
+                                       cookie_request)
+        return Response(url, response.status, response.reason, response.msg,
+                        content)
+
+
+class KeepAliveTransport(xmlrpclib.Transport):
+
+    """ XML-RPC transport borrowing its connections from an HTTPSession.
+
+    xmlrpclib.Transport keeps one connection for each ServerProxy; this one
+    gives it back to the pool of the session after every call so all the
+    proxies to a server share the same connections. Calls are retried as
+    the policy says.
+    """
+
+    scheme = "http"
+
+    def __init__(self, session=None, policy=None):
+        """ Init method with the session to use, the shared one by default.
+        """
+        xmlrpclib.Transport.__init__(self)
+        self.session = session or SESSION
+        self.policy = policy
+        self._timeouts = None
+
+    def request(self, host, handler, request_body, verbose=0):
+        """ Overwrite, retry the failed calls. """
+        policy = self.policy or self.session.policy_for(
+            "{}://{}".format(self.scheme, self.get_host_info(host)[0]))
+        end = policy.start()
+        attempt = 0
+        while True:
+            try:
+                self._timeouts = policy.timeouts(end)
+                return self.single_request(host, handler, request_body,
+                                           verbose)
+            except xmlrpclib.ProtocolError, err:
+                delay = policy.retry_delay(attempt, end, err.errcode,
+                                           err.headers.get("retry-after"))
+            except (httplib.HTTPException, socket.error):
+                delay = policy.retry_delay(attempt, end)
+            if delay is None:
+                raise
+            LOG.debug("XML-RPC call to {} failed, retrying in {:.2f}s".
+                      format(host, delay))
+            time.sleep(delay)
+            attempt += 1
+
+    def make_connection(self, host):
+        """ Overwrite, borrow a connection from the session. """
+        if self._connection[1] is not None and self._connection[0] == host:
+            return self._connection[1]
+        real_host, self._extra_headers, _ = self.get_host_info(host)
+        connection, _ = self.session.get_connection(self.scheme, real_host,
+                                                    *self._timeouts)
+        self._connection = host, connection
+        return connection
+
+    def single_request(self, host, handler, request_body, verbose=0):
+        """ Overwrite, give the connection back once the call is done. """
+        try:
+            return xmlrpclib.Transport.single_request(self, host, handler,
+                                                      request_body, verbose)
+        finally:
+            # On errors the connection is closed and already forgotten
+            proxy_host, connection = self._connection
+            if connection is not None:
+                self._connection = None, None
+                self.session.release_connection(
+                    self.scheme, self.get_host_info(proxy_host)[0],
+                    connection)
+
+
+class SafeKeepAliveTransport(KeepAliveTransport):
+
+    """ KeepAliveTransport for the https servers. """
+
+    scheme = "https"
+
+
+# Session shared by all the plugins
+SESSION = HTTPSession()
+
+
+def server_proxy(url, policy=None):
+    """ Return an xmlrpclib.ServerProxy using the shared session. """
+    if url.startswith("https"):
+        transport = SafeKeepAliveTransport(policy=policy)
+    else:
+        transport = KeepAliveTransport(policy=policy)
+    return xmlrpclib.ServerProxy(url, transport=transport)
+
+
+def download_file(url, file_path, logger, policy=None, data=None,
+                  headers=None):
     """ Download the given url to the given filename. """
-    content = download_content(url, logger)
+    content = download_content(url, logger, policy, data, headers)
+    if content is None:
+        raise IOError("Could not download {}".format(url))
     dump = open(file_path, "wb")
     dump.write(content)
     dump.close()
@@ -18,18 +475,19 @@ def download_file(url, file_path, logger):
                  format(file_path, os.path.getsize(file_path)))
 
 
-def download_content(url, logger, timeout=None):
-    """ Download the given url and returns its contents."""
+def download_content(url, logger, policy=None, data=None, headers=None,
+                     freshness=None):
+    """ Download the given url and returns its contents.
+
+    None is returned once the retries of the policy are exhausted. See
+    HTTPSession.request for freshness.
+    """
     try:
         logger.debug("Downloading %s" % url)
-        req = urllib2.Request(url, headers={'Referer': url,
-                                            'User-Agent': USER_AGENT})
-        if timeout:
-            socket.setdefaulttimeout(timeout)
-        f = urllib2.urlopen(req)
-        content = f.read()
-        f.close()
-        return content
+        request_headers = {'Referer': url}
+        request_headers.update(headers or {})
+        return SESSION.request(url, data, request_headers, policy,
+                               freshness=freshness).content
     except urllib2.HTTPError, e:
         logger.warning("HTTP Error: %s - %s" % (e.code, url))
     except urllib2.URLError, e:
@@ -75,3 +533,47 @@ def extract_subtitle_from_zip_file(file_path, logger):
         if file_extension(file_info.orig_filename) in ('srt', 'sub'):
             return zip_file.read(file_info.orig_filename)
     logger.warn("No content found in {}".format(file_path))
+
+
+def is_valid_subtitle(content):
+    """ Return True if content looks like a subtitle, not an error page. """
+    if not content or not content.strip():
+        return False
+    head = content[:1024].lstrip().lower()
+    return not head.startswith(("pk\x03\x04", "rar!", "<!doctype", "<html"))
+
+
+def extract_subtitle(content, logger):
+    """ Return the (extension, content) of the subtitle of a download.
+
+    content is a subtitle or a ZIP archive holding one. None is returned
+    when no valid subtitle is found.
+    """
+    if not content:
+        return None
+    archive = StringIO(content)
+    if not zipfile.is_zipfile(archive):
+        return ("srt", content) if is_valid_subtitle(content) else None
+    zip_file = zipfile.ZipFile(archive, "r")
+    try:
+        for file_info in zip_file.infolist():
+            extension = file_extension(file_info.orig_filename)
+            if extension in ("srt", "sub", "txt"):
+                subtitle = zip_file.read(file_info.orig_filename)
+                if is_valid_subtitle(subtitle):
+                    return extension, subtitle
+            else:
+                logger.info("File {} does not seem to be valid ".
+                            format(file_info.orig_filename))
+    finally:
+        zip_file.close()
+    logger.warn("No subtitle found in the archive")
+    return None
+
+
+def write_subtitle(video_path, extension, content):
+    """ Write a subtitle next to its video and return its path. """
+    subtitle_path = video_path.rsplit(".", 1)[0] + "." + extension
+    with open(subtitle_path, "wb") as subtitle_file:
+        subtitle_file.write(content)
+    return subtitle_path
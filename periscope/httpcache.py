@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+""" On disk cache of the pages fetched by the plugins. """
+
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from periscope.helper import Response
+
+LOG = logging.getLogger(__name__)
+
+# Seconds after which an entry not used any more is removed
+MAX_AGE = 7 * 24 * 60 * 60
+# Headers kept with a page, the others are not used once it is read
+KEPT_HEADERS = ("content-type", "etag", "last-modified")
+
+
+class CachedPage(object):
+
+    """ A page of the cache, with what is needed to revalidate it. """
+
+    def __init__(self, url, final_url, headers, checked, body):
+        """ Init method with the compressed body of the page. """
+        self.url = url
+        self.final_url = final_url
+        self.headers = headers
+        self.checked = checked
+        self.body = body
+
+    def age(self, now=None):
+        """ Return the seconds since the page was last fetched or checked.
+        """
+        return (now or time.time()) - self.checked
+
+    @property
+    def content(self):
+        """ Return the uncompressed body of the page. """
+        return zlib.decompress(self.body)
+
+    def response(self):
+        """ Return the page as the Response of an HTTPSession request. """
+        return Response(self.final_url, 200, "OK", dict(self.headers),
+                        self.content)
+
+    def validators(self):
+        """ Return the headers asking the server if the page changed. """
+        headers = {}
+        if self.headers.get("etag"):
+            headers["If-None-Match"] = self.headers["etag"]
+        if self.headers.get("last-modified"):
+            headers["If-Modified-Since"] = self.headers["last-modified"]
+        return headers
+
+
+class HTTPCache(object):
+
+    """ Pages kept on disk, revalidated once stale.
+
+    Each page is a file of the folder named after the hash of its url: a
+    line of JSON with the url, the time it was last fetched or checked and
+    the headers needed to revalidate it, then the body compressed with
+    zlib. How long a page is fresh, and served without asking the server,
+    is chosen by the caller of HTTPSession.request for each url. A stale
+    page is requested again with If-None-Match and If-Modified-Since, so
+    an unchanged page costs a 304 answer instead of its body.
+
+    The entries are written to a temporary file then renamed, so several
+    periscope processes can share the folder.
+    """
+
+    def __init__(self, folder, max_age=MAX_AGE):
+        """ Init method with the folder of the pages. """
+        self.folder = folder
+        self.max_age = max_age
+        # url: [lock, number of threads holding or waiting for it]
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.prune()
+
+    def _path(self, url):
+        """ Return the path of the entry of a url. """
+        if isinstance(url, unicode):
+            url = url.encode("utf-8")
+        return os.path.join(self.folder, hashlib.sha1(url).hexdigest())
+
+    @contextmanager
+    def lock(self, url):
+        """ Hold the lock of a url while it is read and fetched.
+
+        The plugins searching the episodes of a season at once all want the
+        same season page: the first one fetches it while the others wait,
+        then read it from the cache. Each url has its own lock, the requests
+        of other urls never wait. It is dropped once nobody needs it.
+        """
+        with self._locks_lock:
+            entry = self._locks.setdefault(url, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[url]
+
+    def get(self, url):
+        """ Return the CachedPage of a url, None if it is not cached.
+
+        The entry is marked as used, prune keeps it for max_age seconds.
+        """
+        path = self._path(url)
+        try:
+            with open(path, "rb") as entry:
+                meta = json.loads(entry.readline())
+                body = entry.read()
+        except (IOError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return CachedPage(url, meta["final_url"], meta["headers"],
+                          meta["checked"], body)
+
+    def put(self, url, response):
+        """ Save the page of a Response and return its CachedPage. """
+        headers = dict((name, response.headers.get(name))
+                       for name in KEPT_HEADERS if response.headers.get(name))
+        page = CachedPage(url, response.url, headers, time.time(),
+                          zlib.compress(response.content))
+        self._write(page)
+        return page
+
+    def touch(self, page):
+        """ Mark a page as checked now, after a 304 answer. """
+        page.checked = time.time()
+        self._write(page)
+
+    def _write(self, page):
+        """ Write the entry of a page. """
+        meta = json.dumps({"url": page.url, "final_url": page.final_url,
+                           "headers": page.headers, "checked": page.checked})
+        try:
+            handle, temporary = tempfile.mkstemp(dir=self.folder)
+            with os.fdopen(handle, "wb") as entry:
+                entry.write(meta + "\n")
+                entry.write(page.body)
+            os.rename(temporary, self._path(page.url))
+        except (IOError, OSError), err:
+            LOG.warn("Could not cache {}: {}".format(page.url, err))
+
+    def prune(self):
+        """ Remove the entries not used for max_age seconds. """
+        limit = time.time() - self.max_age
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except OSError:
+                pass
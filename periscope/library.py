@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+""" Index of the library files already processed, kept in SQLite. """
+
+from __future__ import absolute_import
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+
+from periscope.cache import file_key
+
+LOG = logging.getLogger(__name__)
+
+FOUND, NOT_FOUND, FAILED = "found", "not found", "failed"
+
+# Seconds before a file with no subtitle is searched again, after each of
+# its unsuccessful searches, it is given up after the last one
+RETRY_SCHEDULE = (60 * 60, 6 * 60 * 60, 24 * 60 * 60, 3 * 24 * 60 * 60)
+# Seconds before a file whose searches all failed is searched again
+FAILED_RETRY_DELAY = 60 * 60
+# Number of writes after which they are committed
+COMMIT_EVERY = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    inode INTEGER,
+    size INTEGER,
+    mtime REAL,
+    fingerprint TEXT,
+    outcome TEXT,
+    last_search REAL,
+    next_search REAL,
+    attempts INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS files_next_search ON files (next_search);
+CREATE TABLE IF NOT EXISTS searches (
+    path TEXT,
+    plugin TEXT,
+    searched_at REAL,
+    outcome TEXT,
+    PRIMARY KEY (path, plugin)
+);
+"""
+
+
+class LibraryIndex(object):
+
+    """ Remember the files processed and when to search them again.
+
+    For each file the index keeps its inode, size, mtime and fingerprint,
+    the outcome of its last processing and of the last search of each
+    plugin. is_due() tells if a file is new, changed since, or if its retry
+    time passed, so a scan of a big library only searches the few files
+    that need it.
+
+    The index is also the retry queue of the files with no subtitle yet:
+    the nth unsuccessful search of a file schedules the next one
+    RETRY_SCHEDULE[n - 1] seconds later, as subtitles usually show up in
+    the days following a release, and due() returns the files whose time
+    came without looking at the others. The index can be shared by the
+    searching threads.
+    """
+
+    def __init__(self, path):
+        """ Open or create the index at path, ":memory:" for a temporary one.
+        """
+        self.path = path
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in
+                   self._db.execute("PRAGMA table_info(files)")]
+        if columns and "attempts" not in columns:
+            # Index created before the retry schedule
+            self._db.execute("ALTER TABLE files ADD COLUMN attempts INTEGER "
+                             "DEFAULT 0")
+        self._db.executescript(SCHEMA)
+
+    def is_due(self, path, now=None):
+        """ Return True if the file must be processed. """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return True
+        with self._lock:
+            row = self._db.execute(
+                "SELECT inode, size, mtime, next_search FROM files "
+                "WHERE path = ?", (self._key(path),)).fetchone()
+        if row is None:
+            return True
+        inode, size, mtime, next_search = row
+        if (inode, size, mtime) != (stat.st_ino, stat.st_size,
+                                    stat.st_mtime):
+            LOG.debug("{} changed since it was processed".format(path))
+            return True
+        return next_search is not None and \
+            next_search <= (now or time.time())
+
+    def due(self, now=None):
+        """ Return the files whose retry time passed, the oldest first.
+
+        The files that disappeared since are removed from the index.
+        """
+        with self._lock:
+            paths = [row[0] for row in self._db.execute(
+                "SELECT path FROM files WHERE next_search <= ? "
+                "ORDER BY next_search", (now or time.time(),))]
+        due = []
+        for path in paths:
+            if os.path.isfile(path):
+                due.append(path)
+            else:
+                LOG.info("{} is gone, removing it from the retries".
+                         format(path))
+                self.forget(path)
+        return due
+
+    def forget(self, path):
+        """ Remove a file and its searches from the index. """
+        key = self._key(path)
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE path = ?", (key,))
+            self._db.execute("DELETE FROM searches WHERE path = ?", (key,))
+            self._written()
+
+    def record_search(self, path, plugin_name, outcome):
+        """ Record the outcome of the search of a plugin for a file. """
+        if not os.path.isfile(path):
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)",
+                (self._key(path), plugin_name, time.time(), outcome))
+            self._written()
+
+    def record_file(self, path, outcome):
+        """ Record the outcome of the processing of a file.
+
+        A NOT_FOUND file whose searches all failed during this run is
+        recorded as FAILED, to be retried sooner without counting it as an
+        attempt. Return the time of the next search, None if there is none.
+        """
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        fingerprint = file_key(path)
+        now = time.time()
+        key = self._key(path)
+        with self._lock:
+            if outcome == NOT_FOUND:
+                outcomes = set(row[0] for row in self._db.execute(
+                    "SELECT outcome FROM searches WHERE path = ? AND "
+                    "searched_at >= ?", (key, self.started)))
+                if outcomes == set([FAILED]):
+                    outcome = FAILED
+            row = self._db.execute(
+                "SELECT fingerprint, attempts FROM files WHERE path = ?",
+                (key,)).fetchone()
+            # The attempts of a file replaced since do not count
+            attempts = (row[1] or 0) if row and row[0] == fingerprint else 0
+            next_search = None
+            if outcome == FAILED:
+                next_search = now + FAILED_RETRY_DELAY
+            elif outcome == NOT_FOUND:
+                attempts += 1
+                if attempts <= len(RETRY_SCHEDULE):
+                    next_search = now + RETRY_SCHEDULE[attempts - 1]
+                else:
+                    LOG.info("No subtitle found for {} after {} attempts, "
+                             "giving up".format(path, attempts))
+            else:
+                attempts = 0
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, inode, size, mtime, "
+                "fingerprint, outcome, last_search, next_search, attempts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, stat.st_ino, stat.st_size, stat.st_mtime, fingerprint,
+                 outcome, now, next_search, attempts))
+            self._written()
+        return next_search
+
+    def get(self, path):
+        """ Return the row of a file as a dict, None if it is unknown. """
+        with self._lock:
+            cursor = self._db.execute("SELECT * FROM files WHERE path = ?",
+                                      (self._key(path),))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description],
+                            row))
+
+    def flush(self):
+        """ Commit the pending writes. """
+        with self._lock:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        """ Commit and close the index. """
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def _written(self):
+        """ Commit every COMMIT_EVERY writes. Lock must be held. """
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self._db.commit()
+            self._uncommitted = 0
+
+    @staticmethod
+    def _key(path):
+        """ Return the key of a file in the index. """
+        path = os.path.abspath(path)
+        if isinstance(path, str):
+            path = path.decode("utf-8", "replace")
+        return path
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+""" Lifecycle of the plugin instances shared by the searching threads. """
+
+from __future__ import absolute_import
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from periscope.helper import SESSION
+from periscope.pool import plugin_host
+
+LOG = logging.getLogger(__name__)
+
+
+class PluginManager(object):
+
+    """ Create plugins once and lend the instances to one thread at a time.
+
+    Plugins keep connections and session tokens, which are not safe to use
+    from several threads. Instead of building a new plugin for every file,
+    the manager keeps the idle instances of each plugin class and only
+    creates a new one when all the existing ones are busy. The instances
+    are kept by class name, as the plugins are given as lazy PluginSpec.
+    """
+
+    def __init__(self, config, cache_path):
+        """ Init method with the arguments given to the plugins. """
+        self.config = config
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._instances = []
+
+    def acquire(self, plugin_class):
+        """ Return an idle instance of plugin_class, create one if needed. """
+        with self._lock:
+            idle = self._idle.get(plugin_class.__name__)
+            if idle:
+                return idle.pop()
+        LOG.debug("Creating a new instance of {}".
+                  format(plugin_class.__name__))
+        plugin = plugin_class(self.config, self.cache_path)
+        # The request policy can be tuned in the section of the plugin
+        plugin.policy = plugin.policy.configured(self.config,
+                                                 plugin_class.__name__)
+        SESSION.set_policy(plugin_host(plugin_class), plugin.policy)
+        with self._lock:
+            self._instances.append(plugin)
+        return plugin
+
+    def release(self, plugin):
+        """ Give back an instance returned by acquire. """
+        with self._lock:
+            self._idle.setdefault(type(plugin).__name__, []).append(plugin)
+
+    @contextmanager
+    def plugin(self, plugin_class):
+        """ Lend an instance of plugin_class for the with block. """
+        plugin = self.acquire(plugin_class)
+        try:
+            yield plugin
+        finally:
+            self.release(plugin)
+
+    def close(self):
+        """ Close every instance created so far. """
+        with self._lock:
+            instances, self._instances = self._instances, []
+            self._idle = {}
+        for plugin in instances:
+            try:
+                plugin.close()
+            except Exception:
+                LOG.exception("Error while closing {}".format(plugin))
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+""" Extract the few elements the plugins need from the HTML pages.
+
+The scraping plugins only read a handful of <a>, <td> or <div> of each
+page. extract() returns these elements and what is inside them, nothing
+else of the page is kept as Python objects. The pages are parsed by lxml
+when it is installed, by HTMLParser otherwise. In both cases the tree of
+the page is dropped as soon as the elements are extracted.
+
+The elements answer the subset of the BeautifulSoup 3 API the plugins
+use: find, findAll, findNext, attrs, contents, string and text, with
+findText standing for findAll(text=...).
+"""
+
+from __future__ import absolute_import
+
+import re
+import weakref
+import logging
+from itertools import chain
+from HTMLParser import HTMLParser, HTMLParseError
+from htmlentitydefs import name2codepoint
+
+try:
+    import lxml.html
+    # The pages are decoded by decode, lxml gets them back in utf-8
+    LXML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+except ImportError:
+    lxml = None
+
+LOG = logging.getLogger(__name__)
+
+BACKENDS = ("lxml", "htmlparser")
+# Backend used by extract when none is given
+DEFAULT_BACKEND = "lxml" if lxml is not None else "htmlparser"
+
+# Elements which never have content or an end tag
+VOID_TAGS = frozenset(("area", "base", "br", "col", "embed", "hr", "img",
+                       "input", "link", "meta", "param", "source", "wbr"))
+# Elements implicitly closed by the start of the same element, unless an
+# element of the tags in the value is open in between
+IMPLICIT_END = {"td": ("tr", "table"), "th": ("tr", "table"),
+                "tr": ("table",), "li": ("ul", "ol"), "p": (),
+                "option": ("select",), "dt": ("dl",), "dd": ("dl",)}
+# Elements closing each other, like a <th> after an unclosed <td>
+SIBLING_TAGS = {"td": ("td", "th"), "th": ("td", "th"),
+                "dt": ("dt", "dd"), "dd": ("dt", "dd")}
+CHARSET = re.compile(r"""<meta[^>]+charset=["']?([\w-]+)""", re.I)
+
+
+class Element(object):
+
+    """ An extracted element, with its attributes and content.
+
+    attrs is the list of the (name, value) attributes, in the order of the
+    page, and contents the list of the child Elements and strings. The
+    parent is only kept with a weak reference, so the elements are freed
+    as soon as the result of extract is dropped.
+    """
+
+    __slots__ = ("tag", "attrs", "contents", "_parent", "__weakref__")
+
+    def __init__(self, tag, attrs, parent=None):
+        """ Init method with the tag name, attributes and parent. """
+        self.tag = tag
+        self.attrs = attrs
+        self.contents = []
+        self._parent = weakref.ref(parent) if parent is not None else None
+
+    def __repr__(self):
+        return "<Element {} {}>".format(self.tag, self.attrs)
+
+    @property
+    def parent(self):
+        """ Return the parent element, None for an extracted element. """
+        return self._parent() if self._parent is not None else None
+
+    def get(self, name, default=None):
+        """ Return the value of an attribute, default if it is missing. """
+        for key, value in self.attrs:
+            if key == name:
+                return value
+        return default
+
+    def __getitem__(self, name):
+        """ Return the value of an attribute, raise KeyError if missing. """
+        value = self.get(name, self)
+        if value is self:
+            raise KeyError(name)
+        return value
+
+    @property
+    def text(self):
+        """ Return all the text inside the element. """
+        return u"".join(self.strings())
+
+    @property
+    def string(self):
+        """ Return the text of an element whose only content is a text. """
+        if len(self.contents) != 1:
+            return None
+        child = self.contents[0]
+        if isinstance(child, Element):
+            return child.string
+        return child
+
+    def strings(self):
+        """ Yield the texts inside the element, in the order of the page. """
+        for child in self.contents:
+            if isinstance(child, Element):
+                for text in child.strings():
+                    yield text
+            else:
+                yield child
+
+    def descendants(self):
+        """ Yield the elements inside the element, in the order of the page.
+        """
+        for child in self.contents:
+            if isinstance(child, Element):
+                yield child
+                for element in child.descendants():
+                    yield element
+
+    def matches(self, tag=None, attrs=None):
+        """ Return True if the element has the tag and the attributes.
+
+        As with BeautifulSoup, the value of an attribute is True to only
+        need the attribute, a compiled regex to search its value, or the
+        exact string it must have (so a class is compared as a whole).
+        """
+        if tag is not None and self.tag != tag:
+            return False
+        for name, wanted in (attrs or {}).iteritems():
+            value = self.get(name)
+            if wanted is True:
+                if value is None:
+                    return False
+            elif hasattr(wanted, "search"):
+                if value is None or not wanted.search(value):
+                    return False
+            elif value != wanted:
+                return False
+        return True
+
+    def findAll(self, tag=None, attrs=None):
+        """ Return the elements inside the element matching tag and attrs.
+        """
+        return [element for element in self.descendants()
+                if element.matches(tag, attrs)]
+
+    __call__ = findAll
+
+    def find(self, tag=None, attrs=None):
+        """ Return the first element inside matching tag and attrs, or None.
+        """
+        for element in self.descendants():
+            if element.matches(tag, attrs):
+                return element
+        return None
+
+    def findText(self, text):
+        """ Return this element and the ones inside with text as a string.
+
+        It stands for findAll(text=text), these elements being the parents
+        of the strings it returns.
+        """
+        return [element for element in chain((self,), self.descendants())
+                if text in element.contents]
+
+    def findNext(self, tag=None, attrs=None):
+        """ Return the first element matching tag and attrs after the start
+        of this one, or None.
+
+        Only the extracted element holding this one is searched, the rest
+        of the page is gone.
+        """
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        following = False
+        for element in root.descendants():
+            if following and element.matches(tag, attrs):
+                return element
+            following = following or element is self
+        return None
+
+
+def _target(target):
+    """ Return the (tag, attrs) of a target given as a tag or a tuple. """
+    if isinstance(target, basestring):
+        return target, None
+    return target
+
+
+def _matches_any(element, targets):
+    """ Return True if the element matches one of the targets. """
+    return any(element.matches(tag, attrs) for tag, attrs in targets)
+
+
+def _add_text(element, text):
+    """ Append a text to the content of an element.
+
+    The texts around an entity or a comment make a single string, so the
+    indexes in contents are the same with both backends.
+    """
+    if element.contents and not isinstance(element.contents[-1], Element):
+        element.contents[-1] += text
+    else:
+        element.contents.append(text)
+
+
+def decode(content):
+    """ Return the HTML content as unicode, guessing its charset. """
+    if isinstance(content, unicode):
+        return content
+    match = CHARSET.search(content[:2048])
+    charsets = [match.group(1)] if match else []
+    for charset in charsets + ["utf-8"]:
+        try:
+            return content.decode(charset)
+        except (LookupError, UnicodeDecodeError):
+            pass
+    return content.decode("cp1252", "replace")
+
+
+class _Extractor(HTMLParser):
+
+    """ Build the elements matching the targets, and only them. """
+
+    def __init__(self, targets, nested=True):
+        HTMLParser.__init__(self)
+        self.targets = targets
+        self.nested = nested
+        # The elements of other tags are not even built outside
+        self._tags = set(tag for tag, _ in targets)
+        self.found = []
+        # The tags of the open elements of the page, with their Element
+        # inside an extracted element and None outside
+        self._stack = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = [(name, value if value is not None else name)
+                 for name, value in attrs]
+        if tag in IMPLICIT_END:
+            self._close_implicit(tag)
+        parent = self._stack[-1][1] if self._stack else None
+        element = None
+        if parent is not None or tag in self._tags or None in self._tags:
+            element = Element(tag, attrs, parent)
+            if _matches_any(element, self.targets):
+                if parent is None or self.nested:
+                    self.found.append(element)
+            elif parent is None:
+                # Outside of the extracted elements, nothing is kept
+                element = None
+            if parent is not None:
+                parent.contents.append(element)
+        if tag not in VOID_TAGS:
+            self._stack.append((tag, element))
+
+    def handle_endtag(self, tag):
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index][0] == tag:
+                del self._stack[index:]
+                return
+
+    def handle_data(self, data):
+        if self._stack and self._stack[-1][1] is not None:
+            _add_text(self._stack[-1][1], data)
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+        else:
+            self.handle_data(u"&{};".format(name))
+
+    def handle_charref(self, name):
+        try:
+            if name[:1] in ("x", "X"):
+                self.handle_data(unichr(int(name[1:], 16)))
+            else:
+                self.handle_data(unichr(int(name)))
+        except (ValueError, OverflowError):
+            self.handle_data(u"&#{};".format(name))
+
+    def _close_implicit(self, tag):
+        """ Close the open element ended by the start of tag, if any. """
+        closing = SIBLING_TAGS.get(tag, (tag,))
+        for index in range(len(self._stack) - 1, -1, -1):
+            open_tag = self._stack[index][0]
+            if open_tag in closing:
+                del self._stack[index:]
+                return
+            if open_tag in IMPLICIT_END[tag]:
+                return
+
+
+def _extract_htmlparser(content, targets, nested):
+    """ Extract the elements while parsing the page with HTMLParser. """
+    extractor = _Extractor(targets, nested)
+    try:
+        extractor.feed(content)
+        extractor.close()
+    except HTMLParseError, err:
+        LOG.debug("Stopped parsing a malformed page: {}".format(err))
+    return extractor.found
+
+
+def _convert(node, parent, converted):
+    """ Return the Element of an lxml element and of its content. """
+    element = Element(node.tag, node.attrib.items(), parent)
+    converted[node] = element
+    if node.text:
+        _add_text(element, node.text)
+    for child in node:
+        # The comments and processing instructions have no string tag
+        if isinstance(child.tag, basestring):
+            element.contents.append(_convert(child, element, converted))
+        if child.tail:
+            _add_text(element, child.tail)
+    return element
+
+
+def _extract_lxml(content, targets, nested):
+    """ Extract the elements of the page parsed by lxml. """
+    try:
+        root = lxml.html.document_fromstring(content.encode("utf-8"),
+                                             parser=LXML_PARSER)
+    except (ValueError, lxml.etree.ParserError), err:
+        LOG.debug("Could not parse a page: {}".format(err))
+        return []
+    tags = set(tag for tag, _ in targets)
+    found, converted = [], {}
+    for node in root.iter(*tags) if None not in tags else root.iter():
+        if not isinstance(node.tag, basestring):
+            continue
+        element = converted.get(node)
+        if element is None:
+            element = Element(node.tag, node.attrib.items())
+            if not _matches_any(element, targets):
+                continue
+            # The elements inside are converted once, with their parent
+            converted.clear()
+            element = _convert(node, None, converted)
+        elif not nested or not _matches_any(element, targets):
+            continue
+        found.append(element)
+    return found
+
+
+def extract(content, *targets, **kwargs):
+    """ Return the elements of an HTML page matching one of the targets.
+
+    A target is a tag name, or a (tag, attrs) tuple as for findAll. The
+    elements are returned in the order of the page, with their content.
+    An element inside another one is returned too, unless the nested
+    keyword argument is False. The backend keyword argument picks "lxml" or
+    "htmlparser" instead of DEFAULT_BACKEND.
+
+    The elements only hold a weak reference to their parent: an element
+    found inside an extracted one loses its parent, and findNext its
+    scope, once the extracted element is dropped.
+    """
+    backend = kwargs.get("backend") or DEFAULT_BACKEND
+    nested = kwargs.get("nested", True)
+    if backend not in BACKENDS:
+        raise ValueError("Unknown HTML backend {}".format(backend))
+    if not content:
+        return []
+    targets = [_target(target) for target in targets]
+    content = decode(content)
+    if backend == "lxml" and lxml is not None:
+        return _extract_lxml(content, targets, nested)
+    return _extract_htmlparser(content, targets, nested)
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+""" Guess the show, episode or movie of a video from its file name. """
+
+from __future__ import absolute_import
+
+import os
+import re
+import threading
+from collections import namedtuple, OrderedDict
+
+from periscope.plugins.regexes import ep_regexes
+
+TVSHOW, MOVIE, UNKNOWN = "tvshow", "movie", "unknown"
+
+# Number of file names whose parse result is kept
+CACHE_SIZE = 1024
+
+VIDEO_EXTENSIONS = ('.avi', '.wmv', '.mov', '.mp4', '.mpeg', '.mpg', '.mkv')
+SEPARATORS = re.compile(r"[._]")
+FLAGS = re.IGNORECASE | re.UNICODE
+
+# The patterns of guess_file_data, tried before the ep_regexes ones so the
+# usual names keep their name and teams
+TVSHOW_PATTERN = re.compile(r"(?P<show>.*)S(?P<season>[0-9]{2})"
+                            r"E(?P<episode>[0-9]{2}).(?P<teams>.*)", FLAGS)
+TVSHOW_PATTERN2 = re.compile(r"(?P<show>.*).(?P<season>[0-9]{1,2})x"
+                             r"(?P<episode>[0-9]{1,2})(?P<teams>.*)", FLAGS)
+MOVIE_PATTERN = re.compile(r"(?P<movie>.*)[\._\[\( ]{1}"
+                           r"(?P<year>(?:(?:19|20)[0-9]{2}))(?P<teams>.*)",
+                           FLAGS)
+
+EP_PATTERNS = OrderedDict((name, re.compile(pattern, FLAGS | re.VERBOSE))
+                          for name, pattern in ep_regexes)
+# ep_regexes cases tried before the movies, the others would take the year
+# of a movie for an episode number
+EARLY_EP_PATTERNS = ("standard_repeat", "fov_repeat", "standard", "fov",
+                     "scene_date_format", "verbose")
+# Every pattern, in the order they are tried
+PATTERNS = ("tvshow", "tvshow2") + EARLY_EP_PATTERNS + ("movie",) + \
+    tuple(name for name in EP_PATTERNS if name not in EARLY_EP_PATTERNS)
+
+# The cheap scans telling which patterns may match a name, see route. The
+# names are lower case already, so they do without IGNORECASE.
+DIGITS = re.compile(r"\d+", re.UNICODE)
+SEASON_EPISODE = re.compile(r"s\d+[. _-]*e\d", re.UNICODE)
+SEASON_NUMBER = re.compile(r"s(?:eason[. _-])?\d", re.UNICODE)
+CROSS = re.compile(r"\dx\d", re.UNICODE)
+DATE = re.compile(r"\d{4}[. _-]+\d{2}[. _-]+\d{2}", re.UNICODE)
+YEAR = re.compile(r"[._\[( ](?:19|20)\d{2}", re.UNICODE)
+EPISODE_WORD = re.compile(r"(?:e(?:p(?:isode)?)?|part|pt)[. _-]?[\divx]",
+                          re.UNICODE)
+
+
+class ParseResult(namedtuple("ParseResult", "type name season episode year "
+                                            "date teams part release_group "
+                                            "pattern")):
+
+    """ What the name of a video tells about it.
+
+    type is TVSHOW, MOVIE or UNKNOWN, pattern the name of the pattern that
+    matched. The fields can also be read like the keys of a dict. The
+    results are shared, SubtitleDB.guess_file_data gives the plugins a
+    copy as a dict they can change.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        """ Return a field, or default if there is no such field. """
+        return getattr(self, key, default)
+
+
+def _result(type, name, season=None, episode=None, year=None, date=None,
+            teams=None, part=None, release_group=None, pattern=None):
+    """ Return a ParseResult with the defaults of the missing fields. """
+    return ParseResult(type, name, season, episode, year, date, teams or [],
+                       part, release_group, pattern)
+
+
+def _clean_name(name):
+    """ Return a show or movie name with spaces between the words. """
+    return SEPARATORS.sub(" ", name or "").strip(" -")
+
+
+def _split_teams(teams):
+    """ Return the release tokens after the show or movie name. """
+    teams = teams.split(".")
+    if len(teams) == 1:
+        teams = teams[0].split("_")
+    return teams
+
+
+def _int(value):
+    """ Return value as an int, None if it is not a number. """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_tvshow(filename, pattern, name):
+    """ Parse the usual S01E02 or 1x02 names. """
+    match = pattern.match(filename)
+    if not match:
+        return None
+    show, season, episode, teams = match.groups()
+    return _result(TVSHOW, _clean_name(show), int(season), int(episode),
+                   teams=_split_teams(teams), pattern=name)
+
+
+def _parse_movie(filename):
+    """ Parse the movie names with a year. """
+    match = MOVIE_PATTERN.match(filename)
+    if not match:
+        return None
+    movie, year, teams = match.groups()
+    teams = _split_teams(teams)
+    part = None
+    for number in (1, 2):
+        if "cd{}".format(number) in teams:
+            teams.remove("cd{}".format(number))
+            part = number
+    return _result(MOVIE, _clean_name(movie), year=year, teams=teams,
+                   part=part, pattern="movie")
+
+
+def _parse_episode(filename, name):
+    """ Parse a name with the ep_regexes pattern called name. """
+    match = EP_PATTERNS[name].match(filename)
+    if not match:
+        return None
+    groups = match.groupdict()
+    date = None
+    if groups.get("air_year"):
+        date = "{}-{}-{}".format(groups["air_year"], groups["air_month"],
+                                 groups["air_day"])
+    extra = groups.get("extra_info") or ""
+    return _result(TVSHOW, _clean_name(groups.get("series_name")),
+                   _int(groups.get("season_num")), _int(groups.get("ep_num")),
+                   date=date,
+                   teams=[team for team in re.split(r"[. _]+", extra) if team],
+                   release_group=groups.get("release_group"), pattern=name)
+
+
+def _match(filename, name):
+    """ Return the ParseResult of the pattern called name, or None. """
+    if name == "tvshow":
+        return _parse_tvshow(filename, TVSHOW_PATTERN, name)
+    if name == "tvshow2":
+        return _parse_tvshow(filename, TVSHOW_PATTERN2, name)
+    if name == "movie":
+        return _parse_movie(filename)
+    return _parse_episode(filename, name)
+
+
+def route(filename):
+    """ Yield the names of the patterns that may match a file name.
+
+    Each pattern needs something in the name, like a S01E02 or a run of
+    digits. A scan of the digit runs and a few searches anchored on a
+    literal tell which of these are missing, and the patterns needing them
+    are skipped without running their backtracking regex. The names come
+    in the order of PATTERNS and each check is only made once the previous
+    patterns failed, so the usual S01E02 names cost a single search.
+    """
+    season_episode = SEASON_EPISODE.search(filename) is not None
+    if season_episode:
+        yield "tvshow"
+    runs = DIGITS.findall(filename)
+    if not runs:
+        # Only the parts numbered in roman numerals do without digits
+        if EPISODE_WORD.search(filename):
+            yield "no_season_general"
+        return
+    longest = len(max(runs, key=len))
+    cross = "x" in filename and CROSS.search(filename) is not None
+    if cross:
+        yield "tvshow2"
+    if season_episode:
+        yield "standard_repeat"
+    if cross:
+        yield "fov_repeat"
+    if season_episode:
+        yield "standard"
+    if cross:
+        yield "fov"
+    if longest >= 4 and DATE.search(filename):
+        yield "scene_date_format"
+    if "season" in filename and "episode" in filename:
+        yield "verbose"
+    if longest >= 4 and YEAR.search(filename):
+        yield "movie"
+    if longest >= 3:
+        if "-" in filename and len(runs[-1]) >= 3 and \
+                filename.endswith(runs[-1]):
+            yield "stupid"
+        yield "bare"
+    if season_episode or SEASON_NUMBER.search(filename):
+        yield "season_only"
+    if EPISODE_WORD.search(filename):
+        yield "no_season_general"
+    if longest >= 2:
+        yield "no_season"
+
+
+def _parse(filename, names=PATTERNS):
+    """ Parse a lower case file name without its extension. """
+    for name in names:
+        result = _match(filename, name)
+        if result is not None:
+            return result
+    return _result(UNKNOWN, filename)
+
+
+def file_key(filename):
+    """ Return the part of a file name that is parsed. """
+    name = os.path.basename(filename)
+    if name.lower().endswith(VIDEO_EXTENSIONS):
+        name = name.rsplit(".", 1)[0]
+    if isinstance(name, str):
+        name = name.decode("utf-8", "replace")
+    return name.lower()
+
+
+class _LRUCache(object):
+
+    """ Mapping keeping the maxsize entries used last, safe for threads. """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_CACHE = _LRUCache(CACHE_SIZE)
+
+
+def parse(filename):
+    """ Return the ParseResult of a video file name or path.
+
+    The patterns are compiled once at import and the results of the last
+    CACHE_SIZE names are kept, so the plugins searching the same file share
+    a single parse.
+    """
+    key = file_key(filename)
+    result = _CACHE.get(key)
+    if result is None:
+        result = _parse(key, route(key))
+        _CACHE.set(key, result)
+    return result
+
+
+def parse_many(filenames):
+    """ Return the ParseResult of each file name, in the same order.
+
+    Made for classifying whole library listings: each name is routed to
+    its candidate patterns, a name seen twice is parsed once and the
+    shared cache of parse is left alone, so a listing of thousands of files
+    does not evict the names the plugins are searching.
+    """
+    results, parsed = [], {}
+    for filename in filenames:
+        key = file_key(filename)
+        result = parsed.get(key)
+        if result is None:
+            result = parsed[key] = _parse(key, route(key))
+        results.append(result)
+    return results
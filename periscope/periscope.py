@@ -6,14 +6,26 @@
 from __future__ import absolute_import
 
 import os
+import time
 import threading
 import logging
+from collections import namedtuple
 from locale import getdefaultlocale
-from Queue import Queue
+from Queue import Queue, Empty
 
 import ConfigParser
 
 import periscope.plugins as plugins
+from periscope import fingerprint
+from periscope.helper import SESSION, write_subtitle
+from periscope.manager import PluginManager
+from periscope.cache import ResultCache
+from periscope.health import HealthRegistry
+from periscope.httpcache import HTTPCache
+from periscope.library import LibraryIndex, FOUND, NOT_FOUND, FAILED
+from periscope.ranking import rank_subtitles
+from periscope.pool import (WorkerPool, Future, plugin_host, DEFAULT_JOBS,
+                            DEFAULT_JOBS_PER_HOST, CancelledError)
 
 
 LOG = logging.getLogger(__name__)
@@ -24,17 +36,34 @@ SUPPORTED_FORMATS = (
     'video/mp4'
 )
 DEFAULT_LANG = ["en"]
+# Number of threads shared by all the searches started with alist_subtitles
+ENGINE_JOBS = 16
+# Files in progress for each job in download_many before reading more
+BACKLOG_PER_JOB = 4
 
+SUBTITLE_FOUND = "subtitle"
+PLUGIN_DONE = "done"
+SearchEvent = namedtuple("SearchEvent", "type plugin subtitle")
 
-def select_subtitle_auto(subtitles, langs=None):
-    """ Return the first subtile in the wanted language. """
+
+def select_subtitle_auto(subtitles, langs=None, reliability=None):
+    """ Return the best subtitle in the wanted languages, see ranking. """
+    ranked = rank_subtitles(subtitles, langs or DEFAULT_LANG, reliability)
+    return ranked[0] if ranked else None
+
+
+def filter_subtitles(subtitles, langs=None):
+    """ Return the subtitles in one of the wanted languages. """
     if not langs:
-        langs = DEFAULT_LANG
-    for lang in langs:
-        for subtitle in subtitles:
-            if subtitle['lang'] == lang:
-                return subtitle
-    return None
+        return list(subtitles)
+    return [sub for sub in subtitles if sub["lang"] in langs]
+
+
+def is_satisfying(subtitles, langs=None):
+    """ Return True if a subtitle is in the first wanted language. """
+    if not langs:
+        return bool(subtitles)
+    return any(sub["lang"] == langs[0] for sub in subtitles)
 
 
 def select_subtitle_interactive(subtitles):
@@ -66,6 +95,7 @@ class Periscope(object):
             "lang": "",
             "plugins": "",
             "lang-in-name": "no",
+            "libraries": "",
         })
         LOG.info("Log level : {}".format(LOG.getEffectiveLevel()))
         self.config_file = os.path.join(cache_folder, "config")
@@ -83,8 +113,33 @@ class Periscope(object):
         else:
             self.config.read(self.config_file)
 
-        self.plugins = self.prefered_plugins
+        self.plugins = self._get_plugins(self.prefered_plugins)
         self._prefered_languages = None
+        self.plugin_manager = PluginManager(self.config, self.cache_path)
+        self._engine = None
+        self._engine_lock = threading.Lock()
+        self.result_cache = ResultCache(self.cache_path, self.config)
+        self.health = HealthRegistry(os.path.join(self.cache_path, "health"))
+        self.library = LibraryIndex(os.path.join(self.cache_path,
+                                                 "library.db"))
+        fingerprint.set_cache_folder(self.cache_path)
+        SESSION.set_cache(HTTPCache(os.path.join(self.cache_path, "http")))
+
+    def close(self):
+        """ Close the plugins, their sessions stay cached on disk. """
+        if self._engine:
+            self._engine.close()
+        self.plugin_manager.close()
+        SESSION.close()
+        self.health.flush()
+        self.library.close()
+        fingerprint.flush()
+
+    def flush(self):
+        """ Write the plugin health, library index and fingerprints. """
+        self.health.flush()
+        self.library.flush()
+        fingerprint.flush()
 
     def _set_config_value(self, config, value, is_list=False):
         """ Update config and save to config file. """
@@ -114,7 +169,7 @@ class Periscope(object):
         if not value:
             try:
                 value = [getdefaultlocale()[0][:2]]
-            except (IndexError, ValueError):
+            except (IndexError, TypeError, ValueError):
                 value = DEFAULT_LANG
                 LOG.info(" Default value lang : {}".format(value))
         return value
@@ -126,10 +181,11 @@ class Periscope(object):
 
     @property
     def prefered_plugins(self):
-        """ Get prefered_plugins value from config. """
-        value = self.config.get("DEFAULT", "plugins")
+        """ Get the names of the prefered plugins from config. """
+        value = self._get_config_value("plugins", True)
         if not value:
-            value = self.list_existing_plugins()
+            value = [spec.name for spec in self.list_existing_plugins()
+                     if spec.default]
         return value
 
     @prefered_plugins.setter
@@ -137,6 +193,11 @@ class Periscope(object):
         """ Set prefered_plugins value in config. """
         self._set_config_value("plugins", value, True)
 
+    @property
+    def library_roots(self):
+        """ Get the folders of the video libraries from config. """
+        return self._get_config_value("libraries", True)
+
     @property
     def prefered_naming(self):
         """ Get prefered_naming value from config. """
@@ -151,76 +212,464 @@ class Periscope(object):
         value = "yes" if value else "no"
         self._set_config_value("lang_in_name", value)
 
+    @staticmethod
+    def _get_plugins(names):
+        """ Return the specs of the plugins called names. """
+        specs = []
+        for name in names:
+            spec = plugins.get_plugin(name)
+            if spec is None:
+                LOG.warn("No plugin with the name {} exists".format(name))
+            elif spec not in specs:
+                specs.append(spec)
+        return specs
+
     def deactivate_plugin(self, plugin):
-        """ Remove a plugin from the list. """
-        self.plugins -= plugin
-        self.prefered_plugins = self.plugins
+        """ Remove a plugin from the list, by name. """
+        self.plugins = [spec for spec in self.plugins
+                        if spec.name.lower() != plugin.lower()]
+        self.prefered_plugins = [spec.name for spec in self.plugins]
 
     def activate_plugin(self, plugin):
-        """ Activate a plugin. """
-        if plugin not in self.list_existing_plugins():
+        """ Activate a plugin, by name. Its module is imported when used. """
+        spec = plugins.get_plugin(plugin)
+        if spec is None:
             raise ImportError("No plugin with the name {} exists".
                               format(plugin))
-        self.plugins += plugin
-        self.prefered_plugins = self.plugins
+        if spec not in self.plugins:
+            self.plugins.append(spec)
+        self.prefered_plugins = [spec.name for spec in self.plugins]
 
     def list_active_plugins(self):
         """ Return all active plugins. """
         return self.plugins
 
+    def plugin_reliability(self, name):
+        """ Return the recent success rate of a plugin, from 0 to 1. """
+        return self.health.stats(name)["success_rate"]
+
+    def rank_subtitles(self, subtitles, langs=None):
+        """ Return the subtitles in langs, the best first, see ranking. """
+        return rank_subtitles(subtitles, langs or DEFAULT_LANG,
+                              self.plugin_reliability)
+
+    def plugin_health(self, plugin_class):
+        """ Return a summary of the recent health of a plugin. """
+        return self.health.describe(plugin_class.__name__)
+
     @classmethod
     def list_existing_plugins(cls):
-        """ List all possible plugins from the plugin folder. """
+        """ List the specs of all the plugins of the plugin folder. """
         return plugins.EXISTING_PLUGINS
 
-    def list_subtitles(self, filename, langs=None):
-        """ Return all matching subtitles using the active plugins. """
+    def iter_subtitles(self, filename, langs=None, deadline=None):
+        """ Yield the search events as soon as the plugins produce them.
+
+        A SearchEvent of type SUBTITLE_FOUND is yielded for each matching
+        subtitle, then one of type PLUGIN_DONE when a plugin has finished.
+        With a deadline (in seconds), the generator stops once it passed.
+        Closing the generator leaves the plugins still searching running in
+        the background, their results are dropped.
+        """
         LOG.info(" Searching subtitles for {} with langs {}".
                  format(filename, langs))
-        subtitles = []
         queue = Queue()
         for plugin_class in self.plugins:
+            thread = threading.Thread(
+                target=self._search_in_thread,
+                args=(queue, plugin_class, filename, langs))
+            # Do not keep the process alive for an abandoned search
+            thread.daemon = True
+            thread.start()
+
+        end = time.time() + deadline if deadline is not None else None
+        for remaining in range(len(self.plugins), 0, -1):
             try:
-                plugin = plugin_class(self.config, self.cache_path)
-                LOG.info(" Searching on {}".format(plugin_class.__name__))
-                thread = threading.Thread(
-                    target=plugin.search_in_thread,
-                    args=(queue, filename, langs))
-                thread.start()
-            except ImportError:
-                LOG.error("Plugin {} is not a valid plugin name. Skipping it.".
-                    format(plugin_class.__name__))
-
-        # Get data from the queue and wait till we have a result
-        for _ in self.plugins:
-            subs = queue.get(True)
-            if subs and len(subs) > 0:
-                if not langs:
-                    subtitles += subs
+                if end is None:
+                    plugin_class, subs = queue.get(True)
                 else:
-                    for sub in subs:
-                        if sub["lang"] in langs:
-                            subtitles.append(sub)
+                    plugin_class, subs = queue.get(
+                        True, max(0, end - time.time()))
+            except Empty:
+                LOG.warn("Deadline reached, {} plugins did not answer".
+                         format(remaining))
+                return
+            for sub in subs:
+                yield SearchEvent(SUBTITLE_FOUND, plugin_class.__name__, sub)
+            yield SearchEvent(PLUGIN_DONE, plugin_class.__name__, None)
+
+    def list_subtitles(self, filename, langs=None, deadline=None,
+                       satisfice=False):
+        """ Return all matching subtitles using the active plugins.
+
+        With a deadline (in seconds), only the subtitles found in time are
+        returned. With satisfice, the search stops as soon as a subtitle in
+        the first wanted language is found. The plugins still searching are
+        left running in the background and their results are dropped.
+        """
+        subtitles = []
+        for event in self.iter_subtitles(filename, langs, deadline):
+            if event.type == SUBTITLE_FOUND:
+                subtitles.append(event.subtitle)
+            elif satisfice and is_satisfying(subtitles, langs):
+                LOG.info("Found a subtitle in the first language, the other"
+                         " plugins are not waited for")
+                break
         LOG.debug("{} subtitles has been returned." .format(len(subtitles)))
         return subtitles
 
-    def download_subtitle(self, filename, langs=None):
-        """ Dowload only the best subtitle for the file. """
-        subtitles = self.list_subtitles(filename, langs)
-        return self.attempt_download_subtitle(subtitles, langs)
+    def alist_subtitles(self, filename, langs=None, deadline=None,
+                        satisfice=False):
+        """ Start the search of the subtitles and return a Future of them.
+
+        Unlike list_subtitles, no thread is started for the search: every
+        plugin search is a task of an engine shared by all the searches of
+        this object, which runs at most ENGINE_JOBS of them at a time and
+        DEFAULT_JOBS_PER_HOST on the same site. The deadline and satisfice
+        arguments behave like in list_subtitles. Cancelling the returned
+        future cancels the plugin searches that did not start yet.
+        """
+        LOG.info(" Searching subtitles for {} with langs {}".
+                 format(filename, langs))
+        engine = self._get_engine()
+        future = Future()
+        lock = threading.Lock()
+        state = {"subtitles": [], "remaining": len(self.plugins)}
+        searches = []
+
+        def collect(search):
+            """ Add the result of a plugin search. """
+            with lock:
+                if future.done():
+                    return
+                try:
+                    state["subtitles"] += search.result()
+                except Exception:
+                    LOG.debug("A plugin search was cancelled or failed")
+                state["remaining"] -= 1
+                complete = not state["remaining"] or (
+                    satisfice and is_satisfying(state["subtitles"], langs))
+                if complete:
+                    future.set_result(state["subtitles"])
+
+        def expire():
+            """ Give up on the plugins that did not answer in time. """
+            with lock:
+                if future.set_result(list(state["subtitles"])):
+                    LOG.warn("Deadline reached, {} plugins did not answer".
+                             format(state["remaining"]))
+
+        def abandon(_):
+            """ Cancel the searches that are not needed anymore. """
+            for search in searches:
+                search.cancel()
 
-    def attempt_download_subtitle(self, subtitles, langs):
-        """ Attempt to download the best available subtitle in the list. """
-        subtitle = select_subtitle_auto(subtitles, langs)
-        if not subtitle:
+        for plugin_class in self.plugins:
+            searches.append(engine.submit(plugin_host(plugin_class),
+                                          self._search_plugin, plugin_class,
+                                          filename, langs))
+        if not self.plugins:
+            future.set_result([])
+        if deadline is not None:
+            timer = threading.Timer(deadline, expire)
+            timer.daemon = True
+            timer.start()
+            future.add_done_callback(lambda _: timer.cancel())
+        future.add_done_callback(abandon)
+        for search in searches:
+            search.add_done_callback(collect)
+        return future
+
+    def _get_engine(self):
+        """ Return the pool shared by the alist_subtitles searches. """
+        with self._engine_lock:
+            if self._engine is None:
+                self._engine = WorkerPool(ENGINE_JOBS, DEFAULT_JOBS_PER_HOST)
+            return self._engine
+
+    def _search_plugin(self, plugin_class, filename, langs):
+        """ Search a single plugin and return the subtitles in langs.
+
+        Plugins whose circuit is open in the health registry are skipped.
+        """
+        name = plugin_class.__name__
+        cached = self.result_cache.get(plugin_class, filename, langs)
+        # Checked before the plugin is created, which may log in
+        if cached is None and not self.health.allow(name):
+            LOG.info(" Skipping {}, it failed too often lately".format(name))
+            return []
+        start = time.time()
+        subs = None
+        action = "be created"
+        try:
+            with self.plugin_manager.plugin(plugin_class) as plugin:
+                if cached is not None:
+                    for sub in cached:
+                        sub["plugin"] = plugin
+                    return filter_subtitles(cached, langs)
+                LOG.info(" Searching on {}".format(name))
+                action = "search {}".format(filename)
+                subs = plugin.search(filename, langs)
+        except Exception:
+            LOG.exception("Plugin {} could not {}. Skipping it.".
+                          format(name, action))
+            if cached is not None:
+                return []
+        # Also ends the probe of a half-open circuit when the search failed
+        self.health.record(name, subs is not None, time.time() - start)
+        if subs is None:
+            self.library.record_search(filename, name, FAILED)
+            return []
+        subs = filter_subtitles(subs, langs)
+        self.library.record_search(filename, name,
+                                   FOUND if subs else NOT_FOUND)
+        self.result_cache.set(plugin_class, filename, langs, subs)
+        return subs
+
+    def _search_in_thread(self, queue, plugin_class, filename, langs):
+        """ Put the result of _search_plugin on the queue. """
+        # Each plugin must write something, iter_subtitles waits for it
+        queue.put((plugin_class,
+                   self._search_plugin(plugin_class, filename, langs)), True)
+
+    def download_subtitle(self, filename, langs=None, deadline=None,
+                          satisfice=False, speculate=1):
+        """ Dowload only the best subtitle for the file. """
+        subtitles = self.list_subtitles(filename, langs, deadline, satisfice)
+        return self._download_file(filename, subtitles, langs, speculate)
+
+    def download_many(self, videos, langs=None, jobs=DEFAULT_JOBS,
+                      jobs_per_host=DEFAULT_JOBS_PER_HOST, deadline=None,
+                      satisfice=False, callback=None, speculate=1):
+        """ Download the best subtitle of every video on a shared pool.
+
+        Each (video, plugin) search is its own task, so a slow site only
+        holds one worker instead of blocking a whole file, and no more than
+        jobs_per_host requests hit the same site at once. The download of a
+        video is queued as soon as its last search is done, or, like in
+        list_subtitles, once deadline seconds passed since its first search
+        started or a subtitle in the first language is found (satisfice).
+        videos can be any iterable, like a LibraryWalker: it is consumed
+        lazily, no more than BACKLOG_PER_JOB files for each job are in
+        progress at a time. callback, if given, is called from the workers
+        with the path and the downloaded subtitle, or None, as soon as each
+        video is processed. speculate is given to
+        attempt_download_subtitle. Return the list of downloaded subtitles.
+        """
+        downloaded = []
+        backlog = max(1, jobs) * BACKLOG_PER_JOB
+        condition = threading.Condition()
+        outstanding = [0]
+
+        def file_done(filename, subtitle=None):
+            """ Mark a video as completely processed. """
+            if callback is not None:
+                try:
+                    callback(filename, subtitle)
+                except Exception:
+                    LOG.exception("Callback failed for {}".format(filename))
+            with condition:
+                outstanding[0] -= 1
+                condition.notify_all()
+
+        def download(filename, subtitles):
+            """ Download the best subtitle of a video. """
+            subtitle = None
+            try:
+                subtitle = self._download_file(filename, subtitles, langs,
+                                               speculate)
+                if subtitle:
+                    with condition:
+                        downloaded.append(subtitle)
+            finally:
+                file_done(filename, subtitle)
+
+        def finish(pool, filename, state):
+            """ Queue the download of a video, only once. """
+            with condition:
+                if state["done"]:
+                    return
+                state["done"] = True
+                subtitles = list(state["subtitles"])
+            if state["timer"]:
+                state["timer"].cancel()
+            best = select_subtitle_auto(subtitles, langs,
+                                        self.plugin_reliability)
+            if best:
+                pool.submit(plugin_host(type(best["plugin"])), download,
+                            filename, subtitles)
+            else:
+                LOG.error("No subtitles could be chosen for {}.".
+                          format(filename))
+                self.library.record_file(filename, NOT_FOUND)
+                file_done(filename)
+
+        def search(pool, plugin_class, filename, state):
+            """ Search one plugin and queue the download after the last. """
+            with condition:
+                if state["done"]:
+                    return
+                if deadline is not None and not state["timer"]:
+                    state["timer"] = threading.Timer(
+                        deadline, finish, (pool, filename, state))
+                    state["timer"].daemon = True
+                    state["timer"].start()
+            subs = self._search_plugin(plugin_class, filename, langs)
+            with condition:
+                if state["done"]:
+                    return
+                state["subtitles"] += subs
+                state["remaining"] -= 1
+                complete = not state["remaining"] or (
+                    satisfice and is_satisfying(subs, langs))
+            if complete:
+                finish(pool, filename, state)
+
+        pool = WorkerPool(jobs, jobs_per_host)
+        try:
+            for filename in videos:
+                LOG.info(" Searching subtitles for {} with langs {}".
+                         format(filename, langs))
+                state = {"subtitles": [], "remaining": len(self.plugins),
+                         "done": False, "timer": None}
+                with condition:
+                    while outstanding[0] >= backlog:
+                        condition.wait(0.5)
+                    outstanding[0] += 1
+                for plugin_class in self.plugins:
+                    pool.submit(plugin_host(plugin_class), search, pool,
+                                plugin_class, filename, state)
+                if not self.plugins:
+                    file_done(filename)
+            with condition:
+                while outstanding[0]:
+                    # A timeout keeps the main thread responsive to ctrl+c
+                    condition.wait(0.5)
+        finally:
+            # Abandoned searches are left to the daemon workers
+            pool.close()
+        return downloaded
+
+    def _download_file(self, filename, subtitles, langs, speculate=1):
+        """ Download the best subtitle of a file and record the outcome. """
+        outcome = FAILED if subtitles else NOT_FOUND
+        subtitle = self.attempt_download_subtitle(subtitles, langs, speculate)
+        self.library.record_file(filename, FOUND if subtitle else outcome)
+        return subtitle
+
+    def attempt_download_subtitle(self, subtitles, langs, speculate=1):
+        """ Download the best subtitle of the list that can be downloaded.
+
+        The subtitles are tried in the order of rank_subtitles, the ones
+        that fail are removed from the list. With speculate above 1, the
+        next speculate candidates are fetched in memory at once and the
+        first valid one is written, see _fetch_first.
+        """
+        ranked = self.rank_subtitles(subtitles, langs)
+        if not ranked:
             LOG.error("No subtitles could be chosen.")
             return None
-        LOG.info("Trying to download subtitle: {}".format(subtitle['link']))
-        subpath = subtitle["plugin"].create_file(subtitle)
-        if subpath:
-            subtitle["subtitlepath"] = subpath
-            return subtitle
-        LOG.warn(("Subtitle {} could not be downloaded, "
-                  "trying the next on the list.").format(subtitle['link']))
-        subtitles.remove(subtitle)
-        return self.attempt_download_subtitle(subtitles, langs)
+        if speculate > 1:
+            for start in range(0, len(ranked), speculate):
+                candidates = ranked[start:start + speculate]
+                subtitle = self._fetch_first(candidates, subtitles)
+                if subtitle:
+                    return subtitle
+                LOG.warn("None of the {} subtitles fetched at once could be "
+                         "downloaded, trying the next on the list.".
+                         format(len(candidates)))
+            return None
+        for subtitle in ranked:
+            LOG.info("Trying to download subtitle: {}".
+                     format(subtitle['link'] or subtitle.get('page')))
+            subpath = self._create_file(subtitle)
+            if subpath:
+                subtitle["subtitlepath"] = subpath
+                return subtitle
+            LOG.warn(("Subtitle {} could not be downloaded, "
+                      "trying the next on the list.").
+                     format(subtitle['link'] or subtitle.get('page')))
+            subtitles.remove(subtitle)
+        return None
+
+    def _fetch_first(self, candidates, subtitles):
+        """ Fetch candidates in parallel and write the first valid one.
+
+        Return the subtitle written or None. The fetches that did not start
+        are cancelled once one succeeds, the running ones are ignored. The
+        failed candidates are removed from subtitles.
+        """
+        done = Queue()
+        stop = threading.Event()
+        engine = self._get_engine()
+        futures = []
+        for subtitle in candidates:
+            LOG.info("Fetching subtitle: {}".
+                     format(subtitle['link'] or subtitle.get('page')))
+            future = engine.submit(plugin_host(type(subtitle["plugin"])),
+                                   self._fetch_subtitle, subtitle, stop)
+            future.add_done_callback(
+                lambda future, subtitle=subtitle: done.put((subtitle,
+                                                            future)))
+            futures.append(future)
+        try:
+            for _ in candidates:
+                while True:
+                    try:
+                        # A timeout keeps the thread responsive to ctrl+c
+                        subtitle, future = done.get(True, 0.5)
+                        break
+                    except Empty:
+                        pass
+                try:
+                    fetched = future.result(0)
+                except CancelledError:
+                    fetched = None
+                if fetched:
+                    subpath = write_subtitle(subtitle["filename"], *fetched)
+                    subtitle["subtitlepath"] = subpath
+                    return subtitle
+                subtitles.remove(subtitle)
+            return None
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+
+    def _fetch_subtitle(self, subtitle, stop):
+        """ Fetch a subtitle in memory, None on failure or once stopped. """
+        if stop.is_set():
+            return None
+        plugin_class = type(subtitle["plugin"])
+        name = plugin_class.__name__
+        if not self.health.allow(name):
+            LOG.info("Skipping the download from {}, it failed too often "
+                     "lately".format(name))
+            return None
+        start = time.time()
+        try:
+            with self.plugin_manager.plugin(plugin_class) as plugin:
+                fetched = plugin.fetch(subtitle)
+        except Exception:
+            LOG.exception("Download from {} failed".format(name))
+            fetched = None
+        self.health.record(name, fetched is not None, time.time() - start)
+        return fetched
+
+    def _create_file(self, subtitle):
+        """ Download a subtitle, return its path or None on failure. """
+        plugin_class = type(subtitle["plugin"])
+        name = plugin_class.__name__
+        if not self.health.allow(name):
+            LOG.info("Skipping the download from {}, it failed too often "
+                     "lately".format(name))
+            return None
+        start = time.time()
+        try:
+            with self.plugin_manager.plugin(plugin_class) as plugin:
+                subpath = plugin.create_file(subtitle)
+        except Exception:
+            LOG.exception("Download from {} failed".format(name))
+            subpath = None
+        self.health.record(name, bool(subpath), time.time() - start)
+        return subpath
@@ -17,10 +17,14 @@
 #    along with periscope; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-import zipfile, os, urllib2, urllib, logging, traceback, httplib, re, socket
-from BeautifulSoup import BeautifulSoup
-
+import zipfile, os, urllib2, urllib, logging, traceback, httplib, re
 import SubtitleDatabase
+from periscope.markup import extract
+from periscope.policy import RequestPolicy
+from periscope.titles import get_title_index
+
+# The links of the show list to the shows
+SHOW_LINK = re.compile(r"^/show/\d+")
 
 LANGUAGES = {u"English" : "en",
 			 u"English (US)" : "en",
@@ -54,6 +58,9 @@ LANGUAGES = {u"English" : "en",
 
 class Addic7ed(SubtitleDatabase.SubtitleDB):
 	url = "http://www.addic7ed.com"
+	policy = RequestPolicy(connect_timeout=3, read_timeout=3)
+	# The episode pages are shared by the releases of an episode
+	page_freshness = ((r"/serie/", 6 * 60 * 60),)
 	site_name = "Addic7ed"
 
 	def __init__(self, config, cache_folder_path):
@@ -61,13 +68,22 @@ class Addic7ed(SubtitleDatabase.SubtitleDB):
 		#http://www.addic7ed.com/serie/Smallville/9/11/Absolute_Justice
 		self.host = "http://www.addic7ed.com"
 		self.release_pattern = re.compile(" \nVersion (.+), ([0-9]+).([0-9])+ MBs")
+		# The titles as the site spells them in its urls
+		self.shows = get_title_index(cache_folder_path, self.site_name,
+			self._load_shows)
+
+	def _load_shows(self):
+		''' Return the (title, title) of the shows listed on the site '''
+		page = self.request("%s/shows.php" % self.host)
+		links = extract(page.read(), ("a", {"href": SHOW_LINK}))
+		return [(link.text, link.text) for link in links if link.text.strip()]
 		
 
 	def process(self, filepath, langs):
 		''' main method to call on the plugin, pass the filename and the wished 
 		languages and it will query the subtitles source '''
-		fname = unicode(self.getFileName(filepath).lower())
-		guessedData = self.guessFileData(fname)
+		fname = unicode(self.get_file_name(filepath).lower())
+		guessedData = self.guess_file_data(fname)
 		if guessedData['type'] == 'tvshow':
 			subs = self.query(guessedData['name'], guessedData['season'], guessedData['episode'], guessedData['teams'], langs)
 			return subs
@@ -77,28 +93,36 @@ class Addic7ed(SubtitleDatabase.SubtitleDB):
 	def query(self, name, season, episode, teams, langs=None):
 		''' makes a query and returns info (link, lang) about found subtitles'''
 		sublinks = []
-		name = name.lower().replace(" ", "_")
+		title = self.shows.get(name)
+		if title is None and len(self.shows):
+			logging.debug("Unknown show %s" % name)
+			return sublinks
+		# Without the show list, the title of the file is tried
+		name = (title or name).lower().replace(" ", "_")
 		searchurl = "%s/serie/%s/%s/%s/%s" %(self.host, name, season, episode, name)
 		logging.debug("dl'ing %s" %searchurl)
 		try:
-			socket.setdefaulttimeout(3)
-			page = urllib2.urlopen(searchurl)
+			page = self.request(searchurl)
 		except urllib2.HTTPError as inst:
 			logging.info("Error : %s - %s" %(searchurl, inst))
-			return sublinks
+			# Only a missing page means there is no subtitle
+			return sublinks if inst.code == 404 else None
 		except urllib2.URLError as inst:
 			logging.info("TimeOut : %s" %inst)
-			return sublinks
+			return None
 		
 		#HTML bug in addic7ed
 		content = page.read()
 		content = content.replace("The safer, easier way", "The safer, easier way \" />")
 		
-		soup = BeautifulSoup(content)
-		for subs in soup("td", {"class":"NewsTitle", "colspan" : "3"}):
-			if not self.release_pattern.match(str(subs.contents[1])):
+		# The following rows of a version are read with findNext, the
+		# tables holding them are kept until the end of the loop
+		tables = extract(content, "table", nested=False)
+		titles = [td for table in tables for td in table("td", {"class":"NewsTitle", "colspan" : "3"})]
+		for subs in titles:
+			if not self.release_pattern.match(unicode(subs.contents[1])):
 				continue
-			subteams = self.release_pattern.match(str(subs.contents[1])).groups()[0].lower()
+			subteams = self.release_pattern.match(unicode(subs.contents[1])).groups()[0].lower()
 			
 			# Addic7ed only takes the real team	into account
 			fteams = []
@@ -152,16 +176,5 @@ class Addic7ed(SubtitleDatabase.SubtitleDB):
 		videofilename = subtitle["filename"]
 		srtbasefilename = videofilename.rsplit(".", 1)[0]
 		srtfilename = srtbasefilename +".srt"
-		self.downloadFile(suburl, srtfilename)
+		self.download_file(suburl, srtfilename)
 		return srtfilename
-
-	def downloadFile(self, url, srtfilename):
-		''' Downloads the given url to the given filename '''
-		req = urllib2.Request(url, headers={'Referer' : url, 'User-Agent' : 'Mozilla/5.0 (X11; U; Linux x86_64; en-US; rv:1.9.1.3)'})
-		
-		f = urllib2.urlopen(req)
-		dump = open(srtfilename, "wb")
-		dump.write(f.read())
-		dump.close()
-		f.close()
-		logging.debug("Download finished to file %s. Size : %s"%(srtfilename,os.path.getsize(srtfilename)))
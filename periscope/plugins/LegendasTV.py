@@ -32,16 +32,25 @@ import shutil
 import ConfigParser
 
 import cookielib, urllib2, urllib, sys, re, os, webbrowser, time, unicodedata, logging
-from BeautifulSoup import BeautifulSoup, BeautifulStoneSoup
 from htmlentitydefs import name2codepoint as n2cp
 
 #from utilities import log
 
 import SubtitleDatabase
 import subprocess
+import threading
+from urlparse import urlsplit
+from periscope.markup import extract
+from periscope.sessions import (get_session_store, load_cookie_jar,
+                                cookie_expiry)
+from periscope.titles import normalize
 
 log = logging.getLogger(__name__)
 
+# Taken while logging in, so the instances do it once for all
+LOGIN_LOCK = threading.Lock()
+USER_AGENT = 'Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.2; .NET CLR 1.1.4322)'
+
 class LegendasTV(SubtitleDatabase.SubtitleDB):
     url = "http://legendas.tv"
     site_name = "LegendasTV"
@@ -49,13 +58,12 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
 
     def __init__(self, config, cache_folder_path ):
         super(LegendasTV, self).__init__(None)
-        self.tvshowRegex = re.compile('(?P<show>.*)S(?P<season>[0-9]{2})E(?P<episode>[0-9]{2}).(?P<teams>.*)', re.IGNORECASE)
-        self.tvshowRegex2 = re.compile('(?P<show>.*).(?P<season>[0-9]{1,2})x(?P<episode>[0-9]{1,2}).(?P<teams>.*)', re.IGNORECASE)
-        self.movieRegex = re.compile('(?P<movie>.*)[\_\.|\[|\(| ]{1}(?P<year>(?:(?:19|20)[0-9]{2}))(?P<teams>.*)', re.IGNORECASE)
         self.user = None
         self.password = None
         self.unrar = None
         self.sub_ext = None
+        self.sessions = get_session_store(cache_folder_path)
+        self.cookie_jar = load_cookie_jar(cache_folder_path, self.site_name)
         try:
             self.user = config.get("LegendasTV","user")
             self.password = config.get("LegendasTV","pass")
@@ -81,7 +89,7 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
             return []
         arquivo = self.getFileName(filepath)
         dados = {}
-        dados = self.guessFileData(arquivo)
+        dados = self.guess_file_data(arquivo)
         log.debug(dados)
         if dados['type'] == 'tvshow':
             subtitles = self.LegendasTVSeries(filepath,dados['name'], str(dados['season']), str(dados['episode']),langs)
@@ -99,59 +107,42 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
             fname = filename
         return fname
 
-    def guessFileData(self, filename):
-        filename = unicode(self.getFileName(filename).lower())
-        matches_tvshow = self.tvshowRegex.match(filename)
-        if matches_tvshow: # It looks like a tv show
-            (tvshow, season, episode, teams) = matches_tvshow.groups()
-            tvshow = tvshow.replace(".", " ").strip()
-            tvshow = tvshow.replace("_", " ").strip()
-            teams = teams.split('.')
-            if len(teams) ==1:
-                teams = teams[0].split('_')
-            return {'type' : 'tvshow', 'name' : tvshow.strip(), 'season' : int(season), 'episode' : int(episode), 'teams' : teams}
-        else:
-            matches_tvshow = self.tvshowRegex2.match(filename)
-            if matches_tvshow:
-                (tvshow, season, episode, teams) = matches_tvshow.groups()
-                tvshow = tvshow.replace(".", " ").strip()
-                tvshow = tvshow.replace("_", " ").strip()
-                teams = teams.split('.')
-                if len(teams) ==1:
-                    teams = teams[0].split('_')
-                return {'type' : 'tvshow', 'name' : tvshow.strip(), 'season' : int(season), 'episode' : int(episode), 'teams' : teams}
-            else:
-                matches_movie = self.movieRegex.match(filename)
-                if matches_movie:
-                    (movie, year, teams) = matches_movie.groups()
-                    movie = movie.replace(".", " ").strip()
-                    movie = movie.replace("_", " ").strip()
-                    teams = teams.split('.')
-                    if len(teams) ==1:
-                        teams = teams[0].split('_')
-                    part = None
-                    if "cd1" in teams :
-                            teams.remove('cd1')
-                            part = 1
-                    if "cd2" in teams :
-                            teams.remove('cd2')
-                            part = 2
-                    return {'type' : 'movie', 'name' : movie.strip(), 'year' : year, 'teams' : teams, 'part' : part}
-                else:
-                    return {'type' : 'unknown', 'name' : filename, 'teams' : [] }
+    def open(self, url, data=None):
+        '''Fetch the url with the session cookies, on a kept-alive connection'''
+        return self.request(url, data, headers={'User-Agent': USER_AGENT},
+                            cookie_jar=self.cookie_jar)
 
+    def session_expiry(self):
+        '''Return when the cookies of the site expire, None without cookies'''
+        return cookie_expiry(self.cookie_jar, urlsplit(self.url).netloc)
+
+    def logged_in(self):
+        '''Return True if the shared cookie jar holds a valid session of the user'''
+        return self.session_expiry() is not None and \
+            self.sessions.get(self.site_name) == self.user
 
     def LegendasTVLogin(self):
-        '''Function for login on LegendasTV using username and password from config file'''
-        cj = cookielib.MozillaCookieJar()
-        opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
-        opener.addheaders = [('User-agent', ('Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.2; .NET CLR 1.1.4322)'))]
-        urllib2.install_opener(opener)
-        username = self.user
-        password = self.password
-        login_data = urllib.urlencode({'txtLogin':username,'txtSenha':password})
-        request = urllib2.Request(self.url+'/login_verificar.php',login_data)
-        response = urllib2.urlopen(request).read()
+        '''Function for login on LegendasTV using username and password from config file.
+        The cookie jar is shared by the instances and saved in the cache folder, the
+        session is reused until its cookies expire'''
+        if self.logged_in():
+            return
+        with LOGIN_LOCK:
+            # Another instance may have logged in while this one waited
+            if self.logged_in():
+                return
+            username = self.user
+            password = self.password
+            login_data = urllib.urlencode({'txtLogin':username,'txtSenha':password})
+            response = self.open(self.url+'/login_verificar.php',login_data).read()
+            expiry = self.session_expiry()
+            if expiry is None:
+                log.warn("LegendasTV did not set a session cookie, check the user and password")
+                return
+            # The user the cookies belong to, for as long as they last
+            self.sessions.set(self.site_name, self.user, expiry - time.time())
+            if self.cookie_jar.filename:
+                self.cookie_jar.save()
 
     def createFile(self, subtitle):
         '''pass the ID of the sub and the file it matches, will unzip it
@@ -198,8 +189,7 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
         extract_path = os.path.join(srtfilename.replace(self.getFileName(srtfilename),''), str(url))
 
         url_request = self.url+'/info.php?d='+url+'&c=1'
-        request =  urllib2.Request(url_request)
-        response = urllib2.urlopen(request)
+        response = self.open(url_request)
         ltv_sub = response.read()
         os.makedirs(extract_path)
         fname = os.path.join(extract_path,str(url))
@@ -292,8 +282,7 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
         search_string = self.getFileName(file_original_path)[:50]
         search_dict = {'txtLegenda':search_string,'selTipo':'1','int_idioma':langCode}
         search_data = urllib.urlencode(search_dict)
-        request = urllib2.Request(self.url+'/index.php?opcao=buscarlegenda',search_data)
-        response = self.to_unicode_or_bust(urllib2.urlopen(request).read())
+        response = self.to_unicode_or_bust(self.open(self.url+'/index.php?opcao=buscarlegenda',search_data).read())
 
 
         # If no subtitles with the original name are found, try the parsed title.
@@ -303,8 +292,7 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
             if len(search_string) < 3: search_string = search_string + year
             search_dict = {'txtLegenda':search_string,'selTipo':'1','int_idioma':langCode}
             search_data = urllib.urlencode(search_dict)
-            request = urllib2.Request(self.url+'/index.php?opcao=buscarlegenda',search_data)
-            response = self.to_unicode_or_bust(urllib2.urlopen(request).read())
+            response = self.to_unicode_or_bust(self.open(self.url+'/index.php?opcao=buscarlegenda',search_data).read())
 
         # Retrieves the number of pages.
         pages = re.findall("<a class=\"paginacao\" href=",response)
@@ -314,12 +302,11 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
         # Download all pages content.
         for x in range(pages):
             if x:
-                html = urllib2.urlopen(self.url+'/index.php?opcao=buscarlegenda&pagina='+str(x+1)).read()
+                html = self.open(self.url+'/index.php?opcao=buscarlegenda&pagina='+str(x+1)).read()
                 response = response + self.to_unicode_or_bust(html)
 
-        # Parse all content to BeautifulSoup
-        soup = BeautifulSoup(response)
-        td_results =  soup.findAll('td',{'id':'conteudodest'})
+        # Extract the result cells of all the pages
+        td_results = extract(response, ('td',{'id':'conteudodest'}))
         for td in td_results:
             span_results = td.findAll('span')
             for span in span_results:
@@ -376,11 +363,10 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
 
         search_string = self.getFileName(file_original_path)[:50]
 
-        # Doing the search and parsing the results to BeautifulSoup
+        # Doing the search and extracting the results
         search_dict = {'txtLegenda':search_string,'selTipo':'1','int_idioma':langCode}
         search_data = urllib.urlencode(search_dict)
-        request = urllib2.Request(self.url+'/index.php?opcao=buscarlegenda',search_data)
-        response = self.to_unicode_or_bust(urllib2.urlopen(request).read())
+        response = self.to_unicode_or_bust(self.open(self.url+'/index.php?opcao=buscarlegenda',search_data).read())
 
         # If no subtitles with the original name are found, try the parsed title.
         if response.__contains__('Nenhuma legenda foi encontrada'):
@@ -388,14 +374,15 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
             search_string = tvshow + " " +"S"+ss+"E"+ee
             search_dict = {'txtLegenda':search_string,'selTipo':'1','int_idioma':langCode}
             search_data = urllib.urlencode(search_dict)
-            request = urllib2.Request(self.url+'/index.php?opcao=buscarlegenda',search_data)
-            response = self.to_unicode_or_bust(urllib2.urlopen(request).read())
+            response = self.to_unicode_or_bust(self.open(self.url+'/index.php?opcao=buscarlegenda',search_data).read())
 
         page = self.to_unicode_or_bust(response)
-        soup = BeautifulSoup(page)
+        # The cell is kept for the parents of the spans inside
+        td_results = extract(page, ('td',{'id':'conteudodest'}))
 
-        span_results = soup.find('td',{'id':'conteudodest'}).findAll('span')
+        span_results = td_results[0].findAll('span')
 
+        key = normalize(tvshow)
         for span in span_results:
         # Jumping season packs
             if span.attrs == [('class', 'brls')]:
@@ -435,13 +422,12 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
             if ltv_lang == "pt": ltv_lang = "pt"
             if ltv_lang == "es": ltv_lang = "es"
 
-            # Compares the parsed and the LTV season number, then compares the retrieved titles from LTV
-            # to those parsed or snatched by this service.
+            # Compares the parsed and the LTV season number, then compares the normalized titles
+            # from LTV to the one parsed by this service.
             # Each language is appended to a unique sequence.
-            tvshow = self.CleanLTVTitle(tvshow)
             if int(ltv_season) == int(season):
                 SubtitleResult = {"release" : release,"lang" : 'pt-br', "link" : download_id, "page" : self.url}
-                if re.findall("^%s" % (tvshow),ltv_original_title) or self.comparetitle(ltv_title,tvshow) or self.comparetitle(ltv_original_title,original_tvshow):
+                if normalize(ltv_original_title).startswith(key) or normalize(ltv_title) == key:
                     sub1.append( SubtitleResult )
                 else:
                     reResult = re.findall("[Ss][0-9]+[Ee]([0-9]+)",release)
@@ -470,29 +456,6 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
         return s
 
 
-    def shiftarticle(self,s):
-        for art in [ 'The', 'O', 'A', 'Os', 'As', 'El', 'La', 'Los', 'Las', 'Les', 'Le' ]:
-            x = '^' + art + ' '
-            y = ', ' + art
-            if re.search(x, s):
-                return re.sub(x, '', s) + y
-        return s
-
-    def unshiftarticle(self,s):
-        for art in [ 'The', 'O', 'A', 'Os', 'As', 'El', 'La', 'Los', 'Las', 'Les', 'Le' ]:
-            x = ', ' + art + '$'
-            y = art + ' '
-            if re.search(x, s):
-                return y + re.sub(x, '', s)
-        return s
-
-    def noarticle(self,s):
-        for art in [ 'The', 'O', 'A', 'Os', 'As', 'El', 'La', 'Los', 'Las', 'Les', 'Le' ]:
-            x = '^' + art + ' '
-            if re.search(x, s):
-                return re.sub(x, '', s)
-        return s
-
     def notag(self,s):
         return re.sub('<([^>]*)>', '', s)
 
@@ -504,12 +467,6 @@ class LegendasTV(SubtitleDatabase.SubtitleDB):
         else:
             return 0
 
-    def comparetitle(self,a, b):
-            if (a == b) or (self.noarticle(a) == self.noarticle(b)) or (a == self.noarticle(b)) or (self.noarticle(a) == b) or (a == self.shiftarticle(b)) or (self.shiftarticle(a) == b):
-                return 1
-            else:
-                return 0
-
 
     def to_unicode_or_bust(self,obj, encoding='iso-8859-1'):
          if isinstance(obj, basestring):
@@ -4,16 +4,20 @@
 """ Plugin to enable periscope to donwload subtiles from OpenSubtitles. """
 
 import os
-import xmlrpclib
 import logging
-import socket  # For timeout purposes
 import gzip
+from StringIO import StringIO
 
-from periscope.helper import download_file
+from periscope.helper import download_file, server_proxy, is_valid_subtitle
+from periscope.policy import RequestPolicy
+from periscope.sessions import get_session_store
 from periscope.plugins.SubtitleDatabase import SubtitleDB
 
 LOG = logging.getLogger(__name__)
 
+# Tokens expire after 15 minutes without any request
+SESSION_TTL = 15 * 60
+
 # TODO : get this dict from OpenSubtitle itself and cache it.
 OS_LANGS = {"en": "eng",
             "fr": "fre",
@@ -76,22 +80,34 @@ class OpenSubtitles(SubtitleDB):
     url = "http://www.opensubtitles.org/"
     site_name = "OpenSubtitles"
     server_url = 'http://api.opensubtitles.org/xml-rpc'
+    policy = RequestPolicy(connect_timeout=10, read_timeout=10)
 
     def __init__(self, config, cache_path):
         """ Overwrite the default constuctor. """
         super(OpenSubtitles, self).__init__(OS_LANGS)
-        self.server = xmlrpclib.Server(self.server_url)
-        response = self.server.LogIn("", "", "eng", "periscope")
-        LOG.debug('LogIn : {}'.format(response))
-        socket.setdefaulttimeout(10)
-        self.token = response['token']
-
-    def __del__(self):
-        """ Logout from the service on destuction. """
-        if self.token is not None:
-            response = self.server.LogOut(self.token)
-            LOG.debug('LogOut : {}'.format(response))
-        socket.setdefaulttimeout(None)
+        self._server = None
+        self.sessions = get_session_store(cache_path)
+
+    @property
+    def server(self):
+        """ Return the proxy of the API, it uses the policy of the plugin. """
+        if self._server is None:
+            self._server = server_proxy(self.server_url, self.policy)
+        return self._server
+
+    def login(self):
+        """ Return a session token, only log in when there is none cached.
+
+        The token is shared by all the instances and the next runs through
+        the session store, so it is never logged out.
+        """
+        token = self.sessions.get(self.site_name)
+        if token is None:
+            response = self.server.LogIn("", "", "eng", "periscope")
+            LOG.debug('LogIn : {}'.format(response))
+            token = response['token']
+            self.sessions.set(self.site_name, token, SESSION_TTL)
+        return token
 
     def process(self, file_path, langs):
         """ Get a list of subtitles in the wanted languages. """
@@ -103,13 +119,20 @@ class OpenSubtitles(SubtitleDB):
                          'sublanguageid': langs_id}
         try:
             LOG.debug(" Querying with arguments : {}".format(search_params))
-            response = self.server.SearchSubtitles(self.token, [search_params])
+            response = self.server.SearchSubtitles(self.login(),
+                                                   [search_params])
+            if response['status'].startswith('401'):
+                # The cached token expired on the server side
+                self.sessions.delete(self.site_name)
+                response = self.server.SearchSubtitles(self.login(),
+                                                       [search_params])
+            self.sessions.touch(self.site_name, SESSION_TTL)
             LOG.debug(" status: {}, {} subtitles".
                       format(response['status'], len(response['data'])))
         except Exception, err:
             LOG.error(" Could not query the server OpenSubtitles")
             LOG.debug(err)
-            return []
+            return None
         return self.post_process_results(response['data'])
 
     def create_file(self, subtitle):
@@ -117,7 +140,7 @@ class OpenSubtitles(SubtitleDB):
         suburl = subtitle["link"]
         videofilename = subtitle["filename"]
         srtbasefilename = videofilename.rsplit(".", 1)[0]
-        download_file(suburl, srtbasefilename + ".srt.gz", LOG)
+        download_file(suburl, srtbasefilename + ".srt.gz", LOG, self.policy)
         srt_file = gzip.open(srtbasefilename + ".srt.gz")
         dump = open(srtbasefilename + ".srt", "wb")
         dump.write(srt_file.read())
@@ -126,6 +149,18 @@ class OpenSubtitles(SubtitleDB):
         os.remove(srtbasefilename + ".srt.gz")
         return srtbasefilename + ".srt"
 
+    def fetch(self, subtitle):
+        """ Download and gunzip the subtitle in memory, see SubtitleDB. """
+        content = self.download_content(subtitle["link"])
+        if content is None:
+            return None
+        try:
+            content = gzip.GzipFile(fileobj=StringIO(content)).read()
+        except (IOError, EOFError):
+            LOG.warn("{} is not a gzipped subtitle".format(subtitle["link"]))
+            return None
+        return ("srt", content) if is_valid_subtitle(content) else None
+
     def post_process_results(self, data):
         """ Postprocessing. See details in SubtitleDB class. """
         for sub in data:
@@ -133,4 +168,6 @@ class OpenSubtitles(SubtitleDB):
             sub["link"] = sub.pop('SubDownloadLink')
             sub["page"] = sub["link"]
             sub["lang"] = self.get_lang(sub.pop('SubLanguageID'))
+            sub["hash_match"] = sub.get('MatchedBy') == 'moviehash'
+            sub["rating"] = sub.get('SubRating')
         return data
@@ -19,14 +19,15 @@
 
 import zipfile, os, urllib2, urllib, traceback, logging 
 
-from BeautifulSoup import BeautifulSoup
-
 import SubtitleDatabase
+from periscope.markup import extract
+from periscope.policy import RequestPolicy
 
 log = logging.getLogger(__name__)
 
 class Podnapisi(SubtitleDatabase.SubtitleDB):
     url = "http://www.podnapisi.net/"
+    policy = RequestPolicy(connect_timeout=10, read_timeout=10)
     site_name = "Podnapisi"
 
     def __init__(self, config, cache_folder_path):
@@ -41,7 +42,7 @@ class Podnapisi(SubtitleDatabase.SubtitleDB):
     def process(self, filepath, langs):
         ''' main method to call on the plugin, pass the filename and the wished 
         languages and it will query the subtitles source '''
-        fname = self.getFileName(filepath)
+        fname = self.get_file_name(filepath)
         log.debug("Searching for %s" %fname)
         try:
             subs = []
@@ -65,11 +66,11 @@ class Podnapisi(SubtitleDatabase.SubtitleDB):
         except Exception, e:
             log.error("Error raised by plugin %s: %s" %(self.__class__.__name__, e))
             traceback.print_exc()
-            return []
+            return None
     
     def query(self, token, langs=None):
         ''' makes a query on podnapisi and returns info (link, lang) about found subtitles'''
-        guessedData = self.guessFileData(token)
+        guessedData = self.guess_file_data(token)
         sublinks = []
         params = {"sK" : token}
         if langs and len(langs) == 1:
@@ -78,12 +79,11 @@ class Podnapisi(SubtitleDatabase.SubtitleDB):
             params["sJ"] = 0
 
         searchurl = self.host + self.search + urllib.urlencode(params)
-        content = self.downloadContent(searchurl, 10)
+        content = self.download_content(searchurl)
         
         # Workaround for the Beautifulsoup 3.1 bug
         content = content.replace("scr'+'ipt", "script")
-        soup = BeautifulSoup(content)
-        for subs in soup("tr", {"class":"a"}) + soup("tr", {"class": "b"}):
+        for subs in extract(content, ("tr", {"class":"a"}), ("tr", {"class": "b"})):
             details = subs.find("span", {"class" : "opis"}).findAll("b")
             if guessedData["type"] == "tvshow" and guessedData["season"] == int(details[0].text) and guessedData["episode"] == int(details[1].text):
                 links = subs.findAll("a")
@@ -108,16 +108,15 @@ class Podnapisi(SubtitleDatabase.SubtitleDB):
         subpage = subtitle["page"]
         
         # Parse the subpage and extract the link
-        content = self.downloadContent(subpage, timeout = 10)
+        content = self.download_content(subpage)
         if not content:
             return sublinks
 
         # Workaround for the Beautifulsoup 3.1 bug or HTML bugs
         content = content.replace("scr'+'ipt", "script")
         content = content.replace("</br", "<br")
-        soup = BeautifulSoup(content)
-        dlimg = soup.find("img", {"title" : "Download"})
-        subtitle["link"] = self.host + dlimg.parent["href"]
+        links = [link for link in extract(content, "a") if link.find("img", {"title" : "Download"})]
+        subtitle["link"] = self.host + links[0]["href"]
         
         SubtitleDatabase.SubtitleDB.createFile(self, subtitle)
         return subtitle["link"]
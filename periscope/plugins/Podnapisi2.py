@@ -22,9 +22,12 @@ import xmlrpclib, struct, socket
 from hashlib import md5, sha256
 
 import SubtitleDatabase
+from periscope.helper import server_proxy
+from periscope.policy import RequestPolicy
 
 class Podnapisi(SubtitleDatabase.SubtitleDB):
     url = "http://www.podnapisi.net/"
+    policy = RequestPolicy(connect_timeout=1, read_timeout=30)
     site_name = "Podnapisi"
 
     def __init__(self, config, cache_folder_path):
@@ -42,18 +45,17 @@ class Podnapisi(SubtitleDatabase.SubtitleDB):
         if os.path.isfile(filepath):
             filehash = self.hashFile(filepath)
             size = os.path.getsize(filepath)
-            fname = self.getFileName(filepath)
+            fname = self.get_file_name(filepath)
             return self.query(moviehash=filehash, langs=langs, bytesize=size, filename=fname)
         else:
-            fname = self.getFileName(filepath)
+            fname = self.get_file_name(filepath)
             return self.query(langs=langs, filename=fname)
     
     def query(self, filename, imdbID=None, moviehash=None, bytesize=None, langs=None):
         ''' makes a query on podnapisi and returns info (link, lang) about found subtitles'''
         
         #Login
-        self.server = xmlrpclib.Server(self.server_url)
-        socket.setdefaulttimeout(1)
+        self.server = server_proxy(self.server_url, self.policy)
         try:
             log_result = self.server.initiate("Periscope")
             logging.debug(log_result)
@@ -61,8 +63,7 @@ class Podnapisi(SubtitleDatabase.SubtitleDB):
             nonce = log_result["nonce"]
         except Exception, e:
             logging.error("Podnapisi could not be contacted")
-            socket.setdefaulttimeout(None)
-            return []
+            return None
         logging.debug("got token %s" %token)
         logging.debug("got nonce %s" %nonce)
         logging.debug("hashes are %s" %[moviehash])
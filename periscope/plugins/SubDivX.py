@@ -22,11 +22,10 @@ import os
 import re
 import subprocess
 import urllib
-import urllib2
-
-from BeautifulSoup import BeautifulSoup
 
 import SubtitleDatabase
+from periscope.markup import extract
+from periscope.policy import RequestPolicy
 
 
 LANGUAGES = {"es": "Spanish"}
@@ -34,6 +33,7 @@ LANGUAGES = {"es": "Spanish"}
 
 class SubDivX(SubtitleDatabase.SubtitleDB):
     url = "http://www.subdivx.com"
+    policy = RequestPolicy(connect_timeout=5, read_timeout=5)
     site_name = "SubDivX"
 
     def __init__(self, config, cache_folder_path):
@@ -49,8 +49,8 @@ class SubDivX(SubtitleDatabase.SubtitleDB):
         if 'es' not in langs:
             return []
 
-        fname = unicode(self.getFileName(filepath).lower())
-        guessedData = self.guessFileData(fname)
+        fname = unicode(self.get_file_name(filepath).lower())
+        guessedData = self.guess_file_data(fname)
         if guessedData['type'] == 'tvshow':
             subs = self.query(guessedData['name'],
                               guessedData['season'],
@@ -73,14 +73,13 @@ class SubDivX(SubtitleDatabase.SubtitleDB):
 
     def _get_download_link(self, result_url):
         '''Return the direct link of the subtitle'''
-        content = self.downloadContent(result_url, timeout=5)
-        soup = BeautifulSoup(content)
-        return soup.find('a', {'class': 'link1'}).get('href')
+        content = self.download_content(result_url)
+        return extract(content, ('a', {'class': 'link1'}))[0].get('href')
 
-    def _get_result_rating(self, result, extra):
+    def _get_result_rating(self, details, extra):
         if extra is None:
             extra = []
-        description = result.findNext('div', {'id': 'buscador_detalle_sub'}).text
+        description = details.text
         description = description.split('<!--')[0].lower()
         rating = 0
         for keyword in extra:
@@ -107,17 +106,24 @@ class SubDivX(SubtitleDatabase.SubtitleDB):
 
         logging.debug("SubDivX query: %s", query_url)
 
-        content = self.downloadContent(query_url, timeout=5)
-        if content is not None:
-            soup = BeautifulSoup(content)
-            for subs in soup('div', {"id": "menu_detalle_buscador"}):
-                result = {}
-                result["release"] = self._get_result_title(subs)
-                result["lang"] = 'es'
-                result["link"] = self._get_result_link(subs)
-                result["page"] = query_url
-                result["rating"] = self._get_result_rating(subs, extra)
-                sublinks.append(result)
+        content = self.download_content(query_url)
+        if content is None:
+            return None
+        # The details of a result are in the div following its menu
+        divs = extract(content, ('div', {"id": "menu_detalle_buscador"}),
+                       ('div', {"id": "buscador_detalle_sub"}))
+        for index, subs in enumerate(divs):
+            if subs.get("id") != "menu_detalle_buscador":
+                continue
+            details = [div for div in divs[index + 1:]
+                       if div.get("id") == "buscador_detalle_sub"]
+            result = {}
+            result["release"] = self._get_result_title(subs)
+            result["lang"] = 'es'
+            result["link"] = self._get_result_link(subs)
+            result["page"] = query_url
+            result["rating"] = self._get_result_rating(details[0], extra)
+            sublinks.append(result)
         sorted_links = sorted(sublinks, key=lambda k: k['rating'], reverse=True)
         return sorted_links
 
@@ -129,9 +135,7 @@ class SubDivX(SubtitleDatabase.SubtitleDB):
         '''
         download_url = self._get_download_link(subtitle["link"])
         subtitle["link"] = download_url
-        request = urllib2.Request(download_url)
-        request.get_method = lambda: 'HEAD'
-        response = urllib2.urlopen(request)
+        response = self.request(download_url, method='HEAD')
 
         if response.url.endswith('.zip'):
             # process as usual
@@ -147,7 +151,7 @@ class SubDivX(SubtitleDatabase.SubtitleDB):
             base_filename, _ = os.path.splitext(video_filename)
             base_rar_filename, _ = os.path.splitext(subtitle["filename"])
             rar_filename = '%s%s' % (base_rar_filename, '.rar')
-            self.downloadFile(download_url, rar_filename)
+            self.download_file(download_url, rar_filename)
 
             try:
                 args = ['unrar', 'lb', rar_filename]
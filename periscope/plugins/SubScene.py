@@ -19,15 +19,12 @@
 
 import zipfile
 import os
-import urllib2
 import urllib
 import logging
 import traceback
-import httplib
 
-from BeautifulSoup import BeautifulSoup
-
-from periscope.helper import USER_AGENT, get_file_name
+from periscope.helper import download_file, get_file_name, extract_subtitle
+from periscope.markup import extract
 from periscope.plugins.SubtitleDatabase import SubtitleDB
 
 LOG = logging.getLogger(__name__)
@@ -94,15 +91,13 @@ class SubScene(SubtitleDB):
             logging.error("Error raised by plugin {}: {}".
                 format(self.__class__.__name__, err))
             traceback.print_exc()
-            return []
+            return None
 
     def create_file(self, subtitle):
         """ Pass the URL of the sub and the file it matches, will unzip it
         and return the path to the created file. """
 
-        page = BeautifulSoup(urllib2.urlopen(subtitle["page"]))
-        dlhref = page.find("div", {"class": "download"}).find("a")["href"]
-        subtitle["link"] = "http://subscene.com" + dlhref.split('"')[7]
+        subtitle["link"] = self.get_link(subtitle)
         srt_base_filename = subtitle["filename"].rsplit(".", 1)[0]
         archive_filename = srt_base_filename + '.zip'
         self.download_file(subtitle["link"], archive_filename)
@@ -157,28 +152,26 @@ class SubScene(SubtitleDB):
                 format(archive_filename))
             return None
 
+    def fetch(self, subtitle):
+        """ Download the subtitle in memory, see SubtitleDB.fetch. """
+        subtitle["link"] = self.get_link(subtitle)
+        return extract_subtitle(self.download_content(subtitle["link"]), LOG)
+
+    def get_link(self, subtitle):
+        """ Return the download link found on the page of the subtitle. """
+        download = extract(self.request(subtitle["page"]).content,
+                           ("div", {"class": "download"}))[0]
+        dlhref = download.find("a")["href"]
+        return "http://subscene.com" + dlhref.split('"')[7]
+
     def download_file(self, url, filename):
         """ Downloads the given url to the given filename """
         LOG.info("Downloading file {}".format(url))
-        req = urllib2.Request(url, headers={'Referer': url,
-            'User-Agent': USER_AGENT})
-
-        subtitle_file = urllib2.urlopen(req, data=urllib.urlencode({
+        download_file(url, filename, LOG, self.policy, data={
             '__EVENTTARGET': 's$lc$bcr$downloadLink',
             '__EVENTARGUMENT': '',
             '__VIEWSTATE': '/wEPDwUHNzUxOTkwNWRk4wau5efPqhlBJJlOkKKHN8FIS04='
-        }))
-        dump = open(filename, "wb")
-        try:
-            subtitle_file.read(1000000)
-        except httplib.IncompleteRead, err:
-            dump.write(err.partial)
-            LOG.warn('Incomplete read for {} ... Trying anyway to decompress.'.
-                format(url))
-        dump.close()
-        subtitle_file.close()
-
-        #SubtitleDatabase.SubtitleDB.downloadFile(self, req, filename)
+        })
 
     def query(self, token, langs=None):
         """ Makes a query on subscene and returns info (link, lang)
@@ -187,9 +180,9 @@ class SubScene(SubtitleDB):
 
         searchurl = "{}{}".format(self.host, urllib.quote(token))
         LOG.debug(" downloading {}".format(searchurl))
-        page = BeautifulSoup(urllib2.urlopen(searchurl))
+        content = self.request(searchurl).content
 
-        for subs in page("a", {"class": "a1"}):
+        for subs in extract(content, ("a", {"class": "a1"})):
             lang_span = subs.find("span")
             lang = self.get_lang(lang_span.contents[0].strip())
             release_span = lang_span.findNext("span")
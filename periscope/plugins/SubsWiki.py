@@ -18,9 +18,8 @@
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import zipfile, os, urllib2, urllib, logging, traceback, httplib, re
-from BeautifulSoup import BeautifulSoup
-
 import SubtitleDatabase
+from periscope.markup import extract
 
 LANGUAGES = {u"English (US)" : "en",
              u"English (UK)" : "en",
@@ -37,6 +36,8 @@ LANGUAGES = {u"English (US)" : "en",
 class SubsWiki(SubtitleDatabase.SubtitleDB):
     url = "http://www.subswiki.com"
     site_name = "SubsWiki"
+    # The episode pages are shared by the releases of an episode
+    page_freshness = ((r"/serie/", 6 * 60 * 60),)
 
     def __init__(self, config, config_folder_path):
         super(SubsWiki, self).__init__(langs=None,revertlangs=LANGUAGES)
@@ -48,8 +49,8 @@ class SubsWiki(SubtitleDatabase.SubtitleDB):
     def process(self, filepath, langs):
         ''' main method to call on the plugin, pass the filename and the wished 
         languages and it will query the subtitles source '''
-        fname = unicode(self.getFileName(filepath).lower())
-        guessedData = self.guessFileData(fname)
+        fname = unicode(self.get_file_name(filepath).lower())
+        guessedData = self.guess_file_data(fname)
         if guessedData['type'] == 'tvshow':
             subs = self.query(guessedData['name'], guessedData['season'], guessedData['episode'], guessedData['teams'], langs)
             return subs
@@ -63,16 +64,19 @@ class SubsWiki(SubtitleDatabase.SubtitleDB):
         searchurl = "%s/serie/%s/%s/%s/" %(self.host, name, season, episode)
         logging.debug("dl'ing %s" %searchurl)
         try:
-            page = urllib2.urlopen(searchurl)
+            page = self.request(searchurl)
             ''' test if no redirect was made '''
             if page.geturl() != searchurl :
                 return sublinks
         except urllib2.HTTPError as inst:
             logging.debug("Error : %s for %s" % (searchurl, inst))
-            return sublinks
+            # Only a missing page means there is no subtitle
+            return sublinks if inst.code == 404 else None
         
-        soup = BeautifulSoup(page)
-        for subs in soup("td", {"class":"NewsTitle"}):
+        # The tables are kept for the parents and findNext of the titles
+        tables = extract(page.read(), "table", nested=False)
+        titles = [td for table in tables for td in table("td", {"class":"NewsTitle"})]
+        for subs in titles:
             subteams = subs.findNext("b").string.lower()            
             teams = set(teams)
             subteams = self.listTeams([subteams], [".", "_", " ", " y "])
@@ -125,15 +129,5 @@ class SubsWiki(SubtitleDatabase.SubtitleDB):
         videofilename = subtitle["filename"]
         srtbasefilename = videofilename.rsplit(".", 1)[0]
         srtfilename = srtbasefilename +".srt"
-        self.downloadFile(suburl, srtfilename)
+        self.download_file(suburl, srtfilename)
         return srtfilename
-
-    def downloadFile(self, url, filename):
-        ''' Downloads the given url to the given filename '''
-        req = urllib2.Request(url, headers={'Referer' : url, 'User-Agent' : 'Mozilla/5.0 (X11; U; Linux x86_64; en-US; rv:1.9.1.3)'})
-        
-        f = urllib2.urlopen(req)
-        dump = open(filename, "wb")
-        dump.write(f.read())
-        dump.close()
-        f.close()
@@ -3,13 +3,18 @@
 
 """ Define the abstract class that periscope plugins should overwrite. """
 
-import os
-import logging
-import zipfile
-import struct
 import re
+import logging
 from abc import ABCMeta, abstractmethod
 
+from periscope.fingerprint import fingerprint
+from periscope.helper import (SESSION, download_file, download_content,
+                              get_file_name, extract_subtitle,
+                              write_subtitle)
+from periscope.parser import parse
+from periscope.policy import DEFAULT_POLICY
+from periscope.pool import page_pool, plugin_host, CancelledError
+
 LOG = logging.getLogger(__name__)
 
 
@@ -20,6 +25,15 @@ class SubtitleDB(object):
     __metaclass__ = ABCMeta
 
     site_name = "Overwrite to name the module"
+    # Lifetime in seconds of the cached results, when some or none are found
+    cache_ttl = 24 * 60 * 60
+    negative_cache_ttl = 6 * 60 * 60
+    # Timeouts and retries of the requests to the site
+    policy = DEFAULT_POLICY
+    # (regex, seconds) pairs: the pages whose url matches a regex are kept
+    # in the HTTP cache and used for that many seconds before checking if
+    # they changed. The other pages are always fetched.
+    page_freshness = ()
 
     def __init__(self, langs, revertlangs=None):
         """ Init method with a list of language as argument. """
@@ -31,62 +45,102 @@ class SubtitleDB(object):
             self.revertlangs = revertlangs
             self.langs = dict(map(lambda item: (item[1], item[0]),
                                   self.revertlangs.items()))
-        self.tvshowRegex = re.compile(('(?P<show>.*)S(?P<season>[0-9]{2})'
-                                       'E(?P<episode>[0-9]{2}).(?P<teams>.*)'),
-                                      re.IGNORECASE)
-        self.tvshowRegex2 = re.compile(('(?P<show>.*).(?P<season>[0-9]{1,2})x('
-                                        '?P<episode>[0-9]{1,2})'
-                                        '(?P<teams>.*)'), re.IGNORECASE)
-        self.movieRegex = re.compile(('(?P<movie>.*)[\.|\[|\(| ]{1}'
-                                      '(?P<year>(?:(?:19|20)[0-9]{2}))'
-                                      '(?P<teams>.*)'), re.IGNORECASE)
 
-    def search_in_thread(self, queue, filename, langs):
-        """ Append subtitles to the queue. """
+    def search(self, filename, langs):
+        """ Return the subtitles found for the file, never raise.
+
+        None is returned when the search failed, to tell it apart from a
+        search that found nothing.
+        """
         try:
             subs = self.process(filename, langs)
-            for sub in subs:
+            for sub in subs or []:
                 sub.setdefault("plugin", self)
                 sub.setdefault("filename", filename)
-            LOG.info("{} writing {} items to queue".format(self, len(subs)))
         except:
             LOG.exception("Error occured")
-            subs = []
+            subs = None
+        return subs
+
+    def search_in_thread(self, queue, filename, langs):
+        """ Append subtitles to the queue. """
+        subs = self.search(filename, langs) or []
+        LOG.info("{} writing {} items to queue".format(self, len(subs)))
         # Each plugin must write something
         # The caller periscope.py waits for a result on the queue
         queue.put(subs, True)
 
     def create_file(self, subtitle):
         """ Download subtile, unzip and create the subtitle file. """
-        suburl = subtitle["link"]
-        videofilename = subtitle["filename"]
-        srtbasefilename = videofilename.rsplit(".", 1)[0]
-        zipfilename = srtbasefilename + ".zip"
-        self.downloadFile(suburl, zipfilename)
-
-        if zipfile.is_zipfile(zipfilename):
-            LOG.debug("Unzipping file " + zipfilename)
-            unzipped_file = zipfile.ZipFile(zipfilename, "r")
-
-            for elem in unzipped_file.infolist():
-                extension = elem.orig_filename.rsplit(".", 1)[1]
-                if extension in ("srt", "sub", "txt"):
-                    outfile = open(srtbasefilename + "." +
-                                   extension, "wb")
-                    outfile.write(unzipped_file.read(elem.orig_filename))
-                    outfile.flush()
-                    outfile.close()
-                else:
-                    LOG.info("File {} does not seem to be valid ".
-                             format(elem.orig_filename))
-            # Deleting the zip file
-            unzipped_file.close()
-            os.remove(zipfilename)
-            return srtbasefilename + ".srt"
-        else:
-            LOG.info("Unexpected file type (not zip)")
-            os.remove(zipfilename)
+        fetched = self.fetch(subtitle)
+        if fetched is None:
+            LOG.info("No valid subtitle in {}".format(subtitle["link"]))
             return None
+        return write_subtitle(subtitle["filename"], *fetched)
+
+    def fetch(self, subtitle):
+        """ Download a subtitle in memory, unzipped and checked.
+
+        Return its (extension, content), or None if it is not valid. Nothing
+        is written, so several candidates can be fetched at once and only
+        the first valid one saved with write_subtitle.
+        """
+        return extract_subtitle(self.download_content(subtitle["link"]), LOG)
+
+    def freshness_for(self, url):
+        """ Return the seconds the page of url is fresh, None to not cache
+        it.
+        """
+        for pattern, seconds in self.page_freshness:
+            if re.search(pattern, url):
+                return seconds
+        return None
+
+    def request(self, url, data=None, **kwargs):
+        """ Send a request with the policy of the plugin, see HTTPSession.
+        """
+        kwargs.setdefault("policy", self.policy)
+        kwargs.setdefault("freshness", self.freshness_for(url))
+        return SESSION.request(url, data, **kwargs)
+
+    def map_pages(self, function, calls, stop=None):
+        """ Return [function(*args) for args in calls], run concurrently.
+
+        Made for the pages a search fetches after the first one: the calls
+        run on the shared page_pool, within its cap for the site. stop is
+        called on each result in the order of calls, once it returns True
+        the calls not started yet are cancelled and the results so far are
+        returned. The first error is raised once the others are cancelled.
+        """
+        futures = [page_pool().submit(plugin_host(type(self)), function,
+                                      *args) for args in calls]
+        results = []
+        try:
+            for future in futures:
+                try:
+                    result = future.result()
+                except CancelledError:
+                    continue
+                results.append(result)
+                if stop is not None and stop(result):
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+        return results
+
+    def download_file(self, url, file_path):
+        """ Download the given url to the given file path. """
+        download_file(url, file_path, LOG, self.policy)
+
+    def download_content(self, url):
+        """ Return the content of the given url, None on errors. """
+        return download_content(url, LOG, self.policy,
+                                freshness=self.freshness_for(url))
+
+    def close(self):
+        """ Release the resources held by the plugin (sessions, ...). """
+        pass
 
     def get_lang(self, language):
         """ Return a language two character code from its long naming. """
@@ -108,7 +162,11 @@ class SubtitleDB(object):
 
     @abstractmethod
     def process(self, filepath, langs):
-        """ Dowload the subtiles for a file in the wanted languages. """
+        """ Dowload the subtiles for a file in the wanted languages.
+
+        Return None when the site could not be searched, so the failure is
+        not cached as a file without subtitles.
+        """
         pass
 
     # @abstractmethod
@@ -127,75 +185,24 @@ class SubtitleDB(object):
         pass
 
     def guess_file_data(self, filename):
-        """ Return the more relevent information for the file name. """
-        filename = unicode(self.getFileName(filename).lower())
-        matches_tvshow = self.tvshowRegex.match(filename)
-        if not matches_tvshow:  # we try the second regex
-            matches_tvshow = self.tvshowRegex2(filename)
-        if matches_tvshow:  # It looks like a tv show
-            (tvshow, season, episode, teams) = matches_tvshow.groups()
-            tvshow = tvshow.replace(".", " ").strip()
-            teams = teams.split('.')
-            return {'type': 'tvshow',
-                    'name': tvshow.strip(),
-                    'season': int(season),
-                    'episode': int(episode),
-                    'teams': teams}
-
-        matches_movie = self.movieRegex.match(filename)
-        if matches_movie:  # It looks like a movie
-            (movie, year, teams) = matches_movie.groups()
-            teams = teams.split('.')
-            part = None
-            if "cd1" in teams:
-                teams.remove('cd1')
-                part = 1
-            if "cd2" in teams:
-                teams.remove('cd2')
-                part = 2
-                return {'type': 'movie',
-                        'name': movie.strip(),
-                        'year': year,
-                        'teams': teams,
-                        'part': part}
-        # No relevant information were found from the file name
-        return {'type': 'unknown', 'name': filename, 'teams': []}
-
-    def hash_file(self, file_path):
-        """ Return the hash of the file as used by OpenSubtitles.
+        """ Return what the file name tells as a dict, see periscope.parser.
 
-        The method is defined on OpenSubtitles API (link below)
-        http://trac.opensubtitles.org/projects/opensubtitles/
-        wiki/HashSourceCodes#Python
+        The parse is shared by all the plugins searching the same file, each
+        gets its own copy it can change.
         """
-        try:
-            longlongformat = 'q'  # long long
-            bytesize = struct.calcsize(longlongformat)
-
-            input_file = open(file_path, "rb")
-            file_size = os.path.getsize(file_path)
-            file_hash = file_size
-
-            if file_size < 65536 * 2:
-                return "SizeError"
-
-            for _ in range(65536 / bytesize):
-                file_buffer = input_file.read(bytesize)
-                (l_value,) = struct.unpack(longlongformat, file_buffer)
-                file_hash += l_value
-                file_hash = file_hash & 0xFFFFFFFFFFFFFFFF
+        data = parse(filename)._asdict()
+        data["teams"] = list(data["teams"])
+        return data
 
-            input_file.seek(max(0, file_size - 65536), 0)
-            for _ in range(65536 / bytesize):
-                file_buffer = input_file.read(bytesize)
-                (l_value,) = struct.unpack(longlongformat, file_buffer)
-                file_hash += l_value
-                file_hash = file_hash & 0xFFFFFFFFFFFFFFFF
+    def get_file_name(self, filepath):
+        """ Return the file name of a video without its extension. """
+        return get_file_name(filepath)
 
-            input_file.close()
-            return "%016x" % file_hash
-
-        except(IOError):
+    def hash_file(self, file_path):
+        """ Return the hash of the file as used by OpenSubtitles. """
+        try:
+            return fingerprint(file_path)["opensubtitles"]
+        except (IOError, OSError):
             return "IOError"
 
     def __str__(self):
@@ -27,6 +27,7 @@ except ImportError:
     is_local = False
     
 import SubtitleDatabase
+from periscope.policy import RequestPolicy
 
 SS_LANGUAGES = {"en": "English",
                 "sv": "Swedish",
@@ -39,6 +40,7 @@ SS_LANGUAGES = {"en": "English",
 
 class SubtitleSource(SubtitleDatabase.SubtitleDB):
     url = "http://www.subtitlesource.org/"
+    policy = RequestPolicy(connect_timeout=5, read_timeout=5)
     site_name = "SubtitleSource"
 
     def __init__(self, config, cache_folder_path):
@@ -58,7 +60,7 @@ class SubtitleSource(SubtitleDatabase.SubtitleDB):
         if not key:
             log.info("No key in the config file for SubtitleSource : skip")
             return []
-        fname = self.getFileName(filepath)
+        fname = self.get_file_name(filepath)
         try:
             subs = self.query(fname, langs)
             if not subs and fname.rfind(".[") > 0:
@@ -71,7 +73,7 @@ class SubtitleSource(SubtitleDatabase.SubtitleDB):
         except Exception, e:
             logging.error("Error raised by plugin %s: %s" %(self.__class__.__name__, e))
             traceback.print_exc()
-            return []
+            return None
     
     def query(self, token, langs=None):
         ''' makes a query on subtitlessource and returns info (link, lang) about found subtitles'''
@@ -84,7 +86,7 @@ class SubtitleSource(SubtitleDatabase.SubtitleDB):
             languages = [SS_LANGUAGES[l] for l in langs if l in SS_LANGUAGES.keys()]
             
         # Get the CD part of this
-        metaData = self.guessFileData(token)
+        metaData = self.guess_file_data(token)
         multipart = metaData.get('part', None)
         part = metaData.get('part')
         if not part : # part will return None if not found using the regex
@@ -93,8 +95,8 @@ class SubtitleSource(SubtitleDatabase.SubtitleDB):
         for lang in languages:
             searchurl = "%s/%s/%s/0" %(self.host, urllib.quote(token), lang)
             logging.debug("dl'ing %s" %searchurl)
-            page = urllib2.urlopen(searchurl, timeout=5)
-            xmltree = xml.dom.minidom.parse(page)
+            page = self.request(searchurl)
+            xmltree = xml.dom.minidom.parseString(page.content)
             subs = xmltree.getElementsByTagName("sub")
 
             for sub in subs:
@@ -110,7 +112,7 @@ class SubtitleSource(SubtitleDatabase.SubtitleDB):
                 result["link"] = dllink
                 result["page"] = dllink
                 result["lang"] = sublang
-                releaseMetaData = self.guessFileData(result['release'])
+                releaseMetaData = self.guess_file_data(result['release'])
                 teams = set(metaData['teams'])
                 srtTeams = set(releaseMetaData['teams'])
                 logging.debug("Analyzing : %s " % result['release'])
@@ -128,7 +130,7 @@ class SubtitleSource(SubtitleDatabase.SubtitleDB):
         suburl = subtitle["link"]
         videofilename = subtitle["filename"]
         srtfilename = videofilename.rsplit(".", 1)[0] + '.srt'
-        self.downloadFile(suburl, srtfilename)
+        self.download_file(suburl, srtfilename)
         return srtfilename
 
     def getValue(self, sub, tagName):
@@ -18,9 +18,9 @@
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import zipfile, os, urllib2, urllib, logging, traceback, httplib, re
-from BeautifulSoup import BeautifulSoup
-
 import SubtitleDatabase
+from periscope.markup import extract
+from periscope.policy import RequestPolicy
 
 log = logging.getLogger(__name__)
 
@@ -38,20 +38,21 @@ LANGUAGES = {u"English (US)" : "en",
 
 class Subtitulos(SubtitleDatabase.SubtitleDB):
     url = "http://www.subtitulos.es"
+    policy = RequestPolicy(connect_timeout=10, read_timeout=10)
     site_name = "Subtitulos"
 
     def __init__(self, config, cache_folder_path):
         super(Subtitulos, self).__init__(langs=None,revertlangs=LANGUAGES)
         #http://www.subtitulos.es/dexter/4x01
         self.host = "http://www.subtitulos.es"
-        self.release_pattern = re.compile("Versi&oacute;n (.+) ([0-9]+).([0-9])+ megabytes")
+        self.release_pattern = re.compile(u"Versi\xf3n (.+) ([0-9]+).([0-9])+ megabytes")
         
 
     def process(self, filepath, langs):
         ''' main method to call on the plugin, pass the filename and the wished 
         languages and it will query the subtitles source '''
-        fname = unicode(self.getFileName(filepath).lower())
-        guessedData = self.guessFileData(fname)
+        fname = unicode(self.get_file_name(filepath).lower())
+        guessedData = self.guess_file_data(fname)
         if guessedData['type'] == 'tvshow':
             subs = self.query(guessedData['name'], guessedData['season'], guessedData['episode'], guessedData['teams'], langs)
             return subs
@@ -63,14 +64,18 @@ class Subtitulos(SubtitleDatabase.SubtitleDB):
         sublinks = []
         name = name.lower().replace(" ", "-")
         searchurl = "%s/%s/%sx%s" %(self.host, name, season, episode)
-        content = self.downloadContent(searchurl, 10)
+        try:
+            content = self.request(searchurl, headers={"Referer": searchurl}).read()
+        except urllib2.HTTPError as inst:
+            log.debug("Error : %s for %s" % (searchurl, inst))
+            # Only a missing page means there is no subtitle
+            return sublinks if inst.code == 404 else None
         if not content:
             return sublinks
         
-        soup = BeautifulSoup(content)
-        for subs in soup("div", {"id":"version"}):
+        for subs in extract(content, ("div", {"id":"version"})):
             version = subs.find("p", {"class":"title-sub"})
-            subteams = self.release_pattern.search("%s"%version.contents[1]).group(1).lower()            
+            subteams = self.release_pattern.search(version.text).group(1).lower()            
             teams = set(teams)
             subteams = self.listTeams([subteams], [".", "_", " ", "/"])
             
@@ -80,10 +85,10 @@ class Subtitulos(SubtitleDatabase.SubtitleDB):
             nexts = subs.findAll("ul", {"class":"sslist"})
             for lang_html in nexts:
                 langLI = lang_html.findNext("li",{"class":"li-idioma"} )
-                lang = self.getLG(langLI.find("strong").contents[0].string.strip())
+                lang = self.getLG(langLI.find("strong").text.strip())
         
                 statusLI = lang_html.findNext("li",{"class":"li-estado green"} )
-                status = statusLI.contents[0].string.strip()
+                status = statusLI.contents[0].strip()
 
                 link = statusLI.findNext("span", {"class":"descargar green"}).find("a")["href"]
                 if status == "Completado" and subteams.issubset(teams) and (not langs or lang in langs) :
@@ -116,15 +121,5 @@ class Subtitulos(SubtitleDatabase.SubtitleDB):
         videofilename = subtitle["filename"]
         srtbasefilename = videofilename.rsplit(".", 1)[0]
         srtfilename = srtbasefilename +".srt"
-        self.downloadFile(suburl, srtfilename)
+        self.download_file(suburl, srtfilename)
         return srtfilename
-
-    def downloadFile(self, url, filename):
-        ''' Downloads the given url to the given filename '''
-        req = urllib2.Request(url, headers={'Referer' : url, 'User-Agent' : 'Mozilla/5.0 (X11; U; Linux x86_64; en-US; rv:1.9.1.3)'})
-        
-        f = urllib2.urlopen(req)
-        dump = open(filename, "wb")
-        dump.write(f.read())
-        dump.close()
-        f.close()
@@ -17,12 +17,14 @@
 #    along with periscope; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-import os
 import urllib2
 import urllib
 import logging
-import hashlib
 
+from periscope.fingerprint import fingerprint
+from periscope.helper import (download_file, download_content,
+                              is_valid_subtitle)
+from periscope.policy import RequestPolicy
 from periscope.plugins.SubtitleDatabase import SubtitleDB
 
 LOG = logging.getLogger(__name__)
@@ -42,6 +44,7 @@ class TheSubDB(SubtitleDB):
     url = "http://thesubdb.com/"
     site_name = "SubDB"
     user_agent = "SubDB/1.0 (periscope/0.1; http://code.google.com/p/periscope)"
+    policy = RequestPolicy(connect_timeout=5, read_timeout=5)
 
     def __init__(self, config, cache_folder_path):
         super(TheSubDB, self).__init__(SS_LANGUAGES)
@@ -57,12 +60,11 @@ class TheSubDB(SubtitleDB):
         params = {'action': 'search', 'hash': filehash}
         search_url = self.base_url.format(urllib.urlencode(params))
         LOG.debug('Query URL : {}'.format(search_url))
-        req = urllib2.Request(search_url)
-        req.add_header('User-Agent', self.user_agent)
         subs = []
         try:
-            page = urllib2.urlopen(req, timeout=5)
-            content = page.readlines()
+            page = self.request(search_url,
+                                headers={'User-Agent': self.user_agent})
+            content = page.content.splitlines()
             plugin_langs = content[0].split(',')
             for lang in plugin_langs:
                 if not langs or lang in langs:
@@ -74,6 +76,7 @@ class TheSubDB(SubtitleDB):
                         'hash': filehash,
                         'language': lang}))
                     result['page'] = result['link']
+                    result['hash_match'] = True
                     subs.append(result)
             return subs
         except urllib2.HTTPError, err:
@@ -85,12 +88,7 @@ class TheSubDB(SubtitleDB):
     def get_hash(self, name):
         '''this hash function receives the name of the file and
         returns the hash code'''
-        readsize = 64 * 1024
-        with open(name, 'rb') as input_file:
-            data = input_file.read(readsize)
-            input_file.seek(-readsize, os.SEEK_END)
-            data += input_file.read(readsize)
-        return hashlib.md5(data).hexdigest()
+        return fingerprint(name)["thesubdb"]
 
     def create_file(self, subtitle):
         '''pass the URL of the sub and the file it matches, will unzip it
@@ -101,18 +99,16 @@ class TheSubDB(SubtitleDB):
         self.download_file(suburl, srtfilename)
         return srtfilename
 
+    def fetch(self, subtitle):
+        ''' Download the subtitle in memory, see SubtitleDB.fetch '''
+        content = download_content(subtitle["link"], LOG, self.policy,
+                                   headers={'User-Agent': self.user_agent})
+        return ('srt', content) if is_valid_subtitle(content) else None
+
     def download_file(self, url, srtfilename):
         ''' Downloads the given url to the given filename '''
-        req = urllib2.Request(url)
-        req.add_header('User-Agent', self.user_agent)
-
-        down_file = urllib2.urlopen(req)
-        dump = open(srtfilename, "wb")
-        dump.write(down_file.read())
-        dump.close()
-        down_file.close()
-        LOG.debug("Download finished to file {}. Size : {}".
-            format(srtfilename, os.path.getsize(srtfilename)))
+        download_file(url, srtfilename, LOG, self.policy,
+                      headers={'User-Agent': self.user_agent})
 
     def upload_file(self, filepath, subpath):
         # Get the hash
@@ -131,11 +127,10 @@ class TheSubDB(SubtitleDB):
         fd.write(content)'''
 
         data = urllib.urlencode({'hash': filehash, 'file': sub})
-        req = urllib2.Request(upload_url, data)
-        req.add_header('User-Agent', self.user_agent)
         try:
-            page = urllib2.urlopen(req, data, timeout=5)
-            LOG.debug(page.readlines())
+            page = self.request(upload_url, data,
+                                headers={'User-Agent': self.user_agent})
+            LOG.debug(page.content.splitlines())
         except urllib2.HTTPError, err:
             LOG.exception('Error occured while uploading : {}'.format(err))
         finally:
@@ -6,8 +6,15 @@
 import logging
 
 import zipfile, os, urllib2
-import os, re, BeautifulSoup, urllib
+import os, re, urllib
 
+from periscope.markup import extract
+from periscope.titles import get_title_index
+
+# The links of the show list to the seasons of a show
+SHOW_LINK = re.compile(r"tvshow-(\d+)-\d+\.html")
+
+# The shows known without loading the show list
 showNum = {
 "24":38,
 "30 rock":46,
@@ -252,51 +259,43 @@ class TvSubtitles(SubtitleDatabase.SubtitleDB):
 	
 	URL_SHOW_PATTERN = "http://www.tvsubtitles.net/tvshow-%s.html"
 	URL_SEASON_PATTERN = "http://www.tvsubtitles.net/tvshow-%s-%d.html"
+	URL_SHOWS = "http://www.tvsubtitles.net/tvshows.html"
+	# The season pages list the new subtitles, the subtitle pages hardly
+	# change once posted
+	page_freshness = (
+		(r"/tvshow-\d+-\d+\.html$", 6 * 60 * 60),
+		(r"/(?:subtitle|episode)-[\w-]+\.html$", 24 * 60 * 60))
 
-	def __init__(self):
+	def __init__(self, config, cache_folder_path):
 		super(TvSubtitles, self).__init__({"en":'en', "fr":'fr'})## TODO ??
 		self.host = TvSubtitles.url
-    
-	def _get_episode_urls(self, show, season, episode, langs):
-		showId = showNum.get(show, None)
-		if not showId:
-			return []
-		show_url = self.URL_SEASON_PATTERN % (showId, season)
-		logging.debug("Show url: %s" % show_url)
-		page = urllib.urlopen(show_url)
-		content = page.read()
-		content = content.replace("SCR'+'IPT", "script")
-		soup = BeautifulSoup.BeautifulSoup(content)
-		td_content = "%sx%s"%(season, episode)
-		tds = soup.findAll(text=td_content)
-		links = []
-		for td in tds:
-			imgs =  td.parent.parent.findAll("td")[3].findAll("img")
-			for img in imgs:
-				# If there is an alt, and that alt in langs or you didn't specify a langs
-				if img['alt'] and ((langs and img['alt'] in langs) or (not langs)):
-					url = self.host + "/" + img.parent['href']
-					lang = img['alt']
-					logging.debug("Found lang %s - %s" %(lang, url))
-					links.append((url, lang))
-					
-		return links
+		self.shows = get_title_index(cache_folder_path, self.site_name,
+			self._load_shows, showNum.items())
 
+	def _load_shows(self):
+		''' Return the (title, id) of the shows listed on the site '''
+		page = self.request(self.URL_SHOWS)
+		links = extract(page.read(), ("a", {"href": SHOW_LINK}))
+		return [(link.text, int(SHOW_LINK.search(link["href"]).group(1)))
+			for link in links if link.text.strip()]
+    
 	def query(self, show, season, episode, teams, langs):
-		showId = showNum.get(show, None)
+		showId = self.shows.get(show)
 		if not showId:
+			logging.debug("Unknown show %s" % show)
 			return []
 		show_url = self.URL_SEASON_PATTERN % (showId, season)
 		logging.debug("Show url: %s" % show_url)
-		page = urllib.urlopen(show_url)
+		page = self.request(show_url)
 		content = page.read()
 		content = content.replace("SCR'+'IPT", "script")
-		soup = BeautifulSoup.BeautifulSoup(content)
+		tables = extract(content, "table", nested=False)
 		td_content = "%dx%02d"%(season, episode)
-		tds = soup.findAll(text=td_content)
-		links = []
+		tds = [td for table in tables for td in table.findText(td_content)]
+		pages = []
+		listings = []
 		for td in tds:
-			imgs =  td.parent.parent.findAll("td")[3].findAll("img")
+			imgs =  td.parent.findAll("td")[3].findAll("img")
 			for img in imgs:
 				# If there is an alt, and that alt in langs or you didn't specify a langs
 				if img['alt'] and ((langs and img['alt'] in langs) or (not langs)):
@@ -304,23 +303,36 @@ class TvSubtitles(SubtitleDatabase.SubtitleDB):
 					lang = img['alt']
 					logging.debug("Found lang %s - %s" %(lang, url))
 					if url.startswith("subtitle"):
-						url = self.host + "/" + url
-						logging.debug("Parse : %s" %url)
-						sub = self.parseSubtitlePage(url, lang, show, season, episode, teams)
-						if sub:
-							links.append(sub)
+						pages.append((self.host + "/" + url, lang))
 					else:
-						page2 = urllib.urlopen(self.host + "/" + url)
-						soup2 = BeautifulSoup.BeautifulSoup(page2)
-						subs = soup2.findAll("div", {"class" : "subtitlen"})
-						for sub in subs:
-							url = self.host + sub.get('href', None)
-							logging.debug("Parse2 : %s" %url)
-							sub = self.parseSubtitlePage(url, lang, show, season, episode, teams)
-							if sub:
-								links.append(sub)
-					
-		return links
+						listings.append((self.host + "/" + url, lang))
+		# The languages with several subtitles link to a listing of them
+		for listed in self.map_pages(self._listing_pages, listings):
+			pages.extend(listed)
+
+		# Nothing better is left once each language of the episode has a
+		# subtitle of the release teams
+		wanted = set(lang for url, lang in pages)
+		matched = set()
+		def stop(sub):
+			if sub and sub["team_match"]:
+				matched.add(sub["lang"])
+			return matched == wanted
+		subs = self.map_pages(self.parseSubtitlePage,
+			[(url, lang, show, season, episode, teams) for url, lang in pages],
+			stop)
+		return [sub for sub in subs if sub]
+
+	def _listing_pages(self, url, lang):
+		''' Return the (url, lang) of the subtitle pages of a listing '''
+		page = self.request(url)
+		subs = extract(page.read(), ("div", {"class" : "subtitlen"}))
+		pages = []
+		for sub in subs:
+			url = self.host + sub.get('href', None)
+			logging.debug("Parse2 : %s" %url)
+			pages.append((url, lang))
+		return pages
 		
 	def parseSubtitlePage(self, url, lang, show, season, episode, teams):
 		fteams = []
@@ -331,19 +343,19 @@ class TvSubtitles(SubtitleDatabase.SubtitleDB):
 		subid = url.rsplit("-", 1)[1].split('.', 1)[0]
 		link = self.host + "/download-" + subid + ".html"
 		
-		page = urllib.urlopen(url)
+		page = self.request(url)
 		content = page.read()
 		content = content.replace("SCR'+'IPT", "script")
-		soup = BeautifulSoup.BeautifulSoup(content)
+		tables = extract(content, "table", nested=False)
 		
 		subteams = set()
-		releases = soup.findAll(text="release:")
+		releases = [element for table in tables for element in table.findText("release:")]
 		if releases:
-			subteams.update([releases[0].parent.parent.parent.parent.findAll("td")[2].string.lower()])
+			subteams.update([releases[0].parent.parent.parent.findAll("td")[2].string.lower()])
 		
-		rips = soup.findAll(text="rip:")
+		rips = [element for table in tables for element in table.findText("rip:")]
 		if rips:
-			subteams.update([rips[0].parent.parent.parent.parent.findAll("td")[2].string.lower()])
+			subteams.update([rips[0].parent.parent.parent.findAll("td")[2].string.lower()])
 		
 		if subteams.issubset(fteams):
 			logging.debug("It'a match ! : %s <= %s" %(subteams, fteams))
@@ -353,6 +365,8 @@ class TvSubtitles(SubtitleDatabase.SubtitleDB):
 			result["lang"] = lang
 			result["link"] = link
 			result["page"] = url
+			# Without release or rip, any release matches
+			result["team_match"] = bool(subteams)
 			return result
 		else:
 			logging.debug("It'not a match ! : %s > %s" %(subteams, fteams))
@@ -364,8 +378,8 @@ class TvSubtitles(SubtitleDatabase.SubtitleDB):
 	def process(self, filename, langs):
 		''' main method to call on the plugin, pass the filename and the wished 
 		languages and it will query TvSubtitles.net '''
-		fname = unicode(self.getFileName(filename).lower())
-		guessedData = self.guessFileData(fname)
+		fname = unicode(self.get_file_name(filename).lower())
+		guessedData = self.guess_file_data(fname)
 		logging.debug(fname)
 		if guessedData['type'] == 'tvshow':
 			subs = self.query(guessedData['name'], guessedData['season'], guessedData['episode'], guessedData['teams'], langs)
@@ -17,24 +17,102 @@
 #    along with emesene; if not, write to the Free Software
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-# from periscope.plugins.OpenSubtitles import OpenSubtitles
-# from Subtitulos import Subtitulos
-# from Podnapisi import Podnapisi
-# from periscope.plugins.TheSubDB import TheSubDB
-# from SubsWiki import SubsWiki
-# from LegendasTV import LegendasTV
-# from SubDivX import SubDivX
+""" Registry of the plugins, whose modules are only imported when used. """
 
-#from SubtitleSource import SubtitleSource # require a key in the config file
+import importlib
 
-# Not working anymore (download fails)
-from periscope.plugins.SubScene import SubScene
+# What a plugin can do, to pick the plugins for a kind of search
+HASH = "hash"  # finds the subtitles by the hash of the video file
+RELEASE = "release"  # matches the name of the release of the video
+TV_SHOWS = "tv"  # only knows the episodes of TV shows
+ACCOUNT = "account"  # needs a login or a key in the config file
 
-# Don't want to be included
-#from Addic7ed import Addic7ed
-#from TvSubtitles import TvSubtitles
 
-# API not working
-#from Podnapisi2 import Podnapisi
+class PluginSpec(object):
 
-EXISTING_PLUGINS = [SubScene]
+    """ Description of a plugin, standing for its class until it is used.
+
+    The name, url and capabilities are known without importing the module
+    of the plugin (which pulls lxml, zipfile and friends), so the
+    plugins can be listed, configured and scheduled for free. The class is
+    imported the first time it is instantiated or one of its other
+    attributes is read, the spec is then a transparent proxy to it.
+    url must be the one of the class, it is the host of its requests.
+    """
+
+    def __init__(self, name, module, url, capabilities=(), default=False):
+        """ Init method with the class name and module of the plugin. """
+        self.name = self.__name__ = name
+        self.module = module
+        self.url = url
+        self.capabilities = frozenset(capabilities)
+        self.default = default
+        self._class = None
+
+    @property
+    def loaded(self):
+        """ True once the module of the plugin was imported. """
+        return self._class is not None
+
+    def load(self):
+        """ Import the module of the plugin and return its class. """
+        if self._class is None:
+            module = importlib.import_module("periscope.plugins." +
+                                             self.module)
+            self._class = getattr(module, self.name)
+        return self._class
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __getattr__(self, attribute):
+        if attribute.startswith("__"):
+            raise AttributeError(attribute)
+        return getattr(self.load(), attribute)
+
+    def __repr__(self):
+        return "PluginSpec({!r})".format(self.name)
+
+
+EXISTING_PLUGINS = [
+    # Not working anymore (download fails)
+    PluginSpec("SubScene", "SubScene", "http://subscene.com/", [RELEASE],
+               default=True),
+    # Disabled, they can be activated with activate_plugin()
+    PluginSpec("OpenSubtitles", "OpenSubtitles",
+               "http://www.opensubtitles.org/", [HASH, RELEASE]),
+    PluginSpec("TheSubDB", "TheSubDB", "http://thesubdb.com/", [HASH]),
+    PluginSpec("Podnapisi", "Podnapisi", "http://www.podnapisi.net/",
+               [RELEASE]),
+    PluginSpec("Subtitulos", "Subtitulos", "http://www.subtitulos.es",
+               [RELEASE, TV_SHOWS]),
+    PluginSpec("SubsWiki", "SubsWiki", "http://www.subswiki.com",
+               [RELEASE, TV_SHOWS]),
+    PluginSpec("SubDivX", "SubDivX", "http://www.subdivx.com", [RELEASE]),
+    PluginSpec("LegendasTV", "LegendasTV", "http://legendas.tv",
+               [RELEASE, ACCOUNT]),
+    # Requires a key in the config file
+    PluginSpec("SubtitleSource", "SubtitleSource",
+               "http://www.subtitlesource.org/", [RELEASE, ACCOUNT]),
+    # Don't want to be included
+    PluginSpec("Addic7ed", "Addic7ed", "http://www.addic7ed.com",
+               [RELEASE, TV_SHOWS]),
+    PluginSpec("TvSubtitles", "TvSubtitles", "http://www.tvsubtitles.net",
+               [RELEASE, TV_SHOWS]),
+    # API not working. Podnapisi2 has no spec: its class is named Podnapisi
+    # too
+]
+
+
+def get_plugin(name):
+    """ Return the spec of the plugin called name, None if there is none. """
+    for spec in EXISTING_PLUGINS:
+        if spec.name.lower() == name.lower():
+            return spec
+    return None
+
+
+def with_capability(capability):
+    """ Return the specs of the plugins that have a capability. """
+    return [spec for spec in EXISTING_PLUGINS
+            if capability in spec.capabilities]
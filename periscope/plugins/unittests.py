@@ -29,7 +29,7 @@ class TVShowRegexTestCase(unittest.TestCase):
         subdb = OpenSubtitles.OpenSubtitles()
         filenames = ('Futurama.S06E05.HDTV.XviD-aAF.avi', 'Parenthood.2010.S01E13.Lost.and.Found.HDTV.XviD-FQM.avi')
         for filename in filenames:
-            print "%s => %s" %(filename, subdb.guessFileData(filename))
+            print "%s => %s" %(filename, subdb.guess_file_data(filename))
 
 
 class RegexTestCase(unittest.TestCase):
@@ -40,7 +40,7 @@ class RegexTestCase(unittest.TestCase):
         #filenames = ('The.Hurt.Locker.2008.DVDRiP.XViD.CD1', 'Catwoman.CAM-NOX-CD2.avi','Marley & Me.2008-L33t-DvDRiP.DivX.NoRaR')
         filenames = ('Catwoman.CAM-NOX-CD2.avi', 'Funny People (2009) DVDRip XviD-MAXSPEED www.torentz.3xforum.ro')
         for filename in filenames:
-            print "%s => %s" %(filename, subdb.guessFileData(filename))
+            print "%s => %s" %(filename, subdb.guess_file_data(filename))
 
 class SubtitulosTestCase(unittest.TestCase):
     def runTest(self):
@@ -48,7 +48,7 @@ class SubtitulosTestCase(unittest.TestCase):
         subdb = Subtitulos.Subtitulos()
         fname = "CSI.S10E13.HDTV.XvID-FQM.avi"
         fname = "rubicon.s01e01.repack.hdtv.xvid-fqm.avi"
-        guessedData = subdb.guessFileData(fname)
+        guessedData = subdb.guess_file_data(fname)
         print fname
         print guessedData
         if guessedData['type'] == 'tvshow':
@@ -60,7 +60,7 @@ class Addic7edTestCase(unittest.TestCase):
         import Addic7ed
         subdb = Addic7ed.Addic7ed()
         fname = "The.Big.Bang.Theory.S03E13.HDTV.XviD-2HD"
-        guessedData = subdb.guessFileData(fname)
+        guessedData = subdb.guess_file_data(fname)
         print fname
         print guessedData
         if guessedData['type'] == 'tvshow':
@@ -73,7 +73,7 @@ class Addic7edTestCase(unittest.TestCase):
         subdb = Addic7ed.Addic7ed()
         #fname = "rubicon.s01e01.repack.hdtv.xvid-fqm.avi"
         fname = "24.1x03.2.00.am_3.00.am.ac3.dvdrip_ws_xvid-fov.avi"
-        guessedData = subdb.guessFileData(fname)
+        guessedData = subdb.guess_file_data(fname)
         print fname
         print guessedData
         if guessedData['type'] == 'tvshow':
@@ -216,7 +216,7 @@ class TvSubtitlesTestCase(unittest.TestCase):
         import TvSubtitles
         subdb = TvSubtitles.TvSubtitles()
         fname = "The.Big.Bang.Theory.S03E15.The.Large.Hadron.Collision.HDTV.XviD-FQM"
-        guessedData = subdb.guessFileData(fname)
+        guessedData = subdb.guess_file_data(fname)
         subs = subdb.query(guessedData['name'], guessedData['season'], guessedData['episode'], guessedData['teams'], ['en'])
         for s in subs:
             print "Sub : %s" %s
@@ -234,5 +234,95 @@ class BierDopjeTestCase(unittest.TestCase):
         assert len(results) > 0, "No result could be found for %s and no languages" %( video )
 '''
 
+class FingerprintTestCase(unittest.TestCase):
+    def runTest(self):
+        import tempfile
+        from periscope.fingerprint import compute_fingerprint
+        video = tempfile.NamedTemporaryFile(suffix=".avi")
+        video.write("\0" * 65536 * 2)
+        video.flush()
+        result = compute_fingerprint(video.name)
+        # Only the size is left when the content is all zeros
+        assert result["opensubtitles"] == "0000000000020000", result
+        assert result["thesubdb"] == "0dfbe8aa4c20b52e1b8bf3cb6cbdf193", result
+        # Hashes of the reference implementations, on sizes that are not a
+        # multiple of 8: the tail is not aligned, and overlaps the head in
+        # the smaller file
+        expected = {131077: ("cfc7c4c1bdc29860", "a0d7e444c8d82a3a8786575ac814ad5d"),
+                    69635: ("SizeError", "f2150fbe61aae462ca7e915f561af7e9")}
+        for size, hashes in expected.items():
+            video = tempfile.NamedTemporaryFile(suffix=".avi")
+            video.write(str(bytearray((i * 131 + 7) % 251 for i in xrange(size))))
+            video.flush()
+            result = compute_fingerprint(video.name)
+            assert (result["opensubtitles"], result["thesubdb"]) == hashes, result
+
+class ParserTestCase(unittest.TestCase):
+    def runTest(self):
+        from periscope.parser import parse, parse_many, TVSHOW, MOVIE
+        result = parse("/videos/The.Show.S01E02.720p.HDTV.x264-LOL.mkv")
+        assert result.type == TVSHOW, result
+        assert (result["name"], result["season"], result["episode"]) == ("the show", 1, 2), result
+        assert result["teams"] == ["720p", "hdtv", "x264-lol"], result
+        result = parse("Some.Movie.2009.DVDRip.XviD-GRP.avi")
+        assert (result.type, result.name, result.year) == (MOVIE, "some movie", "2009"), result
+        result = parse("Show.Name.2010.11.23.HDTV.XviD-GRP.avi")
+        assert (result.type, result.date) == (TVSHOW, "2010-11-23"), result
+        # The result of a name is kept for the next plugin
+        assert parse("The.Show.S01E02.720p.HDTV.x264-LOL.mkv") is parse("The.Show.S01E02.720p.HDTV.x264-LOL.mkv")
+        names = ["Show.2x03.avi", "home_video.avi", "Some.Movie.2009.avi"]
+        assert parse_many(names) == [parse(name) for name in names]
+
+class MarkupTestCase(unittest.TestCase):
+    def runTest(self):
+        from periscope.markup import extract
+        page = """<html><body><ul><li>menu</ul><table><tr><td class="title">Version LOL</td></tr>
+<tr><td class="language">English<td><strong>Completed</strong><td><a href="/1">a</a><a href="/2">b</a></td></tr>
+</table></body></html>"""
+        for backend in ("htmlparser", "lxml"):
+            tables = extract(page, "table", backend=backend)
+            assert len(tables) == 1 and extract(page, "li", backend=backend)[0].text == "menu"
+            title = tables[0].find("td", {"class": "title"})
+            assert title.string == "Version LOL" and title.parent.parent is tables[0]
+            status = title.findNext("td", {"class": "language"}).findNext("td")
+            assert status.find("strong").string == "Completed"
+            assert [link["href"] for link in status.findNext("td").findAll("a")] == ["/1", "/2"]
+
+class HTTPCacheTestCase(unittest.TestCase):
+    def runTest(self):
+        import shutil
+        import tempfile
+        from periscope.helper import Response
+        from periscope.httpcache import HTTPCache
+        folder = tempfile.mkdtemp()
+        try:
+            cache = HTTPCache(folder)
+            url = "http://www.tvsubtitles.net/tvshow-1-2.html"
+            assert cache.get(url) is None
+            cache.put(url, Response(url, 200, "OK", {"etag": '"v1"', "server": "x"}, "season page"))
+            page = HTTPCache(folder).get(url)
+            assert page.response().read() == "season page" and page.age() < 60
+            assert page.validators() == {"If-None-Match": '"v1"'}, page.validators()
+            # The entries older than max_age are removed
+            assert HTTPCache(folder, max_age=-1).get(url) is None
+        finally:
+            shutil.rmtree(folder)
+
+class TitleIndexTestCase(unittest.TestCase):
+    def runTest(self):
+        from periscope.titles import TitleIndex, normalize
+        assert normalize("The Office (2005)") == normalize("Office, The") == normalize("the office") == "office"
+        assert normalize("Law &amp; Order: SVU") == normalize("law and order svu")
+        loads = []
+        def load():
+            loads.append(1)
+            # The lookups during a load are answered from the index
+            assert index.get("24") == 38
+            return [("Office, The", 58), ("Grey's Anatomy", 3)]
+        index = TitleIndex(load=load, seed=[("24", 38)])
+        assert (index.get("the office"), index.get("greys anatomy"), index.get("24")) == (58, 3, 38)
+        # The list is only loaded again once stale
+        assert index.get("unknown") is None and len(loads) == 1
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+""" Timeouts and retries of the requests sent to the subtitle sites. """
+
+import time
+import random
+import socket
+import logging
+
+LOG = logging.getLogger(__name__)
+
+# Statuses meaning the server is overloaded or briefly unavailable
+RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+# Config file options of a plugin section and the matching attributes
+CONFIG_OPTIONS = (("connect-timeout", "connect_timeout"),
+                  ("read-timeout", "read_timeout"),
+                  ("request-deadline", "deadline"),
+                  ("retries", "retries"),
+                  ("retry-backoff", "backoff"))
+
+
+class DeadlineExceeded(socket.timeout):
+
+    """ Raised when the deadline of a request is over. """
+
+    def __str__(self):
+        return "Request deadline exceeded"
+
+
+class RequestPolicy(object):
+
+    """ How long to wait for a site and how to retry its failed requests.
+
+    connect_timeout and read_timeout bound each socket operation of an
+    attempt, deadline bounds the whole request with its retries and
+    redirections (None for no limit). A failed attempt is retried up to
+    retries times when the connection failed or the status is one of
+    retry_statuses, after an exponential backoff with jitter:
+    backoff * 2 ** attempt seconds, at most max_backoff, of which a random
+    part of jitter is removed so that the threads do not retry in step.
+
+    Policies are immutable, use replace() to derive one. Each plugin has
+    its own in its policy class attribute, which can be overridden in its
+    section of the config file:
+
+        [Addic7ed]
+        connect-timeout = 3
+        read-timeout = 10
+        request-deadline = 30
+        retries = 2
+        retry-backoff = 0.5
+    """
+
+    def __init__(self, connect_timeout=10.0, read_timeout=30.0,
+                 deadline=60.0, retries=2, backoff=0.5, max_backoff=8.0,
+                 jitter=0.5, retry_statuses=RETRY_STATUSES):
+        """ Init method with the settings, all the delays in seconds. """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def replace(self, **kwargs):
+        """ Return a copy of the policy with some settings changed. """
+        settings = dict(self.__dict__)
+        settings.update(kwargs)
+        return RequestPolicy(**settings)
+
+    def configured(self, config, section):
+        """ Return the policy with the options of section of config. """
+        changes = {}
+        for option, attribute in CONFIG_OPTIONS:
+            if not config.has_option(section, option):
+                continue
+            try:
+                value = config.getfloat(section, option)
+            except ValueError:
+                LOG.warn("Invalid value for {} in section {} of the config".
+                         format(option, section))
+                continue
+            changes[attribute] = int(value) if attribute == "retries" \
+                else value
+        return self.replace(**changes) if changes else self
+
+    def start(self):
+        """ Return the time at which a request starting now must end. """
+        if self.deadline is None:
+            return None
+        return time.time() + self.deadline
+
+    def timeouts(self, end=None):
+        """ Return the connect and read timeouts of an attempt.
+
+        They are shortened to what remains before end, the value returned
+        by start(). DeadlineExceeded is raised when nothing remains.
+        """
+        if end is None:
+            return self.connect_timeout, self.read_timeout
+        remaining = end - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return min(self.connect_timeout, remaining), \
+            min(self.read_timeout, remaining)
+
+    def retry_delay(self, attempt, end=None, status=None, retry_after=None):
+        """ Return the seconds to wait before retrying or None to give up.
+
+        attempt is the number of the failed attempt, from 0. status is the
+        HTTP status of the failure, None when the connection failed, and
+        retry_after the value of the Retry-After header of the response.
+        """
+        if attempt >= self.retries:
+            return None
+        if status is not None and status not in self.retry_statuses:
+            return None
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        delay *= 1 - self.jitter * random.random()
+        try:
+            delay = max(delay, min(self.max_backoff, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+        if end is not None and time.time() + delay >= end:
+            return None
+        return delay
+
+    def __repr__(self):
+        return "RequestPolicy({})".format(", ".join(
+            "{}={!r}".format(key, value)
+            for key, value in sorted(self.__dict__.iteritems())))
+
+
+DEFAULT_POLICY = RequestPolicy()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+""" Bounded pool of worker threads shared by every search of a run. """
+
+import logging
+import threading
+from collections import deque, OrderedDict
+from urlparse import urlparse
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 4
+DEFAULT_JOBS_PER_HOST = 2
+# Threads fetching the secondary pages of the searches, see page_pool
+PAGE_JOBS = 8
+PAGE_JOBS_PER_HOST = 4
+
+PENDING, RUNNING, CANCELLED, FINISHED = range(4)
+
+
+class CancelledError(Exception):
+
+    """ Raised when the result of a cancelled Future is asked. """
+
+
+class TimeoutError(Exception):
+
+    """ Raised when a Future is not done in the given time. """
+
+
+def plugin_host(plugin_class):
+    """ Return the host a plugin talks to, used to cap its concurrency. """
+    return urlparse(getattr(plugin_class, "url", "")).netloc or \
+        plugin_class.__name__
+
+
+class Future(object):
+
+    """ Result of a task that is run in the background.
+
+    Mimics the concurrent.futures API: the result can be waited for with
+    a timeout, callbacks are run when the task is done, and a task that has
+    not started yet can be cancelled.
+    """
+
+    def __init__(self):
+        """ Create a pending future. """
+        self._condition = threading.Condition()
+        self._state = PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def cancel(self):
+        """ Cancel the task if it did not start, return True on success. """
+        with self._condition:
+            if self._state == CANCELLED:
+                return True
+            if self._state != PENDING:
+                return False
+            self._state = CANCELLED
+            self._condition.notify_all()
+        self._run_callbacks()
+        return True
+
+    def cancelled(self):
+        """ Return True if the task was cancelled. """
+        return self._state == CANCELLED
+
+    def done(self):
+        """ Return True if the task was cancelled or is finished. """
+        return self._state in (CANCELLED, FINISHED)
+
+    def result(self, timeout=None):
+        """ Wait for the task and return its result or raise its error. """
+        with self._condition:
+            if not self.done():
+                self._condition.wait(timeout)
+            if self._state == CANCELLED:
+                raise CancelledError()
+            if self._state != FINISHED:
+                raise TimeoutError()
+            if self._exception is not None:
+                raise self._exception
+            return self._result
+
+    def add_done_callback(self, callback):
+        """ Call callback(future) once done, right away if it already is. """
+        with self._condition:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_running(self):
+        """ Mark the task as started, return False if it was cancelled. """
+        with self._condition:
+            if self._state == CANCELLED:
+                return False
+            self._state = RUNNING
+            return True
+
+    def set_result(self, result):
+        """ Finish the task with a result, return False if already done. """
+        return self._finish(result, None)
+
+    def set_exception(self, exception):
+        """ Finish the task with an error, return False if already done. """
+        return self._finish(None, exception)
+
+    def _finish(self, result, exception):
+        """ Store the outcome and wake up the waiters. """
+        with self._condition:
+            if self.done():
+                return False
+            self._result = result
+            self._exception = exception
+            self._state = FINISHED
+            self._condition.notify_all()
+        self._run_callbacks()
+        return True
+
+    def _run_callbacks(self):
+        """ Call the registered callbacks. """
+        with self._condition:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                LOG.exception("Callback {} failed".format(callback))
+
+
+class WorkerPool(object):
+
+    """ Run tasks on a fixed number of threads with a cap for each host.
+
+    Tasks are queued per host and picked round-robin among the hosts that
+    are below their cap, so a slow site never holds more than
+    jobs_per_host workers while the other sites keep the rest busy.
+    """
+
+    def __init__(self, jobs=DEFAULT_JOBS, jobs_per_host=DEFAULT_JOBS_PER_HOST):
+        """ Start jobs worker threads. """
+        self.jobs = max(1, jobs)
+        self.jobs_per_host = max(1, jobs_per_host)
+        self._condition = threading.Condition()
+        self._pending = OrderedDict()
+        self._running = {}
+        self._unfinished = 0
+        self._closed = False
+        self._threads = []
+        for i in range(self.jobs):
+            thread = threading.Thread(target=self._work,
+                                      name="periscope-worker-{}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, host, func, *args, **kwargs):
+        """ Queue func(*args, **kwargs) to be run against host.
+
+        Return a Future of the result of the call.
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot submit a task to a closed pool")
+            self._pending.setdefault(host, deque()).append(
+                (future, func, args, kwargs))
+            self._unfinished += 1
+            self._condition.notify()
+        return future
+
+    def join(self):
+        """ Block until every submitted task, even nested ones, is done. """
+        with self._condition:
+            while self._unfinished:
+                # A timeout keeps the main thread responsive to ctrl+c
+                self._condition.wait(0.5)
+
+    def close(self):
+        """ Stop the workers once the queued tasks are done. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.join()
+        self.close()
+
+    def _next_task(self):
+        """ Pop a task whose host is below its cap. Lock must be held. """
+        for host, tasks in self._pending.items():
+            if self._running.get(host, 0) < self.jobs_per_host:
+                task = tasks.popleft()
+                # Move the host to the end of the queue for round-robin
+                del self._pending[host]
+                if tasks:
+                    self._pending[host] = tasks
+                self._running[host] = self._running.get(host, 0) + 1
+                return host, task
+        return None, None
+
+    def _work(self):
+        """ Worker loop. """
+        while True:
+            with self._condition:
+                host, task = self._next_task()
+                while task is None:
+                    if self._closed and not self._unfinished:
+                        return
+                    self._condition.wait()
+                    host, task = self._next_task()
+            future, func, args, kwargs = task
+            try:
+                if future.set_running():
+                    future.set_result(func(*args, **kwargs))
+            except Exception, err:
+                LOG.exception("Task {} on {} failed".format(func, host))
+                future.set_exception(err)
+            finally:
+                with self._condition:
+                    self._running[host] -= 1
+                    self._unfinished -= 1
+                    self._condition.notify_all()
+
+
+_PAGE_POOL = None
+_PAGE_POOL_LOCK = threading.Lock()
+
+
+def page_pool():
+    """ Return the pool fetching the pages a search reads after the first.
+
+    It is apart from the pools running the searches: a search waiting for
+    its pages holds a worker, and would otherwise wait for itself. It is
+    shared by the plugins so a site never gets more than
+    PAGE_JOBS_PER_HOST of these requests at once.
+    """
+    global _PAGE_POOL
+    with _PAGE_POOL_LOCK:
+        if _PAGE_POOL is None:
+            _PAGE_POOL = WorkerPool(PAGE_JOBS, PAGE_JOBS_PER_HOST)
+        return _PAGE_POOL
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+""" Rank the subtitles found by all the plugins for a video. """
+
+import re
+import logging
+
+LOG = logging.getLogger(__name__)
+
+# Score of a subtitle found by the hash of the video, made for this very file
+HASH_MATCH_SCORE = 100
+# Score of each release token (group, source, resolution...) shared with
+# the name of the video
+TEAM_SCORE = 10
+# Score of a site that never fails, scaled by its recent success rate
+RELIABILITY_SCORE = 20
+# Score of each point of the rating given by the site, up to MAX_RATING
+RATING_SCORE = 1
+MAX_RATING = 10
+
+TOKEN_SEPARATORS = re.compile(r"[^a-z0-9]+")
+SUBTITLE_EXTENSIONS = re.compile(r"\.(srt|sub|txt|zip|rar)$")
+
+
+def release_tokens(release):
+    """ Return the set of lower case tokens of a release name. """
+    if not release:
+        return frozenset()
+    release = SUBTITLE_EXTENSIONS.sub("", release.lower())
+    return frozenset(token for token in TOKEN_SEPARATORS.split(release)
+                     if token)
+
+
+def video_tokens(subtitles):
+    """ Return the release tokens of the video the subtitles are for.
+
+    They come from the teams guessed by the plugin that found the first
+    subtitle, so they are computed once for all the candidates.
+    """
+    for subtitle in subtitles:
+        plugin = subtitle.get("plugin")
+        filename = subtitle.get("filename")
+        if plugin is None or not filename:
+            continue
+        try:
+            teams = plugin.guess_file_data(filename).get("teams") or []
+        except Exception:
+            LOG.debug("Could not guess the teams of {}".format(filename))
+            return frozenset()
+        return release_tokens(".".join(teams))
+    return frozenset()
+
+
+def score_subtitle(subtitle, teams, reliability=None):
+    """ Return the score of a subtitle, higher is better.
+
+    teams are the tokens of the video (see video_tokens), reliability the
+    recent success rate of the site of the subtitle, from 0 to 1.
+    """
+    score = 0.0
+    if subtitle.get("hash_match"):
+        score += HASH_MATCH_SCORE
+    score += TEAM_SCORE * len(teams & release_tokens(subtitle.get("release")))
+    if reliability is not None:
+        score += RELIABILITY_SCORE * reliability
+    try:
+        rating = float(subtitle.get("rating") or 0)
+    except (TypeError, ValueError):
+        rating = 0
+    score += RATING_SCORE * max(0, min(MAX_RATING, rating))
+    return score
+
+
+def rank_subtitles(subtitles, langs=None, reliability=None):
+    """ Return the subtitles in langs, the best first, without duplicates.
+
+    The subtitles are ordered by wanted language, then by score. A release
+    offered by several sites in the same language is only kept from the
+    site where it scores best, with all its uploads there. reliability is
+    a function returning the success rate of the site of a plugin name, or
+    None if unknown.
+    """
+    teams = video_tokens(subtitles)
+    ranked = []
+    for index, subtitle in enumerate(subtitles):
+        if langs and subtitle.get("lang") not in langs:
+            continue
+        plugin = subtitle.get("plugin")
+        rate = None
+        if reliability is not None and plugin is not None:
+            rate = reliability(type(plugin).__name__)
+        score = score_subtitle(subtitle, teams, rate)
+        lang_rank = langs.index(subtitle["lang"]) if langs else 0
+        # The index keeps the order of the sites for equal scores
+        ranked.append((lang_rank, -score, index, subtitle))
+    ranked.sort(key=lambda item: item[:3])
+    # The site that kept each release, its other uploads of the release
+    # stay as fallbacks for the download
+    subtitles, kept = [], {}
+    for _, score, _, subtitle in ranked:
+        tokens = release_tokens(subtitle.get("release"))
+        key = (subtitle.get("lang"),
+               tokens or subtitle.get("link") or id(subtitle))
+        site = type(subtitle.get("plugin")).__name__
+        if kept.setdefault(key, site) != site:
+            LOG.debug("Dropping {} from {}, already found elsewhere".format(
+                subtitle.get("release"), subtitle.get("plugin")))
+            continue
+        LOG.debug("Score {:.1f} for {} from {}".format(
+            -score, subtitle.get("release"), subtitle.get("plugin")))
+        subtitles.append(subtitle)
+    return subtitles
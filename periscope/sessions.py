@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+""" Session tokens and cookies kept in the cache folder between runs. """
+
+import os
+import json
+import time
+import logging
+import threading
+import cookielib
+
+LOG = logging.getLogger(__name__)
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+_JARS = {}
+
+
+class SessionStore(object):
+
+    """ Key/value store of session tokens with an expiry date.
+
+    The values are saved as JSON in the given file so the next runs can
+    reuse them instead of logging in again. With no path the store only
+    lives in memory.
+    """
+
+    def __init__(self, path=None):
+        """ Load the sessions saved in path. """
+        self.path = path
+        self._lock = threading.Lock()
+        self._sessions = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as session_file:
+                    self._sessions = json.load(session_file)
+            except (IOError, ValueError):
+                LOG.warn("Could not read the sessions from {}".format(path))
+
+    def get(self, name):
+        """ Return the value saved for name or None if it expired. """
+        with self._lock:
+            session = self._sessions.get(name)
+            if session and session["expires"] > time.time():
+                return session["value"]
+            return None
+
+    def set(self, name, value, ttl):
+        """ Save value for name, valid for ttl seconds. """
+        with self._lock:
+            self._sessions[name] = {"value": value,
+                                    "expires": time.time() + ttl}
+            self._save()
+
+    def touch(self, name, ttl):
+        """ Push back the expiry of a session that has just been used. """
+        with self._lock:
+            if name in self._sessions:
+                self._sessions[name]["expires"] = time.time() + ttl
+                self._save()
+
+    def delete(self, name):
+        """ Forget the session saved for name. """
+        with self._lock:
+            if self._sessions.pop(name, None) is not None:
+                self._save()
+
+    def _save(self):
+        """ Write the sessions to disk. Lock must be held. """
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as session_file:
+                json.dump(self._sessions, session_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            LOG.warn("Could not save the sessions to {}".format(self.path))
+
+
+def get_session_store(cache_path):
+    """ Return the session store of a cache folder, shared in the process. """
+    with _STORES_LOCK:
+        if cache_path not in _STORES:
+            path = os.path.join(cache_path, "sessions") if cache_path else None
+            _STORES[cache_path] = SessionStore(path)
+        return _STORES[cache_path]
+
+
+def load_cookie_jar(cache_path, name):
+    """ Return the cookie jar of name, shared in the process.
+
+    It is loaded from the cache folder the first time, so all the plugin
+    instances see the cookies of the one that logged in. The cookies that
+    only last for the browser session are not loaded: they belong to a
+    session of a previous run.
+    """
+    with _STORES_LOCK:
+        if (cache_path, name) in _JARS:
+            return _JARS[cache_path, name]
+        if not cache_path:
+            cookie_jar = cookielib.MozillaCookieJar()
+        else:
+            cookie_jar = cookielib.MozillaCookieJar(
+                os.path.join(cache_path, "{}.cookies".format(name)))
+            if os.path.exists(cookie_jar.filename):
+                try:
+                    cookie_jar.load()
+                except (IOError, cookielib.LoadError):
+                    LOG.warn("Could not read the cookies from {}".
+                             format(cookie_jar.filename))
+        _JARS[cache_path, name] = cookie_jar
+        return cookie_jar
+
+
+def cookie_expiry(cookie_jar, host):
+    """ Return when the last cookie of host in cookie_jar expires.
+
+    A cookie without expiry lasts as long as the process, float("inf") is
+    returned for it. None is returned when host has no valid cookie.
+    """
+    now = time.time()
+    expiry = None
+    for cookie in cookie_jar:
+        if not host.endswith(cookie.domain.lstrip(".")) or \
+                cookie.is_expired(now):
+            continue
+        expires = cookie.expires if cookie.expires else float("inf")
+        expiry = max(expiry, expires)
+    return expiry
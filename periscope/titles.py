@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+""" Index of the show titles of each site, kept in the cache folder. """
+
+from __future__ import absolute_import
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+import unicodedata
+from HTMLParser import HTMLParser
+
+LOG = logging.getLogger(__name__)
+
+# Seconds between two loads of the show list of a site
+REFRESH = 7 * 24 * 60 * 60
+# Seconds before a title missing from the index loads the list again, for
+# the shows added to the site since
+MISS_REFRESH = 24 * 60 * 60
+
+ARTICLES = ("the", "a", "an", "o", "os", "as", "el", "la", "los", "las",
+            "le", "les")
+LEADING_ARTICLE = re.compile(r"^(?:{}) ".format("|".join(ARTICLES)))
+# "Office, The" as the sites sort their lists
+TRAILING_ARTICLE = re.compile(r", *(?:{})$".format("|".join(ARTICLES)))
+YEAR_SUFFIX = re.compile(r"(?<=\S) *[(\[]?(?:19|20)[0-9]{2}[)\]]?$")
+APOSTROPHES = re.compile(u"['’`]")
+PUNCTUATION = re.compile(r"[\W_]+", re.UNICODE)
+
+_UNESCAPE = HTMLParser().unescape
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def normalize(title):
+    """ Return the key of a show title in the indexes.
+
+    The entities, accents, case, punctuation and apostrophes, a year at the
+    end and a leading article (or a trailing one after a comma) are left
+    out, and & is read as "and". "The Office (2005)", "Office, The" and
+    the office parsed from a file name all give "office".
+    """
+    if isinstance(title, str):
+        title = title.decode("utf-8", "replace")
+    title = _UNESCAPE(title)
+    title = unicodedata.normalize("NFKD", title)
+    title = u"".join(char for char in title if not unicodedata.combining(char))
+    title = YEAR_SUFFIX.sub(u"", title.lower().strip())
+    title = TRAILING_ARTICLE.sub(u"", title).replace(u"&", u" and ")
+    title = PUNCTUATION.sub(u" ", APOSTROPHES.sub(u"", title))
+    title = u" ".join(title.split())
+    return LEADING_ARTICLE.sub(u"", title) or title
+
+
+class TitleIndex(object):
+
+    """ Ids of the shows of a site by the normalized key of their titles.
+
+    The index is loaded from the site with load, a function returning the
+    (title, site id) of every show it lists, then saved as JSON in path.
+    A lookup costs a dict access: the list is only loaded again once
+    REFRESH seconds old, or MISS_REFRESH seconds old when a title is not
+    found. The (title, id) pairs of seed are known even if the list
+    cannot be loaded. While a thread loads the list, the lookups of the
+    others are answered from the titles already indexed.
+    """
+
+    def __init__(self, path=None, load=None, seed=(), refresh=REFRESH):
+        """ Load the index saved in path. """
+        self.path = path
+        self.load = load
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._ids = dict((normalize(title), site_id)
+                         for title, site_id in seed)
+        # Time of the last load of the list, failed or not
+        self._checked = 0
+        self._reloading = False
+        if path and os.path.exists(path):
+            try:
+                with open(path) as index_file:
+                    saved = json.load(index_file)
+                self._ids.update(saved["ids"])
+                self._checked = saved["checked"]
+            except (IOError, ValueError, KeyError):
+                LOG.warn("Could not read the titles from {}".format(path))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, title):
+        """ Return the site id of a show title, None if it is unknown. """
+        key = normalize(title)
+        with self._lock:
+            age = time.time() - self._checked
+            stale = self.load is not None and not self._reloading and (
+                age > self.refresh or
+                (key not in self._ids and age > MISS_REFRESH))
+            if not stale:
+                return self._ids.get(key)
+            self._reloading = True
+        self._reload()
+        with self._lock:
+            return self._ids.get(key)
+
+    def _reload(self):
+        """ Load the show list of the site, without holding the lock. """
+        ids = {}
+        try:
+            for title, site_id in self.load():
+                ids[normalize(title)] = site_id
+        except Exception, err:
+            LOG.warn("Could not load the show list for {}: {}".
+                     format(self.path, err))
+        if ids:
+            LOG.info("Indexed {} show titles for {}".format(len(ids),
+                                                            self.path))
+        with self._lock:
+            self._ids.update(ids)
+            self._checked = time.time()
+            self._reloading = False
+            self._save()
+
+    def _save(self):
+        """ Write the index to disk. Lock must be held. """
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as index_file:
+                json.dump({"checked": self._checked, "ids": self._ids},
+                          index_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            LOG.warn("Could not save the titles to {}".format(self.path))
+
+
+def get_title_index(cache_path, name, load=None, seed=()):
+    """ Return the title index of the site name, shared in the process.
+
+    It is saved in the cache folder, load and seed are those of the
+    TitleIndex created by the first call.
+    """
+    with _INDEXES_LOCK:
+        if (cache_path, name) not in _INDEXES:
+            path = os.path.join(cache_path, "{}.titles".format(name)) \
+                if cache_path else None
+            _INDEXES[cache_path, name] = TitleIndex(path, load, seed)
+        return _INDEXES[cache_path, name]
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+""" Walk the video libraries to find the files that need a subtitle. """
+
+from __future__ import absolute_import
+
+import os
+import re
+import logging
+import fnmatch
+import mimetypes
+from collections import deque
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+from periscope.periscope import SUPPORTED_FORMATS
+
+LOG = logging.getLogger(__name__)
+
+SUBTITLE_EXTENSIONS = (".srt", ".sub")
+
+
+def _video_extensions():
+    """ Return the extensions of the SUPPORTED_FORMATS mimetypes. """
+    mimetypes.add_type("video/x-matroska", ".mkv")
+    extensions = set()
+    for mimetype in SUPPORTED_FORMATS:
+        extensions.update(ext.lower() for ext in
+                          mimetypes.guess_all_extensions(mimetype))
+    return frozenset(extensions)
+
+VIDEO_EXTENSIONS = _video_extensions()
+
+
+class _Entry(object):
+
+    """ Directory entry built from os.listdir when scandir is missing. """
+
+    def __init__(self, folder, name):
+        self.name = name
+        self.path = os.path.join(folder, name)
+
+    def is_dir(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isdir(self.path)
+
+    def is_file(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isfile(self.path)
+
+
+def list_dir(folder):
+    """ Return the entries of a folder, with scandir when it is installed.
+    """
+    if scandir is not None:
+        return list(scandir(folder))
+    return [_Entry(folder, name) for name in os.listdir(folder)]
+
+
+def is_video(filename):
+    """ Return True if the file name has the extension of a video. """
+    return os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS
+
+
+class LibraryWalker(object):
+
+    """ Iterate over the videos of some files and folders lazily.
+
+    The folders are walked iteratively, each one is listed once and the
+    listing is reused to check whether a video already has a .srt or .sub
+    file next to it, so a file costs no extra system call. Hidden folders
+    and the paths matching one of the exclude glob patterns (tried against
+    the name and the full path) are skipped. Videos are yielded as soon as
+    their folder is listed, so they can be processed while the walk goes
+    on. found and skipped count the videos yielded and the ones skipped
+    because they already have a subtitle, unchanged the ones refused by
+    the is_due callable.
+    """
+
+    def __init__(self, roots, force=False, exclude=None,
+                 follow_links=False, is_due=None):
+        """ Init method with the files and folders to walk.
+
+        With force, the videos that already have a subtitle are yielded too.
+        is_due is called with the path of each video that needs a subtitle,
+        the ones for which it returns False are skipped.
+        """
+        if isinstance(roots, basestring):
+            roots = [roots]
+        self.roots = roots
+        self.force = force
+        self.follow_links = follow_links
+        self.is_due = is_due
+        patterns = [fnmatch.translate(pattern) for pattern in exclude or []]
+        self._exclude = re.compile("|".join(patterns)) if patterns else None
+        self.found = 0
+        self.skipped = 0
+        self.unchanged = 0
+
+    def is_excluded(self, name, path):
+        """ Return True if a file or folder must not be walked. """
+        return self._exclude is not None and bool(
+            self._exclude.match(name) or self._exclude.match(path))
+
+    def __iter__(self):
+        """ Yield the path of each video that needs a subtitle. """
+        for root in self.roots:
+            if os.path.isdir(root):
+                for video in self._walk(root):
+                    yield video
+            elif os.path.isfile(root):
+                folder, name = os.path.split(root)
+                if not is_video(name):
+                    LOG.warn("{} is not a supported video format ({})".
+                             format(root, ", ".join(SUPPORTED_FORMATS)))
+                    continue
+                base = os.path.splitext(root)[0]
+                if self._keep(root, any(os.path.exists(base + extension)
+                                        for extension in
+                                        SUBTITLE_EXTENSIONS)):
+                    yield os.path.normpath(root)
+            else:
+                LOG.warn("No such file or folder: {}".format(root))
+
+    def _walk(self, root):
+        """ Yield the videos under root, folder by folder. """
+        folders = deque([root])
+        while folders:
+            folder = folders.popleft()
+            try:
+                entries = list_dir(folder)
+            except OSError, err:
+                LOG.warn("Could not list {}: {}".format(folder, err))
+                continue
+            names = set(entry.name for entry in entries)
+            for entry in entries:
+                if self.is_excluded(entry.name, entry.path):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=self.follow_links):
+                        if not entry.name.startswith("."):
+                            folders.append(entry.path)
+                        continue
+                    if not is_video(entry.name) or not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                base = os.path.splitext(entry.name)[0]
+                if self._keep(entry.path, any(base + extension in names
+                                              for extension in
+                                              SUBTITLE_EXTENSIONS)):
+                    yield os.path.normpath(entry.path)
+
+    def _keep(self, path, has_subtitle):
+        """ Count a video and return True if it must be yielded. """
+        if has_subtitle and not self.force:
+            LOG.debug("Skipping file {} as it already has a subtitle. Use "
+                      "the --force option to force the download".format(path))
+            self.skipped += 1
+            return False
+        if self.is_due is not None and not self.is_due(path):
+            self.unchanged += 1
+            return False
+        self.found += 1
+        return True
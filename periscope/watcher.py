@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+""" Watch the video libraries and report the new videos once complete. """
+
+from __future__ import absolute_import
+
+import os
+import time
+import logging
+import threading
+from Queue import Queue, Empty, Full
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from periscope.walker import LibraryWalker, is_video
+
+LOG = logging.getLogger(__name__)
+
+# Maximum number of complete videos waiting to be processed
+QUEUE_SIZE = 100
+# Seconds the size of a new file must not change before it is complete
+STABLE_DELAY = 5
+# Seconds between two walks of the libraries when inotify is missing
+POLL_INTERVAL = 60
+# Seconds between two checks of the files being written
+SETTLE_INTERVAL = 1
+
+
+class LibraryWatcher(object):
+
+    """ Iterate over the videos added to some folders, as they land.
+
+    With pyinotify, the folders are watched for files closed after being
+    written or moved in. Without it, they are walked every poll_interval
+    seconds and the new videos are picked from the walk. Either way a file
+    is only complete once its size did not change for stable_delay seconds
+    (and, with inotify, once it was closed), so a video still being copied
+    is never searched.
+
+    The complete videos go through a queue of queue_size entries: when the
+    downloads lag behind, the watcher waits instead of piling up paths.
+    Iterating over the watcher blocks until stop() is called, which makes
+    it suitable as the videos of Periscope.download_many.
+    """
+
+    def __init__(self, roots, force=False, exclude=None,
+                 queue_size=QUEUE_SIZE, stable_delay=STABLE_DELAY,
+                 poll_interval=POLL_INTERVAL, use_inotify=True):
+        """ Init method with the folders to watch, see LibraryWalker. """
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.force = force
+        self.stable_delay = stable_delay
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and pyinotify is not None
+        self.queue = Queue(queue_size)
+        self._walker = LibraryWalker(self.roots, force=True, exclude=exclude)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        # Path of the files being written -> [size, last change, closed]
+        self._pending = {}
+        self._threads = []
+        self._notifier = None
+
+    def start(self):
+        """ Start watching the folders in background threads. """
+        if self.use_inotify:
+            self._start_inotify()
+        else:
+            LOG.info("pyinotify is not installed, polling the libraries "
+                     "every {}s".format(self.poll_interval))
+            self._start_thread(self._poll)
+        self._start_thread(self._settle)
+
+    def stop(self):
+        """ Stop watching, the iteration ends once the queue is empty. """
+        self._stopped.set()
+        if self._notifier is not None:
+            self._notifier.stop()
+
+    def __iter__(self):
+        """ Yield the complete new videos until the watcher is stopped. """
+        while not (self._stopped.is_set() and self.queue.empty()):
+            try:
+                # A timeout keeps the main thread responsive to ctrl+c
+                yield self.queue.get(True, 0.5)
+            except Empty:
+                pass
+
+    def add(self, path, closed=False):
+        """ Report a file written or moved in one of the folders. """
+        folder, name = os.path.split(path)
+        if not is_video(name) or self._ignored(folder, name, path):
+            return
+        with self._lock:
+            pending = self._pending.get(path)
+            if pending is None:
+                LOG.debug("New file {}".format(path))
+                self._pending[path] = [None, time.time(), closed]
+            elif closed:
+                pending[2] = True
+
+    def _ignored(self, folder, name, path):
+        """ Return True if the file is excluded or in a hidden folder. """
+        if self._walker.is_excluded(name, path):
+            return True
+        for root in self.roots:
+            if path.startswith(root + os.sep):
+                relative = os.path.relpath(folder, root)
+                return any(part.startswith(".")
+                           for part in relative.split(os.sep)
+                           if part != os.curdir)
+        return False
+
+    def _start_thread(self, target):
+        """ Run target in a daemon thread. """
+        thread = threading.Thread(target=target,
+                                  name="periscope-watcher-" + target.__name__)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def _start_inotify(self):
+        """ Watch the folders, and the ones created later, with inotify. """
+        watcher = self
+
+        class Handler(pyinotify.ProcessEvent):
+
+            """ Report the files closed after writing or moved in. """
+
+            def process_IN_CLOSE_WRITE(self, event):
+                watcher.add(event.pathname, closed=True)
+
+            def process_IN_MOVED_TO(self, event):
+                if not event.dir:
+                    watcher.add(event.pathname, closed=True)
+                    return
+                # The videos of a folder moved in do not have any event
+                for video in LibraryWalker([event.pathname], force=True):
+                    watcher.add(video, closed=True)
+
+        manager = pyinotify.WatchManager()
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+            pyinotify.IN_CREATE
+        for root in self.roots:
+            manager.add_watch(root, mask, rec=True, auto_add=True)
+        self._notifier = pyinotify.ThreadedNotifier(manager, Handler())
+        self._notifier.daemon = True
+        self._notifier.start()
+
+    def _poll(self):
+        """ Walk the folders regularly and report the new videos. """
+        known = set(self._walker)
+        while not self._stopped.wait(self.poll_interval):
+            current = set(self._walker)
+            for path in current - known:
+                self.add(path, closed=True)
+            known = current
+
+    def _settle(self):
+        """ Queue the files whose size is stable. """
+        while not self._stopped.wait(SETTLE_INTERVAL):
+            now = time.time()
+            complete = []
+            with self._lock:
+                for path, pending in self._pending.items():
+                    try:
+                        size = os.path.getsize(path)
+                    except OSError:
+                        del self._pending[path]
+                        continue
+                    if size != pending[0]:
+                        pending[0], pending[1] = size, now
+                    elif pending[2] and now - pending[1] >= self.stable_delay:
+                        del self._pending[path]
+                        complete.append(path)
+            for path in complete:
+                for video in LibraryWalker([path], force=self.force):
+                    LOG.info("{} is complete, searching its subtitles".
+                             format(video))
+                    # Blocks while the downloads lag behind
+                    while not self._stopped.is_set():
+                        try:
+                            self.queue.put(video, True, 0.5)
+                            break
+                        except Full:
+                            pass
@@ -12,5 +12,5 @@ setup(name = PACKAGE, version = version.VERSION,
       packages= [ "periscope", "periscope/plugins" ],
       py_modules=["periscope"],
       scripts = [ "bin/periscope" ],
-      install_requires = ["BeautifulSoup >= 3.2.0"]
+      extras_require = {"scandir": ["scandir"], "lxml": ["lxml"]}
       )